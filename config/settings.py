@@ -6,6 +6,8 @@ import os
 from pathlib import Path
 from decouple import config
 
+from .database import parse_database_url
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # -------------------------------------
@@ -71,12 +73,32 @@ WSGI_APPLICATION = "config.wsgi.application"
 # -------------------------------------
 # 🗄️ Banco de dados
 # -------------------------------------
+# DATABASE_URL escolhe o banco (postgres://... em produção); sem ela, o SQLite
+# local do repositório, sem WAL: o modo WAL fica gravado no arquivo versionado
+DATABASE_URL = config("DATABASE_URL", default="")
+# Conexões persistentes: segundos que cada conexão fica aberta (0 = fecha a cada requisição)
+DB_CONN_MAX_AGE = config("DB_CONN_MAX_AGE", default=60, cast=int)
+DB_CONN_HEALTH_CHECKS = config("DB_CONN_HEALTH_CHECKS", default=True, cast=bool)
+
 DATABASES = {
+    "default": parse_database_url(
+        DATABASE_URL or f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+        sqlite_wal=bool(DATABASE_URL),
+    )
+}
+
+# Cache compartilhado entre processos (estatísticas das provas).
+# A tabela é criada com `python manage.py createcachetable`.
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "django_cache",
     }
 }
+# Validade das estatísticas em cache, em segundos (também invalidadas por sinais)
+STATISTICS_CACHE_TIMEOUT = config("STATISTICS_CACHE_TIMEOUT", default=3600, cast=int)
 
 # -------------------------------------
 # ☁️ Cloudflare R2 Storage
@@ -126,6 +148,13 @@ STORAGES = {
     },
 }
 
+# Mídia em disco local em vez do R2 (testes de carga e desenvolvimento sem credenciais)
+LOCAL_MEDIA_ROOT = config("LOCAL_MEDIA_ROOT", default="")
+if LOCAL_MEDIA_ROOT:
+    MEDIA_URL = "/media/"
+    MEDIA_ROOT = LOCAL_MEDIA_ROOT
+    STORAGES["default"] = {"BACKEND": "django.core.files.storage.FileSystemStorage"}
+
 # -------------------------------------
 # 🔐 Validação de senha
 # -------------------------------------
@@ -156,4 +185,70 @@ REST_FRAMEWORK = {
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
 }
 
+# Logs do app no console. Em INFO saem o tempo e os bytes economizados em
+# cada etapa do pré-processamento das imagens enviadas
+EXAMS_LOG_LEVEL = config("EXAMS_LOG_LEVEL", default="INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {"format": "{levelname} {name}: {message}", "style": "{"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "simple"},
+    },
+    "loggers": {
+        "exams": {"handlers": ["console"], "level": EXAMS_LOG_LEVEL, "propagate": False},
+    },
+}
+
 OPENAI_API_KEY = config("OPENAI_API_KEY", default="")
+OPENAI_MODEL = config("OPENAI_MODEL", default="gpt-4o")
+# Permite apontar para um servidor compatível (ex.: stub local em testes)
+OPENAI_BASE_URL = config("OPENAI_BASE_URL", default=None)
+
+# Chamadas ao LLM: concorrência, limite de requisições e novas tentativas
+LLM_MAX_CONCURRENCY = config("LLM_MAX_CONCURRENCY", default=8, cast=int)
+LLM_RATE_LIMIT = config("LLM_RATE_LIMIT", default=5.0, cast=float)  # requisições por segundo
+LLM_RATE_BURST = config("LLM_RATE_BURST", default=10, cast=int)
+LLM_TIMEOUT = config("LLM_TIMEOUT", default=60.0, cast=float)  # segundos por chamada
+LLM_MAX_RETRIES = config("LLM_MAX_RETRIES", default=5, cast=int)
+LLM_BACKOFF_BASE = config("LLM_BACKOFF_BASE", default=1.0, cast=float)
+LLM_BACKOFF_MAX = config("LLM_BACKOFF_MAX", default=30.0, cast=float)
+# Páginas de um lote enviadas juntas ao LLM
+LLM_BATCH_SIZE = config("LLM_BATCH_SIZE", default=32, cast=int)
+
+# Cache de reconhecimento: reenvios do mesmo arquivo não são lidos de novo
+RECOGNITION_CACHE_ENABLED = config("RECOGNITION_CACHE_ENABLED", default=True, cast=bool)
+RECOGNITION_CACHE_MAX_ENTRIES = config("RECOGNITION_CACHE_MAX_ENTRIES", default=10000, cast=int)
+
+# Leitura dos gabaritos: "local_omr" (padrão) ou "llm"
+ANSWER_SHEET_RECOGNITION_BACKEND = config("ANSWER_SHEET_RECOGNITION_BACKEND", default="local_omr")
+# Abaixo desta confiança a leitura local é refeita pelo LLM (se habilitado)
+OMR_MIN_CONFIDENCE = config("OMR_MIN_CONFIDENCE", default=0.9, cast=float)
+OMR_LLM_FALLBACK = config("OMR_LLM_FALLBACK", default=bool(OPENAI_API_KEY), cast=bool)
+# Resolução usada ao converter PDFs digitalizados em imagem e ao reduzir fotos JPEG
+OMR_RASTER_DPI = config("OMR_RASTER_DPI", default=200, cast=int)
+# Páginas convertidas em paralelo no envio em lote
+OMR_PAGE_WORKERS = config("OMR_PAGE_WORKERS", default=2, cast=int)
+# Resolução das imagens enviadas ao LLM (recortadas na moldura, em tons de cinza)
+LLM_IMAGE_DPI = config("LLM_IMAGE_DPI", default=150, cast=int)
+
+# Gabaritos por PDF gerado na própria requisição. O ReportLab mantém todas
+# as páginas em memória até o fim (cerca de 57 MB de pico com 1.000 gabaritos);
+# acima disso use async=true, que gera o PDF na fila de tarefas
+PDF_SYNC_MAX_SHEETS = config("PDF_SYNC_MAX_SHEETS", default=1000, cast=int)
+
+# PDFs maiores que este limite (em bytes) são gravados em arquivo temporário
+PDF_SPOOL_MAX_MEMORY = config("PDF_SPOOL_MAX_MEMORY", default=5 * 1024 * 1024, cast=int)
+# O mesmo para as planilhas de resultados
+EXPORT_SPOOL_MAX_MEMORY = config("EXPORT_SPOOL_MAX_MEMORY", default=5 * 1024 * 1024, cast=int)
+
+# Fila de tarefas: segundos sem sinal do trabalhador até a tarefa ser
+# considerada abandonada, e tentativas antes de marcá-la como falha
+JOB_LEASE_TIMEOUT = config("JOB_LEASE_TIMEOUT", default=300, cast=int)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=3, cast=int)
+
+# Renderização paralela dos gabaritos (1 = desativada)
+PDF_RENDER_WORKERS = config("PDF_RENDER_WORKERS", default=1, cast=int)
+PDF_RENDER_CHUNK_SIZE = config("PDF_RENDER_CHUNK_SIZE", default=500, cast=int)
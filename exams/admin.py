@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Exam, CorrectAnswerSheet, StudentAnswerSheet
+from django.db import transaction
+
+from .models import Exam, CorrectAnswerSheet, StudentAnswerSheet, Job, RecognitionCacheEntry
+from .utils.item_analysis import invalidate_exam_statistics
 
 
 @admin.register(Exam)
@@ -45,3 +48,43 @@ class StudentAnswerSheetAdmin(admin.ModelAdmin):
 
     verbose_name = "Gabarito do Aluno"
     verbose_name_plural = "Gabaritos dos Alunos"
+
+    # Gabaritos de aluno não têm receptor de post_delete (ver exams.signals):
+    # as exclusões pelo admin invalidam as estatísticas aqui, uma vez por prova
+
+    def delete_model(self, request, obj):
+        exam_id = obj.exam_id
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: invalidate_exam_statistics(exam_id))
+
+    def delete_queryset(self, request, queryset):
+        exam_ids = set(queryset.values_list('exam_id', flat=True))
+        super().delete_queryset(request, queryset)
+
+        def invalidate():
+            for exam_id in exam_ids:
+                invalidate_exam_statistics(exam_id)
+
+        transaction.on_commit(invalidate)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'exam', 'progress', 'total', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    readonly_fields = ['progress', 'total', 'started_at', 'finished_at', 'error']
+    ordering = ['-created_at']
+
+    verbose_name = "Tarefa"
+    verbose_name_plural = "Tarefas"
+
+
+@admin.register(RecognitionCacheEntry)
+class RecognitionCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['key', 'hits', 'created_at', 'last_used_at']
+    search_fields = ['key']
+    readonly_fields = ['key', 'result', 'hits', 'created_at', 'last_used_at']
+    ordering = ['-last_used_at']
+
+    verbose_name = "Reconhecimento em Cache"
+    verbose_name_plural = "Reconhecimentos em Cache"
@@ -0,0 +1,108 @@
+import random
+import time
+from multiprocessing import Process, Queue
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from exams.models import CorrectAnswerSheet, Exam, StudentAnswerSheet
+from exams.utils.sheet_layout import option_letters
+
+
+def _work(exam_id, operations, write_ratio, results):
+    """
+    Mistura de leituras (listagem de gabaritos da prova) e escritas
+    (gabarito novo com código alocado, respostas e nota) em um processo.
+    """
+    close_old_connections()
+    exam = Exam.objects.get(pk=exam_id)
+    letters = option_letters(exam.num_options)
+    reads, writes, errors = [], [], 0
+    for _ in range(operations):
+        write = random.random() < write_ratio
+        started_at = time.perf_counter()
+        try:
+            if write:
+                sheet = StudentAnswerSheet(exam=exam, student_answers={
+                    str(q): random.choice(letters) for q in range(1, exam.num_questions + 1)
+                })
+                sheet.save()
+                sheet.calculate_result()
+            else:
+                list(
+                    StudentAnswerSheet.objects.filter(exam=exam)
+                    .order_by('-submitted_at')
+                    .values_list('id', 'sheet_code', 'accuracy_percentage')[:50]
+                )
+        except OperationalError:
+            # "database is locked" depois de esgotar o timeout
+            errors += 1
+            continue
+        (writes if write else reads).append(time.perf_counter() - started_at)
+    connections.close_all()
+    results.put((reads, writes, errors))
+
+
+def _percentile(values, share):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark de concorrência do banco configurado (DATABASE_URL): vários processos "
+        "lendo e gravando gabaritos ao mesmo tempo. Rode uma vez com SQLite e outra com "
+        "PostgreSQL para comparar. Usa uma prova temporária, excluída ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--operations', type=int, default=500, help="Operações por processo.")
+        parser.add_argument('--write-ratio', type=float, default=0.3)
+
+    def _describe_database(self):
+        description = connection.vendor
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                description += f" (journal_mode={cursor.fetchone()[0]})"
+        return description
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Banco: {self._describe_database()}")
+        exam = Exam.objects.create(subject_name="Benchmark", num_questions=20, num_options=5)
+        CorrectAnswerSheet.objects.create(exam=exam, answers={str(q): 'A' for q in range(1, 21)})
+        try:
+            self.stdout.write(
+                f"{'processos':>9} {'ops/s':>8} {'leitura p50/p95 ms':>19} "
+                f"{'escrita p50/p95 ms':>19} {'erros':>6}"
+            )
+            for processes in options['processes']:
+                # Cada processo precisa abrir sua própria conexão com o banco
+                connections.close_all()
+                results = Queue()
+                workers = [
+                    Process(target=_work, args=(exam.pk, options['operations'], options['write_ratio'], results))
+                    for _ in range(processes)
+                ]
+                started_at = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                outcomes = [results.get() for _ in workers]
+                elapsed = time.perf_counter() - started_at
+                for worker in workers:
+                    worker.join()
+
+                reads = [value for outcome in outcomes for value in outcome[0]]
+                writes = [value for outcome in outcomes for value in outcome[1]]
+                errors = sum(outcome[2] for outcome in outcomes)
+                self.stdout.write(
+                    f"{processes:>9} {(len(reads) + len(writes)) / elapsed:>8.0f} "
+                    f"{_percentile(reads, 0.5) * 1000:>9.1f}/{_percentile(reads, 0.95) * 1000:<9.1f} "
+                    f"{_percentile(writes, 0.5) * 1000:>9.1f}/{_percentile(writes, 0.95) * 1000:<9.1f} "
+                    f"{errors:>6}"
+                )
+        finally:
+            exam.delete()
@@ -0,0 +1,161 @@
+import random
+import resource
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from exams.models import CorrectAnswerSheet, Exam, StudentAnswerSheet
+from exams.utils.excel_exporter import (
+    export_detailed_results_to_excel,
+    export_results_to_excel,
+    iter_results_csv,
+)
+from exams.utils.grading import encode_answers, pack_answers, regrade_exam
+from exams.utils.sheet_layout import option_letters
+
+
+def _export_csv(exam, output):
+    for chunk in iter_results_csv(exam):
+        output.write(chunk.encode())
+
+
+def _memory_mb(field):
+    """Campo de /proc/self/status (VmRSS, VmHWM, RssAnon) do processo atual, em MB."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _AnonymousMemoryPeak(threading.Thread):
+    """
+    Amostra a memória anônima (heap) do processo. O VmHWM também conta as
+    páginas do banco SQLite mapeadas em memória (PRAGMA mmap_size), que
+    não são da exportação.
+    """
+
+    def __init__(self, interval=0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _memory_mb('RssAnon')
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, _memory_mb('RssAnon'))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, _memory_mb('RssAnon'))
+
+
+def _measure(name, exam_id, results):
+    """
+    Roda uma exportação em um processo próprio, para que os picos de
+    memória sejam só dela e sem o custo de rastrear alocações.
+    """
+    exam = Exam.objects.get(pk=exam_id)
+    rss_baseline = _memory_mb('VmRSS')
+    heap_baseline = _memory_mb('RssAnon')
+    heap = _AnonymousMemoryPeak()
+    heap.start()
+    with tempfile.TemporaryFile() as output:
+        started_at = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            EXPORTS[name](exam, output)
+        elapsed = time.perf_counter() - started_at
+        size = output.seek(0, 2)
+    heap.stop()
+    connections.close_all()
+    results.put((
+        len(queries), heap.peak - heap_baseline, _memory_mb('VmHWM') - rss_baseline, elapsed, size,
+    ))
+
+
+EXPORTS = {
+    'excel': export_results_to_excel,
+    'excel_detailed': export_detailed_results_to_excel,
+    'csv_detailed': _export_csv,
+}
+
+
+def _seed(sheets, num_questions, num_options, results):
+    """Cria a prova sintética; roda à parte para não inflar o heap herdado pelas medições."""
+    exam = Exam.objects.create(subject_name="Benchmark", num_questions=num_questions, num_options=num_options)
+    letters = option_letters(num_options)
+    CorrectAnswerSheet.objects.bulk_create([CorrectAnswerSheet(
+        exam=exam,
+        answers={str(q): random.choice(letters) for q in range(1, num_questions + 1)},
+    )])
+
+    batch = []
+    for number in range(sheets):
+        answers = {str(q): random.choice(letters) for q in range(1, num_questions + 1)}
+        batch.append(StudentAnswerSheet(
+            exam=exam,
+            sheet_code=f"B{exam.pk:04d}{number:07d}",
+            student_name=f"Aluno {number}",
+            student_answers=answers,
+            answer_codes=pack_answers(encode_answers(answers, num_questions, num_options)),
+        ))
+        if len(batch) == 5000:
+            StudentAnswerSheet.objects.bulk_create(batch)
+            batch = []
+    StudentAnswerSheet.objects.bulk_create(batch)
+    regrade_exam(exam)
+    connections.close_all()
+    results.put(exam.pk)
+
+
+def _run_in_process(target, *args):
+    """Roda `target` em um processo próprio e devolve o que ele puser na fila."""
+    # Cada processo precisa abrir sua própria conexão com o banco
+    connections.close_all()
+    results = Queue()
+    process = Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede as exportações de resultados (consultas, pico de memória e tempo) "
+        "em uma prova sintética com muitos gabaritos, excluída ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sheets', type=int, default=100_000)
+        parser.add_argument('--questions', type=int, default=40)
+        parser.add_argument('--options', type=int, default=5)
+        parser.add_argument('--exports', nargs='+', choices=sorted(EXPORTS), default=list(EXPORTS))
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Criando {options['sheets']} gabaritos...")
+        exam_id = _run_in_process(_seed, options['sheets'], options['questions'], options['options'])
+        try:
+            self.stdout.write(
+                f"{'exportação':>15} {'consultas':>9} {'heap MB':>8} {'RSS MB':>7} {'segundos':>9} {'arquivo MB':>11}"
+            )
+            for name in options['exports']:
+                queries, heap, rss, elapsed, size = _run_in_process(_measure, name, exam_id)
+                self.stdout.write(
+                    f"{name:>15} {queries:>9} {heap:>8.1f} {rss:>7.1f} {elapsed:>9.1f} {size / 2 ** 20:>11.1f}"
+                )
+        finally:
+            Exam.objects.filter(pk=exam_id).delete()
+        self.stdout.write(
+            "heap MB: pico da memória anônima acrescentada pela exportação; "
+            "RSS MB: pico da memória residente, com as páginas do banco mapeadas em memória."
+        )
@@ -0,0 +1,62 @@
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from exams.models import Exam, StudentAnswerSheet
+from exams.utils.pdf_generator import generate_answer_sheet_pdf, render_answer_sheets
+
+
+def _per_sheet(exam, quantity):
+    """Caminho antigo: um INSERT (e uma ida ao banco) por gabarito."""
+    codes = [
+        StudentAnswerSheet.objects.create(exam=exam, student_name=None, student_answers=None).sheet_code
+        for _ in range(quantity)
+    ]
+    render_answer_sheets(BytesIO(), exam.subject_name, exam.num_questions, exam.num_options, codes)
+
+
+def _bulk(exam, quantity):
+    """Caminho atual: códigos reservados em bloco e um único bulk_create."""
+    generate_answer_sheet_pdf(exam, quantity, workers=1)
+
+
+STRATEGIES = {
+    'per_sheet': _per_sheet,
+    'bulk': _bulk,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a geração de gabaritos (registros + PDF) com um INSERT por gabarito "
+        "e com bulk_create, em requisições por segundo. Usa uma prova temporária, "
+        "excluída ao final; a sequência de códigos avança."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                            help="Quantidades de gabaritos por requisição.")
+        parser.add_argument('--strategies', nargs='+', choices=sorted(STRATEGIES),
+                            default=['per_sheet', 'bulk'])
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--options', type=int, default=4)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'gabaritos':>10} {'estratégia':>10} {'segundos':>9} {'req/s':>8} {'gabaritos/s':>12}")
+        for quantity in options['sizes']:
+            for name in options['strategies']:
+                exam = Exam.objects.create(
+                    subject_name="Benchmark",
+                    num_questions=options['questions'],
+                    num_options=options['options'],
+                )
+                try:
+                    started_at = time.perf_counter()
+                    STRATEGIES[name](exam, quantity)
+                    elapsed = time.perf_counter() - started_at
+                finally:
+                    exam.delete()
+                self.stdout.write(
+                    f"{quantity:>10} {name:>10} {elapsed:>9.2f} {1 / elapsed:>8.2f} {quantity / elapsed:>12.0f}"
+                )
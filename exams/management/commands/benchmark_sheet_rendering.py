@@ -0,0 +1,67 @@
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from reportlab.pdfgen import canvas
+
+from exams.utils import sheet_layout as layout
+from exams.utils.code_allocator import encode_sheet_code
+from exams.utils.pdf_generator import CODE_LABEL, _draw_code_qr, _draw_sheet_template, render_answer_sheets
+
+
+def _render_redrawn(output, subject_name, num_questions, num_options, codes):
+    """Caminho antigo: a moldura, as bolhas e as letras redesenhadas em cada gabarito."""
+    c = canvas.Canvas(output, pagesize=(layout.PAGE_WIDTH, layout.PAGE_HEIGHT))
+    code_x = layout.TEXT_X + c.stringWidth(CODE_LABEL, "Helvetica", 11)
+    for i, code in enumerate(codes):
+        c.saveState()
+        c.translate(layout.PAGE_MARGIN + (i % 2) * (layout.SHEET_WIDTH + layout.SHEET_GAP), layout.PAGE_MARGIN)
+        _draw_sheet_template(c, subject_name, num_questions, num_options)
+        c.setFont("Helvetica", 11)
+        c.drawString(code_x, layout.CODE_Y, code)
+        _draw_code_qr(c, code)
+        c.restoreState()
+        if i % 2 == 1:
+            c.showPage()
+    c.save()
+
+
+def _render_template(output, subject_name, num_questions, num_options, codes):
+    """Caminho atual: layout fixo gravado uma vez como Form XObject."""
+    render_answer_sheets(output, subject_name, num_questions, num_options, codes)
+
+
+MODES = {
+    'redrawn': _render_redrawn,
+    'template': _render_template,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark do desenho de gabaritos: tempo e bytes por gabarito com o "
+        "layout redesenhado a cada gabarito e com o layout em Form XObject. Não usa o banco."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, nargs='+', default=[20, 50, 100])
+        parser.add_argument('--options', type=int, default=5)
+        parser.add_argument('--sheets', type=int, default=500, help="Gabaritos por medição.")
+        parser.add_argument('--repeat', type=int, default=3, help="Medições; vale a mais rápida.")
+
+    def handle(self, *args, **options):
+        codes = [encode_sheet_code(value) for value in range(options['sheets'])]
+        self.stdout.write(f"{'questões':>8} {'modo':>9} {'ms/gabarito':>12} {'bytes/gabarito':>15}")
+        for num_questions in options['questions']:
+            for name, render in MODES.items():
+                best = None
+                for _ in range(max(1, options['repeat'])):
+                    output = BytesIO()
+                    started_at = time.perf_counter()
+                    render(output, "Benchmark", num_questions, options['options'], codes)
+                    elapsed = time.perf_counter() - started_at
+                    best = elapsed if best is None else min(best, elapsed)
+                size = len(output.getvalue())
+                self.stdout.write(
+                    f"{num_questions:>8} {name:>9} {best * 1000 / len(codes):>12.3f} {size / len(codes):>15.0f}"
+                )
@@ -0,0 +1,77 @@
+import signal
+import sys
+import time
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from exams.utils.job_runner import claim_next_job, recover_stale_jobs, run_job
+
+
+def _work(once, poll_interval):
+    """Loop of a single worker process: recover, claim, run, repeat."""
+    while True:
+        close_old_connections()
+        recover_stale_jobs()
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+
+
+def _exit_on_signal(signum, frame):
+    # Como PID 1 de um contêiner, o processo ignoraria o SIGTERM do `docker stop`.
+    # Uma tarefa interrompida aqui fica "em execução" e volta à fila pelo prazo de renovação.
+    sys.exit(128 + signum)
+
+
+class Command(BaseCommand):
+    help = "Processa a fila de tarefas em segundo plano (PDFs de gabaritos e planilhas)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Número de processos trabalhadores.")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Segundos de espera quando a fila está vazia.")
+        parser.add_argument('--once', action='store_true',
+                            help="Esvazia a fila e termina, sem aguardar novas tarefas.")
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        once = options['once']
+        poll_interval = options['poll_interval']
+
+        signal.signal(signal.SIGTERM, _exit_on_signal)
+        if workers == 1:
+            _work(once, poll_interval)
+            return
+
+        # Cada processo precisa abrir sua própria conexão com o banco
+        connections.close_all()
+        processes = {}
+        for _ in range(workers):
+            process = Process(target=_work, args=(once, poll_interval))
+            process.start()
+            processes[process.sentinel] = process
+
+        # Se um trabalhador morrer, encerra os demais e termina com erro, para
+        # que o supervisor (ex.: a política de reinício do contêiner) perceba
+        try:
+            while processes:
+                for sentinel in wait(list(processes)):
+                    process = processes.pop(sentinel)
+                    process.join()
+                    if process.exitcode != 0 or not once:
+                        raise CommandError(
+                            f"O trabalhador {process.pid} terminou com código {process.exitcode}."
+                        )
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                process.join()
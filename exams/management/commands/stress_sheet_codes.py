@@ -0,0 +1,76 @@
+import time
+from multiprocessing import Process, Queue
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from exams.utils.code_allocator import _reserve_block, encode_sheet_code, is_valid_sheet_code
+
+
+def _allocate(blocks, block_size, results):
+    """Reserves `blocks` blocks in one process and reports the ranges."""
+    close_old_connections()
+    ranges = []
+    for _ in range(blocks):
+        block = _reserve_block(block_size)
+        ranges.append((block.start, block.stop))
+    connections.close_all()
+    results.put(ranges)
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de estresse do alocador de códigos: vários processos reservam "
+        "blocos ao mesmo tempo e os códigos resultantes são conferidos. "
+        "Use um banco compartilhado (arquivo SQLite ou PostgreSQL) via DATABASE_URL; "
+        "a sequência avança de verdade."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8,
+                            help="Processos alocando ao mesmo tempo.")
+        parser.add_argument('--codes', type=int, default=1_000_000,
+                            help="Total de códigos a alocar.")
+        parser.add_argument('--block-size', type=int, default=1000,
+                            help="Códigos por reserva (como um lote de PDF).")
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        block_size = max(1, options['block_size'])
+        blocks = -(-options['codes'] // block_size)
+        per_process = [blocks // processes + (index < blocks % processes) for index in range(processes)]
+
+        # Cada processo precisa abrir sua própria conexão com o banco
+        connections.close_all()
+        results = Queue()
+        workers = [
+            Process(target=_allocate, args=(count, block_size, results))
+            for count in per_process if count
+        ]
+        started_at = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        ranges = [block for _ in workers for block in results.get()]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started_at
+
+        if any(worker.exitcode for worker in workers):
+            raise CommandError("Um processo de alocação falhou.")
+
+        ranges.sort()
+        for (_, previous_end), (start, _) in zip(ranges, ranges[1:]):
+            if start < previous_end:
+                raise CommandError(f"Blocos sobrepostos: {previous_end} > {start}")
+
+        codes = {encode_sheet_code(value) for start, end in ranges for value in range(start, end)}
+        total = sum(end - start for start, end in ranges)
+        if len(codes) != total:
+            raise CommandError(f"Códigos repetidos: {total - len(codes)}")
+        if not all(is_valid_sheet_code(code) for code in codes):
+            raise CommandError("Código com dígito verificador inválido.")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} códigos únicos em {len(ranges)} blocos, {len(workers)} processos, "
+            f"{elapsed:.2f}s ({len(ranges) / elapsed:.0f} reservas/s, {total / elapsed:.0f} códigos/s)"
+        ))
@@ -0,0 +1,123 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_sequence_row(apps, schema_editor):
+    SheetCodeSequence = apps.get_model('exams', 'SheetCodeSequence')
+    SheetCodeSequence.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SheetCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(default=0, verbose_name='Próximo Valor')),
+            ],
+            options={
+                'verbose_name': 'Sequência de Códigos',
+                'verbose_name_plural': 'Sequências de Códigos',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='correctanswersheet',
+            options={'verbose_name': 'Gabarito Correto', 'verbose_name_plural': 'Gabaritos Corretos'},
+        ),
+        migrations.AlterModelOptions(
+            name='exam',
+            options={'ordering': ['-created_at'], 'verbose_name': 'Prova', 'verbose_name_plural': 'Provas'},
+        ),
+        migrations.AlterModelOptions(
+            name='studentanswersheet',
+            options={'ordering': ['-submitted_at'], 'verbose_name': 'Gabarito do Aluno', 'verbose_name_plural': 'Gabaritos dos Alunos'},
+        ),
+        migrations.AlterField(
+            model_name='correctanswersheet',
+            name='answers',
+            field=models.JSONField(verbose_name='Respostas Corretas'),
+        ),
+        migrations.AlterField(
+            model_name='correctanswersheet',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Criado em'),
+        ),
+        migrations.AlterField(
+            model_name='correctanswersheet',
+            name='exam',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='correct_answer_sheet', to='exams.exam', verbose_name='Prova'),
+        ),
+        migrations.AlterField(
+            model_name='exam',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Criado em'),
+        ),
+        migrations.AlterField(
+            model_name='exam',
+            name='num_options',
+            field=models.IntegerField(verbose_name='Número de Opções por Questão'),
+        ),
+        migrations.AlterField(
+            model_name='exam',
+            name='num_questions',
+            field=models.IntegerField(verbose_name='Número de Questões'),
+        ),
+        migrations.AlterField(
+            model_name='exam',
+            name='subject_name',
+            field=models.CharField(max_length=255, verbose_name='Nome do Assunto'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='accuracy_percentage',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=5, verbose_name='Percentual de Acertos'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='correct_items',
+            field=models.IntegerField(default=0, verbose_name='Itens Corretos'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='exam',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_answer_sheets', to='exams.exam', verbose_name='Prova'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='incorrect_items',
+            field=models.IntegerField(default=0, verbose_name='Itens Incorretos'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='sheet_code',
+            field=models.CharField(editable=False, max_length=20, unique=True, verbose_name='Código do Gabarito'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='sheet_image',
+            field=models.ImageField(blank=True, null=True, upload_to='student_answer_sheets/', verbose_name='Imagem do Gabarito'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='student_answers',
+            field=models.JSONField(blank=True, null=True, verbose_name='Respostas do Aluno'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='student_name',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Nome do Aluno'),
+        ),
+        migrations.AlterField(
+            model_name='studentanswersheet',
+            name='submitted_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Enviado em'),
+        ),
+        migrations.RunPython(create_sequence_row, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0002_sheet_code_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('answer_sheets_pdf', 'PDF de Gabaritos'), ('results_excel', 'Planilha de Resultados')], max_length=32, verbose_name='Tipo')),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('running', 'Em execução'), ('done', 'Concluída'), ('failed', 'Falhou')], db_index=True, default='pending', max_length=16, verbose_name='Situação')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Parâmetros')),
+                ('progress', models.IntegerField(default=0, verbose_name='Progresso')),
+                ('total', models.IntegerField(default=0, verbose_name='Total')),
+                ('result_file', models.FileField(blank=True, null=True, upload_to='jobs/', verbose_name='Arquivo Gerado')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Erro')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado em')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizado em')),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='exams.exam', verbose_name='Prova')),
+            ],
+            options={
+                'verbose_name': 'Tarefa',
+                'verbose_name_plural': 'Tarefas',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
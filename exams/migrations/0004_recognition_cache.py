@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0003_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecognitionCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Chave')),
+                ('result', models.JSONField(verbose_name='Resultado')),
+                ('hits', models.IntegerField(default=0, verbose_name='Acertos')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Último Uso')),
+            ],
+            options={
+                'verbose_name': 'Reconhecimento em Cache',
+                'verbose_name_plural': 'Reconhecimentos em Cache',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecognitionCacheStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hits', models.BigIntegerField(default=0, verbose_name='Acertos')),
+                ('misses', models.BigIntegerField(default=0, verbose_name='Falhas')),
+            ],
+            options={
+                'verbose_name': 'Estatística do Cache',
+                'verbose_name_plural': 'Estatísticas do Cache',
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+
+def pack_answers(answers, num_questions, num_options):
+    """
+    Cópia congelada de grading.encode_answers + grading.pack_answers como
+    eram nesta migração: uma letra por questão, '-' em branco e '*' para
+    marcação múltipla ou valor que não é alternativa.
+    """
+    letters = [chr(65 + index) for index in range(num_options)]
+    symbols = ['-'] * num_questions
+    for question_num, answer in answers.items():
+        try:
+            index = int(question_num) - 1
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= index < num_questions or answer is None or answer == '':
+            continue
+        letter = str(answer).strip().upper()
+        symbols[index] = letter if letter in letters else '*'
+    return ''.join(symbols)
+
+
+def backfill_answer_codes(apps, schema_editor):
+    StudentAnswerSheet = apps.get_model('exams', 'StudentAnswerSheet')
+    sheets = (
+        StudentAnswerSheet.objects
+        .filter(student_answers__isnull=False)
+        .select_related('exam')
+        .only('id', 'student_answers', 'exam__num_questions', 'exam__num_options')
+    )
+    batch = []
+    for sheet in sheets.iterator(chunk_size=2000):
+        if not sheet.student_answers:
+            continue
+        exam = sheet.exam
+        sheet.answer_codes = pack_answers(sheet.student_answers, exam.num_questions, exam.num_options)
+        batch.append(sheet)
+        if len(batch) >= 1000:
+            StudentAnswerSheet.objects.bulk_update(batch, ['answer_codes'])
+            batch = []
+    if batch:
+        StudentAnswerSheet.objects.bulk_update(batch, ['answer_codes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0004_recognition_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentanswersheet',
+            name='answer_codes',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Respostas Codificadas'),
+        ),
+        migrations.RunPython(backfill_answer_codes, migrations.RunPython.noop),
+    ]
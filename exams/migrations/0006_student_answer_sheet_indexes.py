@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0005_student_answer_codes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='studentanswersheet',
+            index=models.Index(fields=['exam', '-accuracy_percentage'], name='sheet_exam_accuracy_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentanswersheet',
+            index=models.Index(fields=['exam', '-submitted_at'], name='sheet_exam_submitted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentanswersheet',
+            index=models.Index(condition=models.Q(('student_answers__isnull', True)), fields=['exam'], name='sheet_exam_unanswered_idx'),
+        ),
+    ]
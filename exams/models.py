@@ -1,5 +1,7 @@
 from django.db import models
-import uuid
+
+from .utils.code_allocator import allocate_sheet_codes
+from .utils.grading import compile_exam_key, encode_answers, grade_matrix, pack_answers
 
 
 class Exam(models.Model):
@@ -41,6 +43,22 @@ class CorrectAnswerSheet(models.Model):
         return f"Gabarito correto da prova {self.exam.subject_name}"
 
 
+class SheetCodeSequence(models.Model):
+    """
+    Contador único usado para reservar blocos de códigos de gabarito.
+    """
+    SINGLETON_ID = 1
+
+    next_value = models.BigIntegerField(default=0, verbose_name="Próximo Valor")
+
+    class Meta:
+        verbose_name = "Sequência de Códigos"
+        verbose_name_plural = "Sequências de Códigos"
+
+    def __str__(self):
+        return f"Sequência de códigos ({self.next_value})"
+
+
 class StudentAnswerSheet(models.Model):
     """
     Representa o gabarito preenchido por um aluno, com um código único e respostas detectadas.
@@ -68,6 +86,14 @@ class StudentAnswerSheet(models.Model):
         null=True,
         verbose_name="Respostas do Aluno"
     )
+    # Uma letra por questão ('-' em branco, '*' marcação múltipla), para
+    # correção e estatísticas sem interpretar o JSON
+    answer_codes = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name="Respostas Codificadas"
+    )
     correct_items = models.IntegerField(default=0, verbose_name="Itens Corretos")
     incorrect_items = models.IntegerField(default=0, verbose_name="Itens Incorretos")
     accuracy_percentage = models.DecimalField(
@@ -88,44 +114,159 @@ class StudentAnswerSheet(models.Model):
         verbose_name = "Gabarito do Aluno"
         verbose_name_plural = "Gabaritos dos Alunos"
         ordering = ['-submitted_at']
+        indexes = [
+            # Exportações (ordenadas por desempenho) e listagens por prova
+            models.Index(fields=['exam', '-accuracy_percentage'], name='sheet_exam_accuracy_idx'),
+            models.Index(fields=['exam', '-submitted_at'], name='sheet_exam_submitted_idx'),
+            # Gabaritos impressos ainda sem respostas
+            models.Index(
+                fields=['exam'],
+                condition=models.Q(student_answers__isnull=True),
+                name='sheet_exam_unanswered_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Gabarito {self.sheet_code} - {self.student_name or 'Desconhecido'}"
 
     def save(self, *args, **kwargs):
         if not self.sheet_code:
-            self.sheet_code = uuid.uuid4().hex[:5].upper()
+            self.sheet_code = allocate_sheet_codes(1)[0]
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'student_answers' in update_fields:
+            self.answer_codes = self.pack_student_answers()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'answer_codes'}
+
         super().save(*args, **kwargs)
 
+    def pack_student_answers(self):
+        """
+        Retorna as respostas do aluno no formato compacto de answer_codes.
+        """
+        if not self.student_answers:
+            return ''
+        exam = self.exam
+        return pack_answers(encode_answers(self.student_answers, exam.num_questions, exam.num_options))
+
     def calculate_result(self):
         """
         Calcula o resultado comparando as respostas do aluno com o gabarito correto.
+        Questões em branco ou com marcação múltipla contam como incorretas.
         """
         if not self.student_answers:
             return
 
-        try:
-            correct_answers = self.exam.correct_answer_sheet.answers
-            correct_count = 0
-            incorrect_count = 0
+        exam = self.exam
+        key = compile_exam_key(exam)
+        if key is None:
+            return
+
+        answers = encode_answers(self.student_answers, exam.num_questions, exam.num_options)
+        correct, incorrect, accuracy = grade_matrix(answers, key)
+
+        self.correct_items = int(correct[0])
+        self.incorrect_items = int(incorrect[0])
+        self.accuracy_percentage = round(float(accuracy[0]), 2)
+        self.save(update_fields=['correct_items', 'incorrect_items', 'accuracy_percentage'])
+
+
+class Job(models.Model):
+    """
+    Tarefa demorada (PDF de gabaritos, planilha de resultados) executada
+    em segundo plano pelo comando `run_jobs`.
+    """
+    KIND_ANSWER_SHEETS_PDF = 'answer_sheets_pdf'
+    KIND_RESULTS_EXCEL = 'results_excel'
+    KIND_CHOICES = [
+        (KIND_ANSWER_SHEETS_PDF, "PDF de Gabaritos"),
+        (KIND_RESULTS_EXCEL, "Planilha de Resultados"),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pendente"),
+        (STATUS_RUNNING, "Em execução"),
+        (STATUS_DONE, "Concluída"),
+        (STATUS_FAILED, "Falhou"),
+    ]
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES, verbose_name="Tipo")
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        db_index=True,
+        verbose_name="Situação"
+    )
+    exam = models.ForeignKey(
+        Exam,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name="Prova"
+    )
+    params = models.JSONField(default=dict, blank=True, verbose_name="Parâmetros")
+    progress = models.IntegerField(default=0, verbose_name="Progresso")
+    total = models.IntegerField(default=0, verbose_name="Total")
+    result_file = models.FileField(
+        upload_to='jobs/',
+        blank=True,
+        null=True,
+        verbose_name="Arquivo Gerado"
+    )
+    error = models.TextField(blank=True, default='', verbose_name="Erro")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="Iniciado em")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Finalizado em")
+    # Renovado pelo trabalhador enquanto a tarefa roda; vencido, a tarefa volta à fila
+    heartbeat_at = models.DateTimeField(blank=True, null=True, verbose_name="Último Sinal")
+    attempts = models.IntegerField(default=0, verbose_name="Tentativas")
+
+    class Meta:
+        verbose_name = "Tarefa"
+        verbose_name_plural = "Tarefas"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+
+
+class RecognitionCacheEntry(models.Model):
+    """
+    Resultado de reconhecimento de um arquivo já enviado, indexado pelo
+    hash do conteúdo e do layout da prova, para reenvios não serem lidos
+    de novo.
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name="Chave")
+    result = models.JSONField(verbose_name="Resultado")
+    hits = models.IntegerField(default=0, verbose_name="Acertos")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Último Uso")
+
+    class Meta:
+        verbose_name = "Reconhecimento em Cache"
+        verbose_name_plural = "Reconhecimentos em Cache"
 
-            for question_num, student_answer in self.student_answers.items():
-                correct_answer = correct_answers.get(question_num)
-                if student_answer == correct_answer:
-                    correct_count += 1
-                else:
-                    incorrect_count += 1
+    def __str__(self):
+        return f"{self.key[:12]} ({self.hits} acertos)"
 
-            self.correct_items = correct_count
-            self.incorrect_items = incorrect_count
 
-            total_questions = self.exam.num_questions
-            if total_questions > 0:
-                self.accuracy_percentage = (correct_count / total_questions) * 100
-            else:
-                self.accuracy_percentage = 0
+class RecognitionCacheStats(models.Model):
+    """
+    Contadores únicos de acertos e falhas do cache de reconhecimento.
+    """
+    SINGLETON_ID = 1
 
-            self.save()
+    hits = models.BigIntegerField(default=0, verbose_name="Acertos")
+    misses = models.BigIntegerField(default=0, verbose_name="Falhas")
 
-        except CorrectAnswerSheet.DoesNotExist:
-            pass
+    class Meta:
+        verbose_name = "Estatística do Cache"
+        verbose_name_plural = "Estatísticas do Cache"
+
+    def __str__(self):
+        return f"Cache de reconhecimento ({self.hits} acertos, {self.misses} falhas)"
@@ -0,0 +1,33 @@
+from rest_framework.pagination import CursorPagination
+
+
+class StudentAnswerSheetCursorPagination(CursorPagination):
+    """
+    Cursor pagination for answer sheets: pages are fetched by position,
+    not OFFSET, so deep pages cost the same as the first one.
+    """
+    ordering = ('-submitted_at', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        """
+        The cursor only encodes the first ordering field, plus an offset
+        among rows that share its value; `id` is appended so those ties
+        come back in the same order on every page.
+        """
+        ordering = super().get_ordering(request, queryset, view)
+        if not {'id', '-id'} & set(ordering):
+            ordering += ('id',)
+        return ordering
+
+
+class ExamCursorPagination(CursorPagination):
+    """
+    Cursor pagination for exams, newest first.
+    """
+    ordering = ('-created_at', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
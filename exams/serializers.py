@@ -1,8 +1,39 @@
 from rest_framework import serializers
-from .models import Exam, CorrectAnswerSheet, StudentAnswerSheet
+from rest_framework.reverse import reverse
+from .models import Exam, CorrectAnswerSheet, StudentAnswerSheet, Job
+from .utils.grading import compile_answer_key
 
 
-class ExamSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """
+    Lets GET requests choose the serialized fields: `?fields=id,sheet_code`
+    keeps only the listed fields and `?compact=true` leaves out the fields
+    in Meta.heavy_fields.
+    """
+
+    @classmethod
+    def omitted_fields(cls, request):
+        """Returns the names of the fields the request leaves out."""
+        if request is None or request.method != 'GET':
+            return set()
+
+        params = request.query_params
+        all_fields = set(cls.Meta.fields)
+        omitted = set()
+        if params.get('fields'):
+            requested = {name.strip() for name in params['fields'].split(',')}
+            omitted |= all_fields - requested
+        if str(params.get('compact', '')).lower() in ('1', 'true', 'yes'):
+            omitted |= set(getattr(cls.Meta, 'heavy_fields', ()))
+        return omitted
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.omitted_fields(self.context.get('request')):
+            self.fields.pop(name, None)
+
+
+class ExamSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the Exam model.
     """
@@ -31,8 +62,24 @@ class CorrectAnswerSheetSerializer(serializers.ModelSerializer):
         fields = ['id', 'exam', 'exam_subject', 'answers', 'created_at']
         read_only_fields = ['id', 'created_at']
 
+    def validate(self, attrs):
+        """
+        Compiles the key against the exam, so invalid letters and unknown
+        question numbers are a 400 here instead of failing the regrade after
+        it is saved. Questions left out of the key are accepted (UNKEYED).
+        """
+        exam = attrs.get('exam') or self.instance.exam
+        answers = attrs['answers'] if 'answers' in attrs else self.instance.answers
+        try:
+            compile_answer_key(
+                answers, exam.num_questions, exam.num_options, reject_unknown_questions=True
+            )
+        except ValueError as e:
+            raise serializers.ValidationError({'answers': str(e)})
+        return attrs
 
-class StudentAnswerSheetSerializer(serializers.ModelSerializer):
+
+class StudentAnswerSheetSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the StudentAnswerSheet model.
     """
@@ -47,6 +94,7 @@ class StudentAnswerSheetSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'sheet_code', 'correct_items', 'incorrect_items',
                             'accuracy_percentage', 'submitted_at']
+        heavy_fields = ['student_answers', 'sheet_image']
 
 
 class StudentAnswerSheetUploadSerializer(serializers.ModelSerializer):
@@ -57,3 +105,23 @@ class StudentAnswerSheetUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = StudentAnswerSheet
         fields = ['exam', 'sheet_image', 'student_name']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for background jobs (read-only).
+    """
+    download_url = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'exam', 'params', 'progress', 'total',
+            'error', 'attempts', 'created_at', 'started_at', 'finished_at', 'download_url'
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != Job.STATUS_DONE or not obj.result_file:
+            return None
+        return reverse('job-download', args=[obj.pk], request=self.context.get('request'))
@@ -0,0 +1,53 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CorrectAnswerSheet, Exam, StudentAnswerSheet
+from .utils.grading import regrade_exam
+from .utils.item_analysis import invalidate_exam_statistics
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=CorrectAnswerSheet)
+def regrade_on_answer_key_change(sender, instance, **kwargs):
+    """
+    Recalcula as notas da prova quando o gabarito correto é criado ou
+    alterado, depois que a transação for confirmada.
+    """
+    exam = instance.exam
+
+    def regrade():
+        # A resposta já foi confirmada: um erro aqui não pode virar um 500
+        try:
+            regrade_exam(exam)
+        except Exception:
+            logger.exception("Regrading exam %s failed", exam.pk)
+        invalidate_exam_statistics(exam.pk)
+
+    transaction.on_commit(regrade)
+
+
+@receiver(post_delete, sender=CorrectAnswerSheet)
+@receiver(post_save, sender=StudentAnswerSheet)
+def invalidate_statistics_on_change(sender, instance, **kwargs):
+    """
+    Descarta as estatísticas em cache da prova quando um gabarito muda.
+    """
+    exam_id = instance.exam_id
+    transaction.on_commit(lambda: invalidate_exam_statistics(exam_id))
+
+
+# Sem receptor de exclusão por gabarito de aluno: ele impediria o Django de
+# apagar os gabaritos de uma prova com um único DELETE. A exclusão de
+# gabaritos pela API invalida o cache na view, e pelo admin, no
+# StudentAnswerSheetAdmin; a de uma prova, aqui, uma vez.
+@receiver(post_delete, sender=Exam)
+def invalidate_statistics_on_exam_delete(sender, instance, **kwargs):
+    """
+    Descarta as estatísticas em cache de uma prova excluída.
+    """
+    exam_id = instance.pk
+    transaction.on_commit(lambda: invalidate_exam_statistics(exam_id))
@@ -1,3 +1,912 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import openpyxl
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from openai import InternalServerError
+from PIL import Image, ImageDraw
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas as pdf_canvas
+from rest_framework.test import APITestCase
+
+from config.database import parse_database_url
+
+from .models import CorrectAnswerSheet, Exam, Job, RecognitionCacheEntry, StudentAnswerSheet
+from .utils import sheet_layout as layout
+from .utils.code_allocator import allocate_sheet_codes, encode_sheet_code, is_valid_sheet_code
+from .utils.grading import (
+    ANNULLED,
+    BLANK,
+    MULTIPLE,
+    UNKEYED,
+    compile_answer_key,
+    count_choices,
+    encode_answer_matrix,
+    grade_matrix,
+    unpack_answer_matrix,
+)
+from .utils.image_preprocessing import (
+    PreprocessingStats,
+    crop_to_sheet,
+    open_upload_image,
+    prepare_sheet_image,
+)
+from .utils.item_analysis import CACHE_KEY as STATISTICS_CACHE_KEY, exam_statistics
+from .utils.job_runner import claim_next_job, enqueue_job, recover_stale_jobs, run_job
+from .utils.llm_dispatcher import LLMDispatcher
+from .utils.pdf_generator import render_answer_sheets
+from .utils.sheet_reader import BLANK_MARK, MULTIPLE_MARK, _parse_sheet_code, read_answer_sheet
+
+
+def use_temporary_media(test):
+    """Grava os arquivos do teste em um diretório temporário, no lugar do R2."""
+    media_root = tempfile.mkdtemp()
+    storage = override_settings(
+        MEDIA_ROOT=media_root,
+        STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        },
+    )
+    storage.enable()
+    test.addCleanup(storage.disable)
+    test.addCleanup(shutil.rmtree, media_root, True)
+
+
+class GradingTests(TestCase):
+    """Correção vetorizada: gabarito compilado contra a matriz de respostas."""
+
+    def test_only_x_annuls_a_question(self):
+        key = compile_answer_key({"1": "A", "2": "X"}, 3, 4)
+        self.assertEqual(key.tolist(), [0, ANNULLED, UNKEYED])
+
+    def test_questions_missing_from_the_key_are_incorrect(self):
+        key = compile_answer_key({"1": "A", "2": "X"}, 3, 4)
+        matrix = encode_answer_matrix([{"1": "A", "2": "B", "3": "C"}, {}], 3, 4)
+
+        correct, incorrect, accuracy = grade_matrix(matrix, key)
+
+        self.assertEqual(correct.tolist(), [2, 1])
+        self.assertEqual(incorrect.tolist(), [1, 2])
+        np.testing.assert_allclose(accuracy, [66.67, 33.33])
+
+    def test_unknown_questions_are_rejected_on_request(self):
+        answers = {"1": "A", "2": "B", "3": "C", "9": "D"}
+        self.assertEqual(compile_answer_key(answers, 3, 4).tolist(), [0, 1, 2])
+        with self.assertRaisesMessage(ValueError, "9"):
+            compile_answer_key(answers, 3, 4, reject_unknown_questions=True)
+
+    def test_invalid_letters_are_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_answer_key({"1": "Z"}, 1, 4)
+
+
+class AnswerCodesTests(TestCase):
+    """Respostas compactas em answer_codes: gravação, leitura e contagem no banco."""
+
+    def setUp(self):
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=4, num_options=4)
+
+    def _codes(self, sheet):
+        return StudentAnswerSheet.objects.values_list('answer_codes', flat=True).get(pk=sheet.pk)
+
+    def test_save_keeps_answer_codes_in_sync(self):
+        sheet = StudentAnswerSheet.objects.create(exam=self.exam, student_answers={"1": "A", "3": "Z"})
+        self.assertEqual(self._codes(sheet), 'A-*-')
+
+        sheet.student_answers = {"2": "b"}
+        sheet.save(update_fields=['student_answers'])
+        self.assertEqual(self._codes(sheet), '-B--')
+
+        # Sem student_answers em update_fields, nada muda no banco
+        sheet.student_answers = {"1": "C"}
+        sheet.save(update_fields=['student_name'])
+        self.assertEqual(self._codes(sheet), '-B--')
+
+        sheet.save()
+        self.assertEqual(self._codes(sheet), 'C---')
+
+    def test_unpack_pads_and_truncates(self):
+        matrix = unpack_answer_matrix(['AB', 'C-*D', '', 'ABCDA'], 4, 4)
+        self.assertEqual(matrix.tolist(), [
+            [0, 1, BLANK, BLANK],
+            [2, BLANK, MULTIPLE, 3],
+            [BLANK] * 4,
+            [0, 1, 2, 3],
+        ])
+
+    def test_count_choices(self):
+        for answers in ({"1": "A"}, {"1": "A", "2": "B"}, {"1": "Z"}, None):
+            StudentAnswerSheet.objects.create(exam=self.exam, student_answers=answers)
+        # Código compactado antes de a prova ganhar questões: termina cedo
+        short = StudentAnswerSheet.objects.create(exam=self.exam, student_answers={"1": "B"})
+        StudentAnswerSheet.objects.filter(pk=short.pk).update(answer_codes='B')
+
+        self.assertEqual(count_choices(self.exam, 1), {'A': 2, 'B': 1, 'C': 0, 'D': 0, '-': 0, '*': 1})
+        self.assertEqual(count_choices(self.exam, 2), {'A': 0, 'B': 1, 'C': 0, 'D': 0, '-': 3, '*': 0})
+
+
+class CorrectAnswerSheetApiTests(APITestCase):
+    """Gabaritos inválidos são recusados antes de chegar à correção."""
+
+    def setUp(self):
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+        self.sheet = StudentAnswerSheet.objects.create(
+            exam=self.exam, student_answers={"1": "A", "2": "B", "3": "C"}
+        )
+
+    def test_invalid_letter_is_a_400(self):
+        response = self.client.post(
+            '/api/correct-answer-sheets/',
+            {'exam': self.exam.pk, 'answers': {"1": "Z", "2": "B", "3": "C"}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('answers', response.data)
+        self.assertFalse(CorrectAnswerSheet.objects.exists())
+
+    def test_unknown_question_is_a_400(self):
+        response = self.client.post(
+            '/api/correct-answer-sheets/',
+            {'exam': self.exam.pk, 'answers': {"1": "A", "2": "B", "3": "C", "4": "D"}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('answers', response.data)
+
+    def test_incomplete_key_is_accepted(self):
+        # Questões sem resposta no gabarito ficam sem chave e contam como erro
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/correct-answer-sheets/',
+                {'exam': self.exam.pk, 'answers': {"1": "A", "2": ""}},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.sheet.refresh_from_db()
+        self.assertEqual((self.sheet.correct_items, self.sheet.incorrect_items), (1, 2))
+
+    def test_valid_key_regrades_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/correct-answer-sheets/',
+                {'exam': self.exam.pk, 'answers': {"1": "A", "2": "X", "3": "D"}},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.sheet.refresh_from_db()
+        self.assertEqual((self.sheet.correct_items, self.sheet.incorrect_items), (2, 1))
+
+    def test_regrade_errors_do_not_escape_the_commit(self):
+        # Gabarito gravado antes da validação existir
+        CorrectAnswerSheet.objects.bulk_create([CorrectAnswerSheet(exam=self.exam, answers={"1": "Z"})])
+        key = CorrectAnswerSheet.objects.get(exam=self.exam)
+        with self.assertLogs('exams.signals', level='ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                key.save()
+
+        response = self.client.get(f'/api/exams/{self.exam.pk}/statistics/')
+        self.assertEqual(response.status_code, 400)
+
+
+class AnswerSheetPdfApiTests(APITestCase):
+    """PDF de gabaritos gerado na própria requisição, até PDF_SYNC_MAX_SHEETS."""
+
+    def setUp(self):
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=5, num_options=4)
+        self.url = f'/api/exams/{self.exam.pk}/generate_answer_sheets_pdf/'
+
+    def test_pdf_is_streamed(self):
+        response = self.client.post(self.url, {'quantity': 3})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+        # 2 gabaritos por folha
+        self.assertEqual(len(pdf.pages), 2)
+        self.assertEqual(StudentAnswerSheet.objects.filter(exam=self.exam).count(), 3)
+
+    @override_settings(PDF_SYNC_MAX_SHEETS=2)
+    def test_large_print_runs_must_be_async(self):
+        response = self.client.post(self.url, {'quantity': 3})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StudentAnswerSheet.objects.filter(exam=self.exam).exists())
+
+        response = self.client.post(self.url, {'quantity': 3, 'async': 'true'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['total'], 3)
+
+
+class ExamStatisticsApiTests(APITestCase):
+    """Análise de itens de uma matriz pequena montada à mão."""
+
+    def test_item_statistics(self):
+        exam = Exam.objects.create(subject_name="Matemática", num_questions=4, num_options=4)
+        CorrectAnswerSheet.objects.create(exam=exam, answers={"1": "A", "2": "B", "3": "C", "4": "D"})
+        # Acertos por aluno: 1111, 1110, 1100, 1010, 0100, 0000
+        for answers in ("ABCD", "ABCA", "ABAA", "ACCB", "BBAA", "CAAA"):
+            StudentAnswerSheet.objects.create(
+                exam=exam, student_answers={str(q): letter for q, letter in enumerate(answers, start=1)}
+            )
+
+        response = self.client.get(f'/api/exams/{exam.pk}/statistics/')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        questions = data['questions']
+        self.assertEqual([q['difficulty'] for q in questions], [0.6667, 0.6667, 0.5, 0.1667])
+        # Ponto-bisserial contra o escore sem o item (np.corrcoef)
+        self.assertEqual([q['discrimination'] for q in questions], [0.625, 0.2132, 0.5222, 0.4889])
+        self.assertEqual(data['kr20'], 0.6667)
+        self.assertEqual(data['histogram'], [1, 1, 2, 1, 1])
+        self.assertEqual(questions[0]['options'], {'A': 4, 'B': 1, 'C': 1, 'D': 0})
+
+
+@override_settings(ANSWER_SHEET_RECOGNITION_BACKEND='local_omr', OMR_LLM_FALLBACK=False)
+class BatchUploadApiTests(APITestCase):
+    """Envio em lote: uma linha NDJSON por página do PDF, na ordem das páginas."""
+
+    def setUp(self):
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+        CorrectAnswerSheet.objects.create(exam=self.exam, answers={"1": "A", "2": "B", "3": "C"})
+        self.first, self.second = (StudentAnswerSheet.objects.create(exam=self.exam) for _ in range(2))
+
+    def _pdf(self, pages):
+        buffer = io.BytesIO()
+        c = pdf_canvas.Canvas(buffer)
+        for number in range(1, pages + 1):
+            c.drawString(72, 720, f"Página {number}")
+            c.showPage()
+        c.save()
+        return buffer.getvalue()
+
+    def _rasterization(self, pages):
+        """Sem o poppler (pdfinfo/pdftoppm), a conversão das páginas é simulada."""
+        stack = contextlib.ExitStack()
+        if shutil.which('pdfinfo') is None:
+            stack.enter_context(
+                mock.patch('exams.utils.scan_pages.pdfinfo_from_bytes', return_value={'Pages': pages})
+            )
+            stack.enter_context(mock.patch(
+                'exams.utils.scan_pages.convert_from_bytes',
+                side_effect=lambda *args, **kwargs: [Image.new('L', (60, 80), 255)],
+            ))
+        return stack
+
+    def _result(self, sheet_code, answers):
+        return {'sheet_code': sheet_code, 'answers': answers, 'backend': 'local_omr', 'confidence': 1.0}
+
+    def test_one_line_per_page(self):
+        readings = [
+            self._result(self.first.sheet_code, {"1": "A", "2": "B", "3": "D"}),
+            RuntimeError("página ilegível"),
+            self._result('NOPE', {}),
+            self._result(self.second.sheet_code, {"1": "A", "2": "B", "3": "C"}),
+        ]
+        with self._rasterization(4), mock.patch('exams.views.recognize_locally', side_effect=readings):
+            response = self.client.post('/api/student-answer-sheets/upload_answer_sheets_batch/', {
+                'exam': self.exam.pk,
+                'sheets_file': SimpleUploadedFile('lote.pdf', self._pdf(4), content_type='application/pdf'),
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([line['page'] for line in lines], [1, 2, 3, 4])
+        self.assertEqual((lines[0]['sheet_code'], lines[0]['correct_items']), (self.first.sheet_code, 2))
+        # A falha no meio do lote vira uma linha de erro e o lote continua
+        self.assertIn("página ilegível", lines[1]['error'])
+        self.assertEqual((lines[2]['sheet_code'], lines[2]['error']), ('NOPE', "Código do gabarito não reconhecido."))
+        self.assertEqual((lines[3]['sheet_code'], lines[3]['correct_items']), (self.second.sheet_code, 3))
+
+
+class ExportResultsApiTests(APITestCase):
+    """Exportações de resultados: planilhas resumida e detalhada e CSV."""
+
+    def setUp(self):
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+        CorrectAnswerSheet.objects.create(exam=self.exam, answers={"1": "A", "2": "X", "3": "C"})
+        # Criados fora da ordem de acerto: a exportação ordena pelo percentual
+        self.sheets = {}
+        for name, answers in (('low', {"1": "D"}), ('high', {"1": "A", "2": "B", "3": "C"}),
+                              ('mid', {"1": "B", "2": "", "3": "C"})):
+            sheet = StudentAnswerSheet.objects.create(exam=self.exam, student_answers=answers)
+            sheet.calculate_result()
+            self.sheets[name] = sheet.sheet_code
+
+    def _export(self, **params):
+        response = self.client.get('/api/student-answer-sheets/export_results/', {
+            'exam_id': self.exam.pk, **params,
+        })
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def _rows(self, worksheet):
+        # Linhas em branco vêm como tuplas de None
+        return [row for row in worksheet.iter_rows(values_only=True) if any(value is not None for value in row)]
+
+    def test_summary_workbook(self):
+        response, content = self._export(detailed='false')
+
+        self.assertEqual(
+            response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        workbook = openpyxl.load_workbook(io.BytesIO(content))
+        self.assertEqual(workbook.sheetnames, ['Results'])
+        rows = [row[:4] for row in self._rows(workbook['Results'])]
+        self.assertEqual(rows[0][0], "AVALIAÇÃO: Matemática")
+        self.assertEqual(rows[1], ('CODE', 'ITENS CORRETOS', 'ITENS INCORRETOS', 'PERCENTAGE'))
+        self.assertEqual(rows[2:5], [
+            (self.sheets['high'], 3, 0, '100.00%'),
+            (self.sheets['mid'], 2, 1, '66.67%'),
+            (self.sheets['low'], 1, 2, '33.33%'),
+        ])
+        self.assertEqual(rows[5][0], 'STATISTICS')
+        self.assertEqual(rows[6][:2], ('Total students:', 3))
+        self.assertEqual(rows[7][:2], ('Average correct items:', '2.00'))
+        self.assertEqual(rows[8][:2], ('Average percentage:', '66.67%'))
+
+    def test_detailed_workbook(self):
+        _, content = self._export()
+
+        workbook = openpyxl.load_workbook(io.BytesIO(content))
+        self.assertEqual(workbook.sheetnames, ['Resultados Resumidos', 'Respostas Detalhadas'])
+        summary = [row[:4] for row in self._rows(workbook['Resultados Resumidos'])]
+        self.assertEqual(summary[1], ('Código', 'Itens Corretos', 'Itens Incorretos', 'Percentual'))
+        self.assertEqual([row[0] for row in summary[2:]], [self.sheets[name] for name in ('high', 'mid', 'low')])
+
+        details = self._rows(workbook['Respostas Detalhadas'])
+        self.assertEqual(details[1], ('CODE', 'Q1', 'Q2', 'Q3', 'CORRETO', 'INCORRETO', '%'))
+        # A questão 2 foi anulada: certa para todos
+        self.assertEqual(details[2:], [
+            (self.sheets['high'], 'A ✓', 'B ✓', 'C ✓', 3, 0, '100.00%'),
+            (self.sheets['mid'], 'B ✗', '- ✓', 'C ✓', 2, 1, '66.67%'),
+            (self.sheets['low'], 'D ✗', '- ✓', '- ✗', 1, 2, '33.33%'),
+        ])
+
+    def test_csv(self):
+        response, content = self._export(file_type='csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(content.decode().splitlines(), [
+            'CODE,Q1,Q2,Q3,CORRETO,INCORRETO,%',
+            f"{self.sheets['high']},A ✓,B ✓,C ✓,3,0,100.00",
+            f"{self.sheets['mid']},B ✗,- ✓,C ✓,2,1,66.67",
+            f"{self.sheets['low']},D ✗,- ✓,- ✗,1,2,33.33",
+        ])
+
+
+class StatisticsInvalidationTests(TestCase):
+    """Exclusões de gabaritos invalidam as estatísticas sem uma consulta por linha."""
+
+    def test_exam_delete_fast_deletes_sheets(self):
+        exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+        StudentAnswerSheet.objects.bulk_create(
+            StudentAnswerSheet(exam=exam, sheet_code=f"T{number:05d}") for number in range(500)
+        )
+        with self.assertNumQueries(4):
+            exam.delete()
+        self.assertFalse(StudentAnswerSheet.objects.exists())
+
+    def _cached_statistics(self):
+        exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+        CorrectAnswerSheet.objects.create(exam=exam, answers={"1": "A", "2": "B", "3": "C"})
+        sheets = [StudentAnswerSheet.objects.create(exam=exam, student_answers={"1": "A"}) for _ in range(3)]
+        self.assertIsNotNone(exam_statistics(exam))
+        self.assertIsNotNone(cache.get(STATISTICS_CACHE_KEY.format(exam_id=exam.pk)))
+        return exam, sheets
+
+    def _login_admin(self):
+        User = get_user_model()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'senha'))
+
+    def test_admin_delete_invalidates_statistics(self):
+        exam, sheets = self._cached_statistics()
+        self._login_admin()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/admin/exams/studentanswersheet/{sheets[0].pk}/delete/', {'post': 'yes'}
+            )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(cache.get(STATISTICS_CACHE_KEY.format(exam_id=exam.pk)))
+
+    def test_admin_bulk_delete_invalidates_statistics(self):
+        exam, sheets = self._cached_statistics()
+        self._login_admin()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/exams/studentanswersheet/', {
+                'action': 'delete_selected',
+                '_selected_action': [sheet.pk for sheet in sheets[:2]],
+                'post': 'yes',
+            })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(StudentAnswerSheet.objects.filter(exam=exam).count(), 1)
+        self.assertIsNone(cache.get(STATISTICS_CACHE_KEY.format(exam_id=exam.pk)))
+
+
+class CodeAllocatorTests(TestCase):
+    """Blocos reservados em sequência nunca se sobrepõem.
+
+    O teste com vários processos é o comando `stress_sheet_codes`, que
+    precisa de um banco compartilhado entre processos.
+    """
+
+    def test_blocks_are_disjoint_and_valid(self):
+        first = allocate_sheet_codes(500)
+        second = allocate_sheet_codes(500)
+        self.assertEqual(len(set(first) | set(second)), 1000)
+        self.assertTrue(all(is_valid_sheet_code(code) for code in first + second))
+
+
+class RecognitionCacheTests(APITestCase):
+    """Só leituras cujo código corresponde a um gabarito entram no cache."""
+
+    def setUp(self):
+        use_temporary_media(self)
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+        self.sheet = StudentAnswerSheet.objects.create(exam=self.exam)
+
+    def _upload(self):
+        buffer = io.BytesIO()
+        Image.new('L', (60, 80), 255).save(buffer, format='PNG')
+        return self.client.post('/api/student-answer-sheets/upload_answer_sheet/', {
+            'exam': self.exam.pk,
+            'sheet_image': SimpleUploadedFile('scan.png', buffer.getvalue(), content_type='image/png'),
+        })
+
+    def _result(self, sheet_code):
+        return {'sheet_code': sheet_code, 'answers': {"1": "A"}, 'backend': 'local_omr', 'confidence': 1.0}
+
+    def test_unmatched_reads_are_not_cached(self):
+        with mock.patch('exams.views.recognize_answer_sheet', return_value=self._result('NOPE')):
+            response = self._upload()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RecognitionCacheEntry.objects.exists())
+
+        with mock.patch('exams.views.recognize_answer_sheet', return_value=self._result(self.sheet.sheet_code)) as read:
+            first = self._upload()
+            second = self._upload()
+        self.assertEqual((first.status_code, first.data['cached']), (201, False))
+        self.assertEqual((second.status_code, second.data['cached']), (201, True))
+        self.assertEqual(read.call_count, 1)
+
+    def test_backend_settings_are_part_of_the_key(self):
+        from .utils.recognition_cache import cache_key
+
+        with override_settings(ANSWER_SHEET_RECOGNITION_BACKEND='local_omr', OMR_LLM_FALLBACK=False):
+            local = cache_key(b'scan', self.exam)
+        with override_settings(ANSWER_SHEET_RECOGNITION_BACKEND='local_omr', OMR_LLM_FALLBACK=True):
+            fallback = cache_key(b'scan', self.exam)
+        with override_settings(ANSWER_SHEET_RECOGNITION_BACKEND='llm'):
+            llm = cache_key(b'scan', self.exam)
+        self.assertEqual(len({local, fallback, llm}), 3)
+
+
+class WorkerKilled(BaseException):
+    """Simula a morte do processo: não é capturada por run_job."""
+
+
+class JobLeaseTests(TestCase):
+    """Tarefas de trabalhadores que pararam voltam à fila ou falham."""
+
+    def setUp(self):
+        self.exam = Exam.objects.create(subject_name="Matemática", num_questions=3, num_options=4)
+
+    def _running_job(self, attempts, seconds_ago):
+        heartbeat_at = timezone.now() - timedelta(seconds=seconds_ago)
+        return Job.objects.create(
+            kind=Job.KIND_RESULTS_EXCEL, exam=self.exam, status=Job.STATUS_RUNNING,
+            started_at=heartbeat_at, heartbeat_at=heartbeat_at, attempts=attempts,
+        )
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        retry = self._running_job(attempts=1, seconds_ago=600)
+        exhausted = self._running_job(attempts=3, seconds_ago=600)
+        alive = self._running_job(attempts=1, seconds_ago=10)
+
+        self.assertEqual(recover_stale_jobs(lease_timeout=300, max_attempts=3), (1, 1))
+
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(retry.status, Job.STATUS_PENDING)
+        self.assertEqual(exhausted.status, Job.STATUS_FAILED)
+        self.assertEqual(alive.status, Job.STATUS_RUNNING)
+
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.attempts), (retry.pk, 2))
+
+    def test_retried_pdf_job_reuses_its_sheets(self):
+        use_temporary_media(self)
+        job = enqueue_job(Job.KIND_ANSWER_SHEETS_PDF, self.exam, {'quantity': 4}, total=4)
+
+        # O trabalhador morre (ex.: OOM) depois de criar os gabaritos
+        with mock.patch('exams.utils.pdf_generator.render_answer_sheets', side_effect=WorkerKilled):
+            with self.assertRaises(WorkerKilled):
+                run_job(claim_next_job())
+        codes = set(StudentAnswerSheet.objects.filter(exam=self.exam).values_list('sheet_code', flat=True))
+        self.assertEqual(len(codes), 4)
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(recover_stale_jobs(lease_timeout=300, max_attempts=3), (1, 0))
+        retried = run_job(claim_next_job())
+
+        self.assertEqual((retried.pk, retried.status, retried.attempts), (job.pk, Job.STATUS_DONE, 2))
+        self.assertEqual(
+            set(StudentAnswerSheet.objects.filter(exam=self.exam).values_list('sheet_code', flat=True)), codes
+        )
+        with retried.result_file.open('rb') as pdf_file:
+            text = ''.join(page.extract_text() for page in PdfReader(pdf_file).pages)
+        self.assertTrue(all(code in text for code in codes))
+
+
+class ListQueryCountTests(APITestCase):
+    """As listagens fazem um número fixo de consultas, sem N+1."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(5):
+            exam = Exam.objects.create(subject_name=f"Prova {number}", num_questions=3, num_options=4)
+            CorrectAnswerSheet.objects.create(exam=exam, answers={"1": "A", "2": "B", "3": "C"})
+            StudentAnswerSheet.objects.bulk_create(
+                StudentAnswerSheet(exam=exam, sheet_code=f"Q{number}{sheet:04d}", student_answers={"1": "A"})
+                for sheet in range(20)
+            )
+            Job.objects.create(kind=Job.KIND_ANSWER_SHEETS_PDF, exam=exam, params={'quantity': 20})
+        cls.exam = exam
+
+    def assertListQueries(self, url, queries, count):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        results = data['results'] if isinstance(data, dict) else data
+        self.assertEqual(len(results), count)
+
+    def test_exam_list(self):
+        self.assertListQueries('/api/exams/', 1, 5)
+
+    def test_correct_answer_sheet_list(self):
+        self.assertListQueries('/api/correct-answer-sheets/', 1, 5)
+
+    def test_student_answer_sheet_list(self):
+        self.assertListQueries('/api/student-answer-sheets/', 1, 100)
+
+    def test_student_answer_sheet_list_filtered_by_exam(self):
+        # A consulta extra é a validação do filtro `exam`
+        self.assertListQueries(f'/api/student-answer-sheets/?exam={self.exam.pk}', 2, 20)
+
+    def test_student_answer_sheet_list_compact(self):
+        self.assertListQueries('/api/student-answer-sheets/?compact=true&page_size=50', 1, 50)
+
+    def test_job_list(self):
+        self.assertListQueries('/api/jobs/', 1, 5)
+
+    def test_student_answer_sheet_cursor_walks_every_sheet(self):
+        # student_name não está em ordering_fields e é ignorado; submitted_at
+        # se repete entre os gabaritos do bulk_create e o id desempata
+        for ordering in ('student_name', 'submitted_at', '-id'):
+            codes = []
+            url = f'/api/student-answer-sheets/?ordering={ordering}&page_size=30&fields=sheet_code'
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                codes += [sheet['sheet_code'] for sheet in response.data['results']]
+                url = response.data['next']
+            self.assertEqual(len(codes), 100)
+            self.assertEqual(len(set(codes)), 100)
+
+
+class ResultIndexTests(TestCase):
+    """Os índices de resultados são usados pelas consultas da prova."""
+
+    @classmethod
+    def setUpTestData(cls):
+        exams = [
+            Exam.objects.create(subject_name=f"Prova {number}", num_questions=3, num_options=4)
+            for number in range(20)
+        ]
+        StudentAnswerSheet.objects.bulk_create(
+            (
+                StudentAnswerSheet(
+                    exam=exams[row % len(exams)],
+                    sheet_code=f"I{row:06d}",
+                    # Um gabarito em cada 50 ainda não foi lido
+                    student_answers=None if row % 50 == 0 else {"1": "A"},
+                    accuracy_percentage=row % 101,
+                )
+                for row in range(20000)
+            ),
+            batch_size=2000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.exam = exams[0]
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_ranking_uses_accuracy_index(self):
+        sheets = StudentAnswerSheet.objects.filter(exam=self.exam).order_by('-accuracy_percentage')
+        self.assertUsesIndex(sheets, 'sheet_exam_accuracy_idx')
+
+    def test_latest_sheets_use_submitted_index(self):
+        sheets = StudentAnswerSheet.objects.filter(exam=self.exam).order_by('-submitted_at')
+        self.assertUsesIndex(sheets, 'sheet_exam_submitted_idx')
+
+    def test_unanswered_sheets_use_partial_index(self):
+        sheets = StudentAnswerSheet.objects.filter(exam=self.exam, student_answers__isnull=True)
+        self.assertUsesIndex(sheets, 'sheet_exam_unanswered_idx')
+
+
+class DatabaseUrlTests(TestCase):
+    """O modo WAL, gravado no próprio arquivo, só é ativado quando pedido."""
+
+    def test_wal_only_when_requested(self):
+        wal = parse_database_url("sqlite:////tmp/db.sqlite3")
+        plain = parse_database_url("sqlite:////tmp/db.sqlite3", sqlite_wal=False)
+        self.assertIn("journal_mode=WAL", wal["OPTIONS"]["init_command"])
+        self.assertNotIn("journal_mode", plain["OPTIONS"]["init_command"])
+        self.assertEqual(plain["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+
+
+def rasterize_first_page(pdf_bytes, dpi):
+    """
+    Rasteriza a primeira página em tons de cinza com o poppler (pdf2image);
+    sem ele, usa o PyMuPDF se estiver instalado.
+    """
+    from pdf2image import convert_from_bytes
+    from pdf2image.exceptions import PDFInfoNotInstalledError
+
+    try:
+        page = convert_from_bytes(pdf_bytes, dpi=dpi, first_page=1, last_page=1, grayscale=True)[0]
+        return np.array(page)
+    except PDFInfoNotInstalledError:
+        pass
+    try:
+        import pymupdf
+    except ImportError:
+        raise unittest.SkipTest("Nem o poppler nem o PyMuPDF estão instalados.")
+    pixmap = pymupdf.open(stream=pdf_bytes, filetype='pdf')[0].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY)
+    return np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width).copy()
+
+
+class SheetReaderTests(TestCase):
+    """Leitura local: gabarito impresso, preenchido, escaneado torto e lido de volta."""
+
+    DPI = 150
+    NUM_QUESTIONS = 12
+    NUM_OPTIONS = 4
+
+    def _scan(self, code, marks):
+        """Imprime o gabarito, preenche as bolhas `marks` e aplica uma leve perspectiva."""
+        pdf = io.BytesIO()
+        render_answer_sheets(pdf, "Matemática", self.NUM_QUESTIONS, self.NUM_OPTIONS, [code])
+        page = rasterize_first_page(pdf.getvalue(), self.DPI)
+
+        scale = self.DPI / 72
+        centers = layout.bubble_centers(self.NUM_QUESTIONS, self.NUM_OPTIONS)
+        letters = layout.option_letters(self.NUM_OPTIONS)
+        for question, chosen in marks.items():
+            for letter in chosen:
+                x, y = centers[question - 1, letters.index(letter)]
+                center = (
+                    round((layout.PAGE_MARGIN + x) * scale),
+                    round((layout.PAGE_HEIGHT - layout.PAGE_MARGIN - y) * scale),
+                )
+                cv2.circle(page, center, round(layout.CIRCLE_RADIUS * scale), 0, -1)
+
+        # Primeiro gabarito da folha (metade esquerda), fotografado de leve inclinado
+        sheet = page[:, :page.shape[1] // 2]
+        height, width = sheet.shape
+        source = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        target = np.float32([
+            [width * 0.03, height * 0.01], [width * 0.98, height * 0.03],
+            [width * 0.96, height * 0.99], [width * 0.01, height * 0.97],
+        ])
+        return cv2.warpPerspective(
+            sheet, cv2.getPerspectiveTransform(source, target), (width, height), borderValue=255
+        )
+
+    def test_round_trip(self):
+        code = encode_sheet_code(12345)
+        scan = self._scan(code, {1: 'A', 2: 'C', 4: 'AB', 5: 'D', 12: 'B'})
+
+        # O código vem do QR Code, sem cair no OCR
+        with mock.patch('exams.utils.sheet_reader._ocr_sheet_code', return_value=None):
+            result = read_answer_sheet(scan, self.NUM_QUESTIONS, self.NUM_OPTIONS)
+
+        expected = {str(q): BLANK_MARK for q in range(1, self.NUM_QUESTIONS + 1)}
+        expected.update({'1': 'A', '2': 'C', '4': MULTIPLE_MARK, '5': 'D', '12': 'B'})
+        self.assertEqual(result['answers'], expected)
+        self.assertEqual(result['sheet_code'], code)
+        self.assertGreater(result['confidence'], 0.9)
+
+    def test_layout_matches_bubble_centers(self):
+        sheet_layout = layout.build_sheet_layout(self.NUM_QUESTIONS, self.NUM_OPTIONS)
+        centers = layout.bubble_centers(self.NUM_QUESTIONS, self.NUM_OPTIONS)
+        self.assertEqual(len(sheet_layout['bubbles']), self.NUM_QUESTIONS * self.NUM_OPTIONS)
+        for bubble in sheet_layout['bubbles']:
+            option = layout.option_letters(self.NUM_OPTIONS).index(bubble['option'])
+            self.assertEqual(
+                (bubble['x'], bubble['y']), tuple(centers[bubble['question'] - 1, option])
+            )
+
+    def test_parse_sheet_code(self):
+        code = encode_sheet_code(42)
+        self.assertEqual(_parse_sheet_code(f"Código: {code}"), code)
+        # Gabaritos impressos antes do alocador: 5 dígitos hexadecimais
+        self.assertEqual(_parse_sheet_code("Código: 1a2b3"), '1A2B3')
+        # Símbolo de verificação errado
+        wrong = code[:-1] + ('0' if code[-1] != '0' else '1')
+        self.assertIsNone(_parse_sheet_code(f"Código: {wrong}"))
+
+
+class _FlakyLLMHandler(BaseHTTPRequestHandler):
+    """
+    Chat completions que devolvem como código do gabarito o próprio
+    conteúdo da imagem. A imagem N falha nas N % 3 primeiras chamadas
+    (429 com Retry-After e depois 503); a imagem POISONED falha sempre.
+    """
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        image = request['messages'][1]['content'][1]['image_url']['url'].split('base64,', 1)[1]
+        with self.server.lock:
+            attempt = self.server.calls.get(image, 0)
+            self.server.calls[image] = attempt + 1
+
+        if image == self.server.poisoned:
+            self._reply(500, {'error': {'message': 'boom'}})
+        elif attempt < int(image[3:]) % 3:
+            if attempt == 0:
+                self._reply(429, {'error': {'message': 'slow down'}}, {'Retry-After': '0'})
+            else:
+                self._reply(503, {'error': {'message': 'unavailable'}})
+        else:
+            content = json.dumps({'sheet_code': image, 'answers': {'1': 'A'}})
+            self._reply(200, {
+                'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+                'choices': [{
+                    'index': 0, 'finish_reason': 'stop',
+                    'message': {'role': 'assistant', 'content': content},
+                }],
+            })
+
+    def _reply(self, status_code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class LLMDispatcherTests(SimpleTestCase):
+    """Leituras concorrentes com o LLM contra um servidor local."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _FlakyLLMHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.calls = {}
+        self.server.poisoned = 'img07'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_retries_keep_results_in_order(self):
+        images = [f"img{number:02d}" for number in range(12)]
+        dispatcher = LLMDispatcher(
+            api_key='stub', model='stub', base_url=f'http://127.0.0.1:{self.server.server_port}/v1',
+            max_concurrency=4, rate_per_second=50, burst=5, max_retries=2,
+            backoff_base=0.01, backoff_max=0.05,
+        )
+
+        started_at = time.monotonic()
+        results = asyncio.run(dispatcher.recognize_many(images))
+        elapsed = time.monotonic() - started_at
+
+        for image, result in zip(images, results):
+            if image == self.server.poisoned:
+                self.assertIsInstance(result, InternalServerError)
+            else:
+                self.assertEqual(result['sheet_code'], image)
+        # Uma chamada bem-sucedida por imagem, mais as falhas: N % 3 por
+        # imagem e 1 + max_retries para a que sempre falha
+        expected_calls = sum(
+            1 + int(image[3:]) % 3 for image in images if image != self.server.poisoned
+        ) + 3
+        self.assertEqual(sum(self.server.calls.values()), expected_calls)
+        # O balde libera `burst` chamadas de imediato e as demais a 50 por segundo
+        self.assertGreaterEqual(elapsed, (expected_calls - 5) / 50 * 0.9)
+
+    def test_retry_delay(self):
+        dispatcher = LLMDispatcher(api_key='stub', model='stub', backoff_base=1.0, backoff_max=30.0)
+
+        def error(headers):
+            return mock.Mock(response=mock.Mock(headers=headers))
+
+        self.assertEqual(dispatcher._retry_delay(0, error({'retry-after': '2'})), 2.0)
+        self.assertEqual(dispatcher._retry_delay(0, error({'retry-after': '120'})), 30.0)
+        # Sem Retry-After: exponencial com jitter entre metade e o valor cheio
+        delay = dispatcher._retry_delay(3, error({}))
+        self.assertTrue(4.0 <= delay <= 8.0)
+
+
+class ImagePreprocessingTests(SimpleTestCase):
+    """Redução no decode do JPEG, recorte na moldura e reamostragem."""
+
+    DPI = 100
+
+    def _encoded(self, image, image_format):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        return buffer.getvalue()
+
+    def test_jpeg_is_downscaled_while_decoding(self):
+        photo = Image.new('RGB', (4000, 2800), 'white')
+        # Maior lado necessário para o gabarito inteiro no DPI pedido
+        needed = max(layout.SHEET_WIDTH, layout.SHEET_HEIGHT) / 72 * self.DPI
+
+        stats = PreprocessingStats()
+        image = open_upload_image(self._encoded(photo, 'JPEG'), self.DPI, stats)
+
+        self.assertEqual(image.mode, 'L')
+        self.assertLess(max(image.size), 4000)
+        self.assertGreaterEqual(max(image.size), needed)
+        self.assertEqual(stats.steps[0]['step'], 'decode')
+        self.assertEqual(stats.steps[0]['bytes_before'], 4000 * 2800 * 3)
+        self.assertEqual(stats.steps[0]['bytes_after'], image.width * image.height)
+
+        # PNG não tem draft: decodificado no tamanho original
+        self.assertEqual(open_upload_image(self._encoded(photo, 'PNG'), self.DPI).size, (4000, 2800))
+
+    def test_sheet_is_cropped_and_resampled(self):
+        scan = Image.new('RGB', (3000, 4000), 'white')
+        frame = (500, 400, 2500, 3272)
+        ImageDraw.Draw(scan).rectangle(frame, outline='black', width=20)
+        frame_width, frame_height = frame[2] - frame[0] + 1, frame[3] - frame[1] + 1
+
+        cropped = crop_to_sheet(scan.convert('L'))
+        # Moldura mais a margem de 2% de cada lado (busca feita em cópia reduzida)
+        self.assertAlmostEqual(cropped.width, frame_width * 1.04, delta=15)
+        self.assertAlmostEqual(cropped.height, frame_height * 1.04, delta=15)
+
+        stats = PreprocessingStats()
+        prepared = prepare_sheet_image(scan, self.DPI, stats)
+
+        self.assertEqual([step['step'] for step in stats.steps], ['grayscale', 'crop', 'resample'])
+        self.assertTrue(all(step['bytes_saved'] > 0 for step in stats.steps))
+        self.assertEqual(prepared.mode, 'L')
+        dpi = max(prepared.width / layout.SHEET_WIDTH, prepared.height / layout.SHEET_HEIGHT) * 72
+        self.assertAlmostEqual(dpi, self.DPI, delta=1)
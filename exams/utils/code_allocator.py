@@ -0,0 +1,134 @@
+from django.db import connection, transaction
+
+# Crockford base32: no I, L, O or U, so codes survive handwriting and OCR
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+BASE = len(ALPHABET)
+
+PAYLOAD_LENGTH = 6
+CODE_LENGTH = PAYLOAD_LENGTH + 1
+CAPACITY = BASE ** PAYLOAD_LENGTH  # 2**30 codes
+
+# Bijective scramble of the sequence so consecutive sheets do not get
+# consecutive-looking codes. The multiplier must be odd to be invertible.
+_SCRAMBLE_MULTIPLIER = 0x2F0B3A5D
+_SCRAMBLE_MASK = 0x1A2B3C4D & (CAPACITY - 1)
+
+
+def _scramble(value):
+    return ((value * _SCRAMBLE_MULTIPLIER) % CAPACITY) ^ _SCRAMBLE_MASK
+
+
+def _check_symbol(payload):
+    """
+    Computes the Luhn mod 32 check symbol for a payload string.
+    Detects every single-symbol error and most adjacent transpositions.
+    """
+    factor = 2
+    total = 0
+    for char in reversed(payload):
+        addend = factor * ALPHABET.index(char)
+        total += addend // BASE + addend % BASE
+        factor = 1 if factor == 2 else 2
+    return ALPHABET[(BASE - total % BASE) % BASE]
+
+
+def encode_sheet_code(value):
+    """
+    Encodes a sequence number as a fixed-length code with a check symbol.
+
+    Args:
+        value: Integer in the range [0, CAPACITY)
+
+    Returns:
+        str: Code with CODE_LENGTH characters (e.g. '7K2QX9M')
+    """
+    if not 0 <= value < CAPACITY:
+        raise ValueError("Sheet code sequence exhausted.")
+
+    number = _scramble(value)
+    symbols = []
+    for _ in range(PAYLOAD_LENGTH):
+        number, digit = divmod(number, BASE)
+        symbols.append(ALPHABET[digit])
+    payload = ''.join(reversed(symbols))
+    return payload + _check_symbol(payload)
+
+
+def is_valid_sheet_code(code):
+    """
+    Checks length, alphabet and check symbol of a code produced by
+    encode_sheet_code.
+    """
+    if not code or len(code) != CODE_LENGTH:
+        return False
+    if any(char not in ALPHABET for char in code):
+        return False
+    return _check_symbol(code[:-1]) == code[-1]
+
+
+def _reserve_block(size):
+    """
+    Atomically advances the shared sequence by `size` and returns the
+    reserved range. A single UPDATE ... RETURNING statement takes the row
+    lock, so concurrent workers always get disjoint blocks.
+    """
+    from exams.models import SheetCodeSequence
+
+    table = connection.ops.quote_name(SheetCodeSequence._meta.db_table)
+    sql = (
+        f"UPDATE {table} SET next_value = next_value + %s "
+        f"WHERE id = %s RETURNING next_value"
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [size, SheetCodeSequence.SINGLETON_ID])
+            row = cursor.fetchone()
+        if row is None:
+            # Sequence row missing (e.g. database flushed): create it once.
+            SheetCodeSequence.objects.get_or_create(pk=SheetCodeSequence.SINGLETON_ID)
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [size, SheetCodeSequence.SINGLETON_ID])
+                row = cursor.fetchone()
+
+    end = row[0]
+    return range(end - size, end)
+
+
+def reserve_sheet_code_block(quantity):
+    """
+    Reserves `quantity` consecutive sequence values in one round trip.
+
+    The block is enough to rebuild its codes with sheet_codes_for, so
+    callers that must survive a restart (e.g. a retried job) can store
+    the two range bounds instead of every code.
+
+    Returns:
+        range: Reserved sequence values (empty if quantity <= 0)
+    """
+    if quantity <= 0:
+        return range(0)
+    return _reserve_block(quantity)
+
+
+def sheet_codes_for(block):
+    """
+    Encodes every sequence value of a block reserved by
+    reserve_sheet_code_block.
+
+    Returns:
+        list: Codes, in sequence order
+    """
+    return [encode_sheet_code(value) for value in block]
+
+
+def allocate_sheet_codes(quantity):
+    """
+    Reserves `quantity` unique sheet codes in one round trip.
+
+    Codes come from a database-backed sequence, so they never collide and
+    need no SELECT against the answer sheets or retry on IntegrityError.
+
+    Returns:
+        list: Allocated codes, in sequence order
+    """
+    return sheet_codes_for(reserve_sheet_code_block(quantity))
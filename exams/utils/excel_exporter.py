@@ -1,199 +1,276 @@
+import csv
+
+from django.db.models import Avg, Count
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
+from openpyxl.utils import get_column_letter
 from io import BytesIO
 
+from .grading import ANNULLED, BLANK_SYMBOL, UNKEYED, compile_exam_key
+from .sheet_layout import option_letters
+
+# Rows fetched per round trip while exporting
+EXPORT_CHUNK_SIZE = 2000
+SUMMARY_FIELDS = ('sheet_code', 'correct_items', 'incorrect_items', 'accuracy_percentage')
+
+TITLE_STYLE = 'export_title'
+HEADER_STYLE = 'export_header'
+BOLD_STYLE = 'export_bold'
 
-def export_results_to_excel(exam):
+
+def _result_rows(exam, *extra_fields):
     """
-    Exports the results of answer sheets for an exam to an Excel file.
-    
-    Args:
-        exam: Instance of the Exam model
-    
-    Returns:
-        BytesIO: Buffer containing the generated Excel file
+    Iterates over the exam's results as tuples, best scores first,
+    without loading model instances.
     """
-    # Create a new workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Results"
+    return (
+        exam.student_answer_sheets
+        .order_by('-accuracy_percentage')
+        .values_list(*SUMMARY_FIELDS, *extra_fields)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
 
-    # Configure header
-    ws['A1'] = f"AVALIAÇÃO: {exam.subject_name}"
-    ws['A1'].font = Font(bold=True, size=14)
-    ws.merge_cells('A1:E1')
 
-    # Column headers
-    headers = ['CODE', 'ITENS CORRETOS', 'ITENS INCORRETOS', 'PERCENTAGE']
+def _result_statistics(exam):
+    """Totals and averages computed by the database in one query."""
+    return exam.student_answer_sheets.aggregate(
+        total_students=Count('id'),
+        avg_correct=Avg('correct_items'),
+        avg_percentage=Avg('accuracy_percentage'),
+    )
+
+
+def _answer_key_letters(exam):
+    """
+    Returns the key as one letter per question (None for annulled
+    questions, '' for questions missing from the key) and an error
+    message when the details cannot be built.
+    """
+    try:
+        key = compile_exam_key(exam)
+    except ValueError as e:
+        return None, str(e)
+    if key is None:
+        return None, "Exam has no correct answer sheet."
+
+    letters = option_letters(exam.num_options)
+    symbols = {ANNULLED: None, UNKEYED: ''}
+    return [symbols[code] if code < 0 else letters[code] for code in key.tolist()], None
+
+
+def _answer_cells(answer_codes, key_letters, num_questions):
+    """
+    Returns one cell per question with the student's answer, marked as
+    correct or incorrect (annulled questions are correct for everyone).
+    """
+    if not answer_codes:
+        return ['-'] * num_questions
+
+    answer_codes = answer_codes.ljust(num_questions, BLANK_SYMBOL)
+    cells = []
+    for question, correct_answer in enumerate(key_letters):
+        student_answer = answer_codes[question]
+        if correct_answer is None or student_answer == correct_answer:
+            cells.append(f"{student_answer} ✓")
+        else:
+            cells.append(f"{student_answer} ✗")
+    return cells
+
+
+def _detail_headers(exam):
+    headers = ['CODE']
+    for q in range(1, exam.num_questions + 1):
+        headers.append(f'Q{q}')
+    headers.extend(['CORRETO', 'INCORRETO', '%'])
+    return headers
+
+
+def _new_workbook():
+    """
+    Creates a write-only workbook: rows are serialized to disk as they are
+    appended, so memory stays flat however many sheets are exported.
+    Styles are registered once as named styles instead of per cell.
+    """
+    wb = Workbook(write_only=True)
+
+    title = NamedStyle(name=TITLE_STYLE)
+    title.font = Font(bold=True, size=14)
+    wb.add_named_style(title)
+
+    header = NamedStyle(name=HEADER_STYLE)
+    header.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    header.font = Font(bold=True, color="FFFFFF")
+    header.alignment = Alignment(horizontal='center', vertical='center')
+    wb.add_named_style(header)
+
+    bold = NamedStyle(name=BOLD_STYLE)
+    bold.font = Font(bold=True)
+    wb.add_named_style(bold)
+
+    return wb
+
+
+def _styled(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def _append_title(ws, title, merge_range=None):
+    ws.append([_styled(ws, title, TITLE_STYLE)])
+    if merge_range:
+        ws.merged_cells.add(merge_range)
+
+
+def _append_headers(ws, headers):
     ws.append([])  # Blank line
-    ws.append(headers)
+    ws.append([_styled(ws, header, HEADER_STYLE) for header in headers])
 
-    # Style headers
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
 
-    for col in range(1, len(headers) + 1):
-        cell = ws.cell(row=3, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
+def _save(wb, output):
+    buffer = output if output is not None else BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    return buffer
 
-    # Fetch all student answer sheets for this exam
-    student_sheets = exam.student_answer_sheets.all().order_by('-accuracy_percentage')
 
-    # Add data
-    for sheet in student_sheets:
-        ws.append([
-            sheet.sheet_code,
-            sheet.correct_items,
-            sheet.incorrect_items,
-            f"{float(sheet.accuracy_percentage):.2f}%"
-        ])
+def export_results_to_excel(exam, output=None):
+    """
+    Exports the results of answer sheets for an exam to an Excel file.
+    
+    Args:
+        exam: Instance of the Exam model
+        output: Binary file-like object to write to (a new BytesIO if omitted)
+    
+    Returns:
+        File-like object containing the generated Excel file, rewound
+    """
+    wb = _new_workbook()
+    ws = wb.create_sheet(title="Results")
 
-    # Adjust column widths
+    # Column widths must be set before the first row in write-only mode
     ws.column_dimensions['A'].width = 20
     ws.column_dimensions['C'].width = 10
     ws.column_dimensions['D'].width = 10
     ws.column_dimensions['E'].width = 15
 
-    # Add statistics at the end
-    if student_sheets.exists():
-        ws.append([])  # Blank line
-        ws.append(['STATISTICS'])
-        ws.cell(row=ws.max_row, column=1).font = Font(bold=True)
+    # Configure header
+    _append_title(ws, f"AVALIAÇÃO: {exam.subject_name}", 'A1:E1')
+    _append_headers(ws, ['CODE', 'ITENS CORRETOS', 'ITENS INCORRETOS', 'PERCENTAGE'])
 
-        # Calculate statistics
-        total_students = student_sheets.count()
-        avg_correct = sum([s.correct_items for s in student_sheets]) / total_students if total_students > 0 else 0
-        avg_percentage = sum(
-            [float(s.accuracy_percentage) for s in student_sheets]) / total_students if total_students > 0 else 0
+    # Add data, streamed from the database
+    for sheet_code, correct_items, incorrect_items, accuracy_percentage in _result_rows(exam):
+        ws.append([
+            sheet_code,
+            correct_items,
+            incorrect_items,
+            f"{float(accuracy_percentage):.2f}%"
+        ])
 
+    # Add statistics at the end
+    statistics = _result_statistics(exam)
+    total_students = statistics['total_students']
+    if total_students > 0:
+        avg_correct = float(statistics['avg_correct'] or 0)
+        avg_percentage = float(statistics['avg_percentage'] or 0)
+
+        ws.append([])  # Blank line
+        ws.append([_styled(ws, 'STATISTICS', BOLD_STYLE)])
         ws.append(['Total students:', total_students])
         ws.append(['Average correct items:', f"{avg_correct:.2f}"])
         ws.append(['Average percentage:', f"{avg_percentage:.2f}%"])
 
-    # Save to buffer
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    return buffer
+    return _save(wb, output)
 
 
-def export_detailed_results_to_excel(exam):
+def export_detailed_results_to_excel(exam, output=None):
     """
     Exports detailed results of answer sheets for an exam to Excel,
     including the answers for each question.
     
     Args:
         exam: Instance of the Exam model
+        output: Binary file-like object to write to (a new BytesIO if omitted)
     
     Returns:
-        BytesIO: Buffer containing the generated Excel file
+        File-like object containing the generated Excel file, rewound
     """
-    wb = Workbook()
+    wb = _new_workbook()
 
     # Sheet 1: Summary
-    ws_summary = wb.active
-    ws_summary.title = "Resultados Resumidos"
-
-    ws_summary['A1'] = f"EXAM: {exam.subject_name}"
-    ws_summary['A1'].font = Font(bold=True, size=14)
-    ws_summary.merge_cells('A1:E1')
-
-    headers_summary = ['Código', 'Itens Corretos', 'Itens Incorretos', 'Percentual']
-    ws_summary.append([])
-    ws_summary.append(headers_summary)
-
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-
-    for col in range(1, len(headers_summary) + 1):
-        cell = ws_summary.cell(row=3, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-
-    student_sheets = exam.student_answer_sheets.all().order_by('-accuracy_percentage')
-
-    for sheet in student_sheets:
-        ws_summary.append([
-            sheet.sheet_code,
-            sheet.correct_items,
-            sheet.incorrect_items,
-            f"{float(sheet.accuracy_percentage):.2f}%"
-        ])
-
+    ws_summary = wb.create_sheet(title="Resultados Resumidos")
     ws_summary.column_dimensions['A'].width = 20
     ws_summary.column_dimensions['B'].width = 15
     ws_summary.column_dimensions['C'].width = 15
     ws_summary.column_dimensions['D'].width = 15
 
+    _append_title(ws_summary, f"EXAM: {exam.subject_name}", 'A1:E1')
+    _append_headers(ws_summary, ['Código', 'Itens Corretos', 'Itens Incorretos', 'Percentual'])
+
     # Sheet 2: Detailed Answers
     ws_details = wb.create_sheet(title="Respostas Detalhadas")
+    ws_details.column_dimensions['A'].width = 20
+    for col_idx in range(2, 2 + exam.num_questions):
+        ws_details.column_dimensions[get_column_letter(col_idx)].width = 8
+
+    _append_title(ws_details, f"Detalhes de respostas - {exam.subject_name}")
+    _append_headers(ws_details, _detail_headers(exam))
+
+    # The details need the answer key; without it only the summary is filled
+    key_letters, details_error = _answer_key_letters(exam)
+
+    # Fill both sheets in a single pass over the rows. Answers come from
+    # the packed answer_codes column instead of the JSON.
+    for sheet_code, correct_items, incorrect_items, accuracy_percentage, answer_codes in _result_rows(
+            exam, 'answer_codes'):
+        percentage = f"{float(accuracy_percentage):.2f}%"
+        ws_summary.append([sheet_code, correct_items, incorrect_items, percentage])
+
+        if key_letters is not None:
+            ws_details.append([
+                sheet_code,
+                *_answer_cells(answer_codes, key_letters, exam.num_questions),
+                correct_items,
+                incorrect_items,
+                percentage,
+            ])
 
-    ws_details['A1'] = f"Detalhes de respostas - {exam.subject_name}"
-    ws_details['A1'].font = Font(bold=True, size=14)
-
-    # Create dynamic headers based on number of questions
-    headers_details = ['CODE']
-    for q in range(1, exam.num_questions + 1):
-        headers_details.append(f'Q{q}')
-    headers_details.extend(['CORRETO', 'INCORRETO', '%'])
-
-    ws_details.append([])
-    ws_details.append(headers_details)
-
-    for col in range(1, len(headers_details) + 1):
-        cell = ws_details.cell(row=3, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
+    if details_error:
+        ws_details.append(['Error generating details:', details_error])
 
-    # Add detailed data
-    try:
-        correct_answer_sheet = exam.correct_answer_sheet
-        correct_answers = correct_answer_sheet.answers
-
-        for sheet in student_sheets:
-            row_data = [
-                sheet.sheet_code,
-            ]
-
-            # Add answers for each question
-            if sheet.student_answers:
-                for q in range(1, exam.num_questions + 1):
-                    student_answer = sheet.student_answers.get(str(q), '-')
-                    correct_answer = correct_answers.get(str(q), '-')
-
-                    # Mark if correct or incorrect
-                    if student_answer == correct_answer:
-                        row_data.append(f"{student_answer} ✓")
-                    else:
-                        row_data.append(f"{student_answer} ✗")
-            else:
-                row_data.extend(['-'] * exam.num_questions)
-
-            row_data.extend([
-                sheet.correct_items,
-                sheet.incorrect_items,
-                f"{float(sheet.accuracy_percentage):.2f}%"
-            ])
+    return _save(wb, output)
 
-            ws_details.append(row_data)
 
-        # Adjust column widths
-        ws_details.column_dimensions['A'].width = 20
-        ws_details.column_dimensions['B'].width = 30
-        for col_idx in range(3, 3 + exam.num_questions):
-            ws_details.column_dimensions[chr(64 + col_idx)].width = 8
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
 
-    except Exception as e:
-        ws_details.append(['Error generating details:', str(e)])
+    def write(self, value):
+        return value
 
-    # Save to buffer
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
 
-    return buffer
+def iter_results_csv(exam, detailed=True):
+    """
+    Yields the results as CSV lines, straight from the database iterator,
+    for a StreamingHttpResponse. Much faster than XLSX for large exams.
+    """
+    writer = csv.writer(_Echo())
+    key_letters = None
+    if detailed:
+        key_letters, _ = _answer_key_letters(exam)
+
+    if key_letters is not None:
+        yield writer.writerow(_detail_headers(exam))
+        for sheet_code, correct_items, incorrect_items, accuracy_percentage, answer_codes in _result_rows(
+                exam, 'answer_codes'):
+            yield writer.writerow([
+                sheet_code,
+                *_answer_cells(answer_codes, key_letters, exam.num_questions),
+                correct_items,
+                incorrect_items,
+                f"{float(accuracy_percentage):.2f}",
+            ])
+    else:
+        yield writer.writerow(['CODE', 'ITENS CORRETOS', 'ITENS INCORRETOS', 'PERCENTAGE'])
+        for sheet_code, correct_items, incorrect_items, accuracy_percentage in _result_rows(exam):
+            yield writer.writerow([sheet_code, correct_items, incorrect_items, f"{float(accuracy_percentage):.2f}"])
@@ -0,0 +1,339 @@
+"""
+Vectorized grading: answer keys and student answers are compiled to
+int8 code arrays (one code per question) and compared all at once.
+
+Codes:
+    0..N-1  option index (A=0, B=1, ...)
+    BLANK   question left blank
+    MULTIPLE  more than one option marked, or an unreadable mark
+    ANNULLED  annulled question in the key ('X'); every student gets it right
+    UNKEYED   question missing from the key; no answer matches it
+
+Student answers are also stored packed as text, one ASCII character per
+question (StudentAnswerSheet.answer_codes): the option letter, BLANK_SYMBOL
+or MULTIPLE_SYMBOL. Unpacking is a table lookup, and SUBSTR on the column
+lets the database aggregate single questions.
+"""
+import numpy as np
+from django.db import transaction
+
+from .sheet_layout import option_letters
+
+BLANK = -1
+MULTIPLE = -2
+ANNULLED = -3
+UNKEYED = -4
+
+ANNULLED_MARK = 'X'
+CODE_DTYPE = np.int8
+
+BLANK_SYMBOL = '-'
+MULTIPLE_SYMBOL = '*'
+
+# Sheet ids per UPDATE statement when persisting a regrade
+REGRADE_BATCH_SIZE = 1000
+SCORE_FIELDS = ['correct_items', 'incorrect_items', 'accuracy_percentage']
+
+
+def _letter_codes(num_options):
+    return {letter: index for index, letter in enumerate(option_letters(num_options))}
+
+
+def _question_index(question_num, num_questions):
+    try:
+        index = int(question_num) - 1
+    except (TypeError, ValueError):
+        return None
+    return index if 0 <= index < num_questions else None
+
+
+def _question_indexes(num_questions):
+    return {str(number): number - 1 for number in range(1, num_questions + 1)}
+
+
+def _encode_row(answers, num_questions, letter_codes, question_indexes):
+    # Plain list and dict lookups: per-item NumPy assignment and int()
+    # parsing of the JSON keys dominate the cost otherwise
+    row = [BLANK] * num_questions
+    for question_num, answer in (answers or {}).items():
+        index = question_indexes.get(question_num)
+        if index is None:
+            index = _question_index(question_num, num_questions)
+        if index is None or answer is None or answer == '':
+            continue
+        code = letter_codes.get(answer)
+        if code is None:
+            code = letter_codes.get(str(answer).strip().upper(), MULTIPLE)
+        row[index] = code
+    return row
+
+
+def encode_answers(answers, num_questions, num_options):
+    """
+    Encodes a student's answers dict ({"1": "A", ...}) as a code array.
+
+    Missing questions and '' are BLANK; '*' and any value that is not an
+    option letter are MULTIPLE.
+
+    Returns:
+        numpy.ndarray: Shape (num_questions,), dtype int8
+    """
+    row = _encode_row(answers, num_questions, _letter_codes(num_options), _question_indexes(num_questions))
+    return np.array(row, dtype=CODE_DTYPE)
+
+
+def encode_answer_matrix(answers_list, num_questions, num_options):
+    """
+    Encodes many answers dicts as one (N, num_questions) int8 matrix.
+    """
+    letter_codes = _letter_codes(num_options)
+    question_indexes = _question_indexes(num_questions)
+    rows = [
+        _encode_row(answers, num_questions, letter_codes, question_indexes)
+        for answers in answers_list
+    ]
+    return np.array(rows, dtype=CODE_DTYPE).reshape(len(rows), num_questions)
+
+
+def pack_answers(codes):
+    """
+    Packs a code array into the answer_codes text form (e.g. 'AC-*B').
+    """
+    symbols = []
+    for code in np.asarray(codes).tolist():
+        if code >= 0:
+            symbols.append(chr(65 + code))
+        elif code == BLANK:
+            symbols.append(BLANK_SYMBOL)
+        else:
+            symbols.append(MULTIPLE_SYMBOL)
+    return ''.join(symbols)
+
+
+def _unpack_table(num_options):
+    table = np.full(256, MULTIPLE, dtype=CODE_DTYPE)
+    table[ord(BLANK_SYMBOL)] = BLANK
+    table[65:65 + num_options] = np.arange(num_options)
+    return table
+
+
+def unpack_answer_matrix(packed_list, num_questions, num_options):
+    """
+    Decodes many answer_codes strings into an (N, num_questions) int8
+    matrix with one vectorized table lookup. Strings shorter than
+    num_questions are padded with blanks.
+    """
+    padded = b''.join(
+        packed.encode('ascii')[:num_questions].ljust(num_questions, BLANK_SYMBOL.encode('ascii'))
+        for packed in packed_list
+    )
+    raw = np.frombuffer(padded, dtype=np.uint8).reshape(len(packed_list), num_questions)
+    return _unpack_table(num_options)[raw]
+
+
+def compile_answer_key(answers, num_questions, num_options, reject_unknown_questions=False):
+    """
+    Compiles the CorrectAnswerSheet.answers JSON into a code array.
+
+    Only 'X' annuls a question. Questions without an answer in the key are
+    UNKEYED: no student answer matches them, so they count as incorrect,
+    as they did before grading was vectorized.
+
+    Args:
+        reject_unknown_questions: Raise ValueError for question numbers
+            outside 1..num_questions instead of ignoring them
+
+    Returns:
+        numpy.ndarray: Shape (num_questions,), dtype int8
+    """
+    if answers is not None and not isinstance(answers, dict):
+        raise ValueError("O gabarito deve ser um objeto no formato {\"1\": \"A\", ...}")
+
+    letter_codes = _letter_codes(num_options)
+    key = np.full(num_questions, UNKEYED, dtype=CODE_DTYPE)
+    for question_num, answer in (answers or {}).items():
+        index = _question_index(question_num, num_questions)
+        if index is None:
+            if reject_unknown_questions:
+                raise ValueError(f"Questão inexistente no gabarito: {question_num}")
+            continue
+        if not answer:
+            continue
+        answer = str(answer).strip().upper()
+        if answer == ANNULLED_MARK:
+            key[index] = ANNULLED
+            continue
+        if answer not in letter_codes:
+            raise ValueError(f"Resposta inválida no gabarito para a questão {question_num}: {answer}")
+        key[index] = letter_codes[answer]
+
+    return key
+
+
+def grade_matrix(matrix, key):
+    """
+    Grades an (N, Q) answer code matrix against a compiled key.
+
+    Blank and multiple marks, and every answer to an UNKEYED question,
+    count as incorrect, so correct + incorrect always equals the number
+    of questions.
+
+    Returns:
+        tuple: (correct, incorrect, accuracy_percentage) arrays of shape (N,)
+    """
+    num_questions = key.shape[0]
+    matrix = np.asarray(matrix, dtype=CODE_DTYPE).reshape(-1, num_questions)
+
+    correct = ((matrix == key) | (key == ANNULLED)).sum(axis=1, dtype=np.int32)
+    incorrect = num_questions - correct
+    if num_questions > 0:
+        accuracy = np.round(correct * 100.0 / num_questions, 2)
+    else:
+        accuracy = np.zeros(correct.shape[0])
+    return correct, incorrect, accuracy
+
+
+def compile_exam_key(exam):
+    """
+    Returns the compiled answer key of an exam, or None if it has none.
+    """
+    from exams.models import CorrectAnswerSheet
+
+    try:
+        answers = exam.correct_answer_sheet.answers
+    except CorrectAnswerSheet.DoesNotExist:
+        return None
+    return compile_answer_key(answers, exam.num_questions, exam.num_options)
+
+
+def _load_answers(exam, *extra_fields):
+    rows = (
+        exam.student_answer_sheets
+        .exclude(answer_codes='')
+        .order_by('id')
+        .values_list('id', 'answer_codes', *extra_fields)
+    )
+    ids = []
+    packed_list = []
+    extra = []
+    for row in rows.iterator(chunk_size=2000):
+        ids.append(row[0])
+        packed_list.append(row[1])
+        extra.append(row[2:])
+    matrix = unpack_answer_matrix(packed_list, exam.num_questions, exam.num_options)
+    return ids, matrix, extra
+
+
+def load_answer_matrix(exam):
+    """
+    Loads the packed answers of every answered sheet of an exam.
+
+    Returns:
+        tuple: (sheet ids, (N, num_questions) int8 code matrix), ordered by id
+    """
+    ids, matrix, _ = _load_answers(exam)
+    return ids, matrix
+
+
+def grade_exam(exam, key=None):
+    """
+    Grades every answered sheet of an exam in one vectorized pass.
+
+    Args:
+        exam: Exam to grade
+        key: Compiled key (compile_exam_key is used when omitted)
+
+    Returns:
+        dict or None: {'ids', 'correct', 'incorrect', 'accuracy'} arrays in
+        the same order, or None if the exam has no answer key
+    """
+    if key is None:
+        key = compile_exam_key(exam)
+        if key is None:
+            return None
+
+    ids, matrix, _ = _load_answers(exam)
+    correct, incorrect, accuracy = grade_matrix(matrix, key)
+    return {
+        'ids': np.asarray(ids, dtype=np.int64),
+        'correct': correct,
+        'incorrect': incorrect,
+        'accuracy': accuracy,
+    }
+
+
+def regrade_exam(exam, batch_size=REGRADE_BATCH_SIZE):
+    """
+    Regrades every answered sheet of an exam against its current key and
+    writes back only the sheets whose score changed.
+
+    There are at most num_questions + 1 distinct scores, so the changed
+    sheets are grouped by score and each group is written with chunked
+    `UPDATE ... WHERE id IN (...)` statements, all in one transaction.
+    This is much cheaper than bulk_update, whose CASE WHEN per row grows
+    with every sheet.
+
+    Returns:
+        int: Number of sheets updated
+    """
+    from exams.models import StudentAnswerSheet
+
+    key = compile_exam_key(exam)
+    if key is None:
+        return 0
+
+    ids, matrix, current = _load_answers(exam, *SCORE_FIELDS)
+    if not ids:
+        return 0
+
+    correct, incorrect, accuracy = grade_matrix(matrix, key)
+
+    current = np.asarray(current, dtype=np.float64)
+    changed = (
+        (correct != current[:, 0])
+        | (incorrect != current[:, 1])
+        | (np.abs(accuracy - current[:, 2]) >= 0.005)
+    )
+    changed_rows = np.flatnonzero(changed)
+    ids = np.asarray(ids, dtype=np.int64)
+
+    with transaction.atomic():
+        for score in np.unique(correct[changed_rows]):
+            rows = changed_rows[correct[changed_rows] == score]
+            row = rows[0]
+            values = {
+                'correct_items': int(correct[row]),
+                'incorrect_items': int(incorrect[row]),
+                'accuracy_percentage': round(float(accuracy[row]), 2),
+            }
+            for start in range(0, len(rows), batch_size):
+                chunk = ids[rows[start:start + batch_size]].tolist()
+                StudentAnswerSheet.objects.filter(pk__in=chunk).update(**values)
+    return len(changed_rows)
+
+
+def count_choices(exam, question_number):
+    """
+    Counts, in the database, how many sheets chose each option on one
+    question, from the packed answer_codes column.
+
+    Returns:
+        dict: {'A': n, 'B': n, ..., BLANK_SYMBOL: n, MULTIPLE_SYMBOL: n}
+    """
+    from django.db.models import Count
+    from django.db.models.functions import Substr
+
+    rows = (
+        exam.student_answer_sheets
+        .exclude(answer_codes='')
+        .annotate(choice=Substr('answer_codes', question_number, 1))
+        .values('choice')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    counts = {symbol: 0 for symbol in option_letters(exam.num_options) + [BLANK_SYMBOL, MULTIPLE_SYMBOL]}
+    for row in rows:
+        # Strings packed before the exam grew more questions end early
+        choice = row['choice'] or BLANK_SYMBOL
+        counts[choice] = counts.get(choice, 0) + row['total']
+    return counts
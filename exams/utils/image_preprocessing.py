@@ -0,0 +1,145 @@
+"""
+Image preprocessing before recognition: decode-time downscaling of JPEG
+uploads, grayscale conversion, cropping to the sheet frame and resampling
+to a target resolution.
+
+Every step is timed and its input/output size recorded, so the savings
+can be checked in the logs.
+"""
+import io
+import logging
+import math
+import time
+
+import numpy as np
+from PIL import Image
+
+from .sheet_layout import SHEET_HEIGHT, SHEET_WIDTH
+
+logger = logging.getLogger(__name__)
+
+# Extra border kept around the detected frame, as a share of its size
+FRAME_CROP_MARGIN = 0.02
+# Images up to this much above the target resolution are left as they are
+DPI_TOLERANCE = 1.1
+
+
+def _pixel_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class PreprocessingStats:
+    """
+    Time and size (in uncompressed pixel bytes, or encoded bytes for the
+    final payload) of each preprocessing step.
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def record(self, step, started_at, bytes_before, bytes_after):
+        self.steps.append({
+            'step': step,
+            'ms': round((time.perf_counter() - started_at) * 1000, 2),
+            'bytes_before': bytes_before,
+            'bytes_after': bytes_after,
+            'bytes_saved': bytes_before - bytes_after,
+        })
+
+    def log(self, label):
+        for step in self.steps:
+            logger.info(
+                "%s: %s took %.2f ms, %d -> %d bytes (%d saved)",
+                label, step['step'], step['ms'],
+                step['bytes_before'], step['bytes_after'], step['bytes_saved'],
+            )
+
+
+def open_upload_image(file_bytes, dpi, stats=None):
+    """
+    Opens an uploaded image as grayscale, at no more than the resolution
+    needed for a sheet at `dpi`.
+
+    JPEG files are downscaled while decoding with Image.draft, which skips
+    most of the IDCT work instead of decoding the full photo and resizing.
+    """
+    started_at = time.perf_counter()
+    image = Image.open(io.BytesIO(file_bytes))
+    full_bytes = image.width * image.height * len(image.getbands())
+
+    if image.format == 'JPEG':
+        # The sheet may fill the whole photo, so size for the sheet itself
+        longest = max(SHEET_WIDTH, SHEET_HEIGHT) / 72 * dpi
+        scale = longest / max(image.size)
+        if scale < 1:
+            image.draft('L', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+    image = image.convert("L")
+    if stats is not None:
+        stats.record('decode', started_at, full_bytes, _pixel_bytes(image))
+    return image
+
+
+def to_grayscale(image, stats=None):
+    """Converts an image to single-channel 8-bit grayscale."""
+    if image.mode == "L":
+        return image
+    started_at = time.perf_counter()
+    gray = image.convert("L")
+    if stats is not None:
+        stats.record('grayscale', started_at, _pixel_bytes(image), _pixel_bytes(gray))
+    return gray
+
+
+def crop_to_sheet(image, stats=None):
+    """
+    Crops a grayscale image to the printed sheet frame, plus a small
+    margin. Images where no frame is found are returned unchanged.
+    """
+    from .sheet_reader import locate_sheet_frame
+
+    started_at = time.perf_counter()
+    x, y, width, height = locate_sheet_frame(np.asarray(image))
+    margin_x = width * FRAME_CROP_MARGIN
+    margin_y = height * FRAME_CROP_MARGIN
+    box = (
+        max(0, int(x - margin_x)),
+        max(0, int(y - margin_y)),
+        min(image.width, math.ceil(x + width + margin_x)),
+        min(image.height, math.ceil(y + height + margin_y)),
+    )
+    if box == (0, 0, image.width, image.height):
+        return image
+
+    cropped = image.crop(box)
+    if stats is not None:
+        stats.record('crop', started_at, _pixel_bytes(image), _pixel_bytes(cropped))
+    return cropped
+
+
+def resample_to_dpi(image, dpi, stats=None):
+    """
+    Downsamples an image cropped to the sheet so it has about `dpi` pixels
+    per inch of printed sheet. Smaller images are never upscaled.
+    """
+    current_dpi = max(image.width / SHEET_WIDTH, image.height / SHEET_HEIGHT) * 72
+    if current_dpi <= dpi * DPI_TOLERANCE:
+        return image
+
+    started_at = time.perf_counter()
+    factor = dpi / current_dpi
+    size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+    resized = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if stats is not None:
+        stats.record('resample', started_at, _pixel_bytes(image), _pixel_bytes(resized))
+    return resized
+
+
+def prepare_sheet_image(image, dpi, stats=None):
+    """
+    Grayscale, crop to the sheet frame and resample to `dpi`: the smallest
+    image that still holds everything needed to read the sheet.
+    """
+    image = to_grayscale(image, stats)
+    image = crop_to_sheet(image, stats)
+    return resample_to_dpi(image, dpi, stats)
@@ -0,0 +1,130 @@
+"""
+Item analysis of an exam, computed in one vectorized pass over the
+(N, Q) answer code matrix: difficulty, point-biserial discrimination,
+option distribution, score histogram and KR-20 reliability.
+
+Results are cached per exam and invalidated by the signals in
+exams.signals whenever a sheet or the answer key changes.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .grading import ANNULLED, BLANK, MULTIPLE, UNKEYED, compile_exam_key, load_answer_matrix
+from .sheet_layout import option_letters
+
+CACHE_KEY = "exam-statistics:{exam_id}"
+
+
+def _rounded(value, digits=4):
+    """Rounds a NumPy scalar for JSON, with NaN (undefined) as None."""
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+
+def _key_symbol(code, letters):
+    if code == ANNULLED:
+        return 'X'
+    if code == UNKEYED:
+        return None
+    return letters[code]
+
+
+def analyze_items(matrix, key, num_options):
+    """
+    Computes the item statistics of an answer code matrix.
+
+    Args:
+        matrix: (N, Q) int8 answer codes
+        key: Compiled answer key, shape (Q,)
+        num_options: Number of options per question
+
+    Returns:
+        dict: Score summary, histogram, KR-20 and per-question statistics
+    """
+    num_sheets, num_questions = matrix.shape
+    # Annulled and unkeyed questions score the same for everyone
+    graded = key >= 0
+
+    scored = (matrix == key) | (key == ANNULLED)
+    scores = scored.sum(axis=1)
+
+    # Difficulty: share of students who got each question right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        difficulty = scored.mean(axis=0) if num_sheets else np.full(num_questions, np.nan)
+
+        # Point-biserial against the rest score (total minus the item),
+        # so an item is not correlated with itself
+        item = scored.astype(np.float64)
+        rest = scores[:, None] - item
+        item_dev = item - item.mean(axis=0)
+        rest_dev = rest - rest.mean(axis=0)
+        covariance = (item_dev * rest_dev).sum(axis=0)
+        discrimination = covariance / np.sqrt((item_dev ** 2).sum(axis=0) * (rest_dev ** 2).sum(axis=0))
+        discrimination[~graded] = np.nan
+
+        # KR-20 over the graded items
+        k = int(graded.sum())
+        p = difficulty[graded]
+        score_variance = scores.var() if num_sheets else np.nan
+        if k > 1 and score_variance > 0:
+            kr20 = (k / (k - 1)) * (1 - (p * (1 - p)).sum() / score_variance)
+        else:
+            kr20 = np.nan
+
+    # Option distribution: one column per option, then blanks and multiple marks
+    columns = [(matrix == option).sum(axis=0) for option in range(num_options)]
+    columns.append((matrix == BLANK).sum(axis=0))
+    columns.append((matrix == MULTIPLE).sum(axis=0))
+    distribution = np.stack(columns, axis=1) if num_questions else np.zeros((0, num_options + 2), int)
+
+    letters = option_letters(num_options)
+    questions = []
+    for index in range(num_questions):
+        counts = distribution[index].tolist()
+        questions.append({
+            'question': index + 1,
+            'key': _key_symbol(key[index], letters),
+            'difficulty': _rounded(difficulty[index]),
+            'discrimination': _rounded(discrimination[index]),
+            'options': dict(zip(letters, counts[:num_options])),
+            'blank': counts[num_options],
+            'multiple': counts[num_options + 1],
+        })
+
+    return {
+        'num_sheets': num_sheets,
+        'num_questions': num_questions,
+        'mean_score': _rounded(scores.mean()) if num_sheets else None,
+        'std_score': _rounded(scores.std()) if num_sheets else None,
+        'kr20': _rounded(kr20),
+        'histogram': np.bincount(scores, minlength=num_questions + 1).tolist(),
+        'questions': questions,
+    }
+
+
+def exam_statistics(exam):
+    """
+    Returns the item analysis of an exam, from the cache when possible.
+
+    Returns:
+        dict or None: Statistics, or None if the exam has no answer key
+    """
+    cache_key = CACHE_KEY.format(exam_id=exam.pk)
+    statistics = cache.get(cache_key)
+    if statistics is not None:
+        return statistics
+
+    key = compile_exam_key(exam)
+    if key is None:
+        return None
+
+    _, matrix = load_answer_matrix(exam)
+    statistics = {'exam': exam.pk, **analyze_items(matrix, key, exam.num_options)}
+    cache.set(cache_key, statistics, settings.STATISTICS_CACHE_TIMEOUT)
+    return statistics
+
+
+def invalidate_exam_statistics(exam_id):
+    """Drops the cached statistics of an exam."""
+    cache.delete(CACHE_KEY.format(exam_id=exam_id))
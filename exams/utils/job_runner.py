@@ -0,0 +1,210 @@
+import logging
+import tempfile
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_job(kind, exam, params=None, total=0):
+    """
+    Registers a background job to be picked up by a `run_jobs` worker.
+
+    Returns:
+        Job: The pending job
+    """
+    from exams.models import Job
+
+    return Job.objects.create(kind=kind, exam=exam, params=params or {}, total=total)
+
+
+def claim_next_job():
+    """
+    Atomically moves the oldest pending job to the running state.
+
+    Uses SKIP LOCKED where the database supports it, and a conditional
+    UPDATE on the status so two workers never run the same job.
+
+    Returns:
+        Job or None: The claimed job, or None if the queue is empty
+    """
+    from exams.models import Job
+
+    with transaction.atomic():
+        job = (
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=Job.STATUS_PENDING)
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        started_at = timezone.now()
+        claimed = Job.objects.filter(pk=job.pk, status=Job.STATUS_PENDING).update(
+            status=Job.STATUS_RUNNING,
+            started_at=started_at,
+            heartbeat_at=started_at,
+            attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return None
+
+    job.status = Job.STATUS_RUNNING
+    job.started_at = started_at
+    job.heartbeat_at = started_at
+    job.attempts += 1
+    return job
+
+
+def recover_stale_jobs(lease_timeout=None, max_attempts=None):
+    """
+    Handles running jobs whose worker stopped renewing the lease (the
+    process died or the machine was restarted): jobs with attempts left go
+    back to the queue, the others are marked as failed.
+
+    Returns:
+        tuple: (requeued, failed) job counts
+    """
+    from exams.models import Job
+
+    lease_timeout = settings.JOB_LEASE_TIMEOUT if lease_timeout is None else lease_timeout
+    max_attempts = settings.JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.STATUS_RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=lease_timeout),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=Job.STATUS_PENDING,
+        started_at=None,
+        heartbeat_at=None,
+        progress=0,
+    )
+    failed = stale.update(
+        status=Job.STATUS_FAILED,
+        error=f"Worker stopped responding after {max_attempts} attempt(s).",
+        finished_at=now,
+    )
+    if requeued or failed:
+        logger.warning("Recovered stale jobs: %d requeued, %d failed", requeued, failed)
+    return requeued, failed
+
+
+class _Heartbeat(threading.Thread):
+    """Renews the lease of a running job until stopped."""
+
+    def __init__(self, job, interval):
+        super().__init__(daemon=True)
+        self.job_id = job.pk
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        from exams.models import Job
+
+        try:
+            while not self.stopped.wait(self.interval):
+                Job.objects.filter(pk=self.job_id, status=Job.STATUS_RUNNING).update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _report_progress(job):
+    from exams.models import Job
+
+    def progress(done):
+        Job.objects.filter(pk=job.pk).update(progress=done)
+
+    return progress
+
+
+def _run_answer_sheets_pdf(job):
+    """
+    Creates the job's blank sheets and renders them to a PDF.
+
+    The reserved code block is stored in the job's params in the same
+    transaction that creates the sheets, so a retry after the worker died
+    re-renders those sheets instead of creating another batch.
+    """
+    from exams.models import Job
+
+    from .code_allocator import sheet_codes_for
+    from .pdf_generator import generate_answer_sheet_pdf
+
+    exam = job.exam
+    quantity = job.params.get('quantity', 1)
+    block = job.params.get('sheet_code_block')
+    codes = sheet_codes_for(range(*block)) if block else None
+
+    def record_block(reserved):
+        job.params = {**job.params, 'sheet_code_block': [reserved.start, reserved.stop]}
+        Job.objects.filter(pk=job.pk).update(params=job.params)
+
+    with tempfile.TemporaryFile() as pdf_file:
+        generate_answer_sheet_pdf(
+            exam, quantity, output=pdf_file, progress=_report_progress(job),
+            codes=codes, on_created=record_block,
+        )
+        pdf_file.seek(0)
+        job.result_file.save(
+            f"answer_sheets_{exam.subject_name}_{job.pk}.pdf", File(pdf_file), save=False
+        )
+
+
+def _run_results_excel(job):
+    from .excel_exporter import export_detailed_results_to_excel, export_results_to_excel
+
+    exam = job.exam
+    export = export_detailed_results_to_excel if job.params.get('detailed', True) else export_results_to_excel
+    with tempfile.TemporaryFile() as excel_file:
+        export(exam, output=excel_file)
+        excel_file.seek(0)
+        job.result_file.save(f"results_{exam.subject_name}_{job.pk}.xlsx", File(excel_file), save=False)
+
+
+JOB_HANDLERS = {
+    'answer_sheets_pdf': _run_answer_sheets_pdf,
+    'results_excel': _run_results_excel,
+}
+
+
+def run_job(job):
+    """
+    Runs a claimed job with the handler for its kind and records the
+    outcome. Errors are stored on the job instead of being raised.
+
+    A heartbeat thread renews the job's lease while the handler runs, so
+    recover_stale_jobs only picks up jobs whose worker is gone.
+    """
+    from exams.models import Job
+
+    heartbeat = _Heartbeat(job, max(1.0, settings.JOB_LEASE_TIMEOUT / 3))
+    heartbeat.start()
+    try:
+        JOB_HANDLERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Job %s failed", job.pk)
+        job.status = Job.STATUS_FAILED
+        job.error = str(e)
+    else:
+        job.status = Job.STATUS_DONE
+        job.progress = job.total
+    finally:
+        heartbeat.stop()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'progress', 'result_file', 'finished_at'])
+    return job
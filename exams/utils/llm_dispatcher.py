@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+from django.conf import settings
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+
+from .llm_reader import build_messages, parse_response
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APITimeoutError, APIConnectionError)
+
+
+class TokenBucket:
+    """
+    Async token bucket: allows `rate` acquisitions per second on average,
+    with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMDispatcher:
+    """
+    Reads many answer sheets concurrently with the LLM.
+
+    Requests share one pooled HTTP client and are limited by a semaphore
+    (concurrency) and a token bucket (requests per second). Rate limits,
+    5xx responses, timeouts and connection errors are retried with
+    exponential backoff and jitter, honouring Retry-After when present.
+    """
+
+    def __init__(self, api_key, model, base_url=None, max_concurrency=8, rate_per_second=5.0,
+                 burst=10, timeout=60.0, max_retries=5, backoff_base=1.0, backoff_max=30.0):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            api_key=settings.OPENAI_API_KEY,
+            model=settings.OPENAI_MODEL,
+            base_url=settings.OPENAI_BASE_URL,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            rate_per_second=settings.LLM_RATE_LIMIT,
+            burst=settings.LLM_RATE_BURST,
+            timeout=settings.LLM_TIMEOUT,
+            max_retries=settings.LLM_MAX_RETRIES,
+            backoff_base=settings.LLM_BACKOFF_BASE,
+            backoff_max=settings.LLM_BACKOFF_MAX,
+        )
+
+    def _retry_delay(self, attempt, error):
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay * (0.5 + random.random() / 2)
+
+    async def _recognize(self, client, semaphore, bucket, image_b64):
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                async with semaphore:
+                    response = await client.chat.completions.create(
+                        model=self.model,
+                        response_format={"type": "json_object"},
+                        messages=build_messages(image_b64),
+                        temperature=0,
+                    )
+                return parse_response(response.choices[0].message.content)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt, e)
+                logger.warning("LLM call failed (%s), retrying in %.1fs", e.__class__.__name__, delay)
+                await asyncio.sleep(delay)
+
+    async def recognize_many(self, images_b64):
+        """
+        Reads all images concurrently.
+
+        Returns:
+            list: One result dict per image, in input order, or the
+            exception raised for that image
+        """
+        limits = httpx.Limits(
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency,
+        )
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as http_client:
+            client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0,
+                timeout=self.timeout,
+            )
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            bucket = TokenBucket(self.rate_per_second, self.burst)
+            return await asyncio.gather(
+                *(self._recognize(client, semaphore, bucket, image_b64) for image_b64 in images_b64),
+                return_exceptions=True,
+            )
+
+
+def recognize_images_with_llm(images_b64):
+    """
+    Synchronous entry point: reads the base64 JPEG images concurrently
+    with the dispatcher configured in settings.
+    """
+    if not images_b64:
+        return []
+    return asyncio.run(LLMDispatcher.from_settings().recognize_many(images_b64))
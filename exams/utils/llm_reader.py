@@ -0,0 +1,112 @@
+import base64
+import io
+import json
+
+from django.conf import settings
+from openai import OpenAI
+
+_client = None
+
+
+def get_client():
+    """Returns the shared OpenAI client, created on first use."""
+    global _client
+    if _client is None:
+        _client = OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            timeout=settings.LLM_TIMEOUT,
+            max_retries=settings.LLM_MAX_RETRIES,
+        )
+    return _client
+
+
+def encode_image(image):
+    """
+    Encodes a PIL image as a base64 JPEG string for the vision API.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def build_messages(image_b64):
+    """
+    Builds the chat messages asking the model to read an answer sheet.
+    """
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Você é um sistema especialista em leitura automática de gabaritos de provas. "
+                "Analise a imagem e retorne as respostas no formato JSON puro."
+            )
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": (
+                        "Analise a imagem de um gabarito de prova e identifique "
+                        "quais alternativas (A, B, C, D, E) estão marcadas. "
+                        "Se alguma estiver em branco, use ''. "
+                        "Retorne exatamente neste formato:\n\n"
+                        "{ \"sheet_code\": \"CÓDIGO\", \"answers\": { \"1\": \"A\", \"2\": \"B\", ... } }"
+                    )
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}
+                }
+            ]
+        },
+    ]
+
+
+def parse_response(result_text):
+    """
+    Parses the model output into the recognition result format.
+
+    Raises:
+        ValueError: If the model did not return valid JSON
+    """
+    try:
+        result = json.loads(result_text)
+    except json.JSONDecodeError:
+        raise ValueError(f"Falha ao interpretar a resposta da IA: {result_text}")
+
+    return {
+        'sheet_code': result.get("sheet_code"),
+        'answers': result.get("answers", {}),
+        'confidence': 1.0,
+    }
+
+
+def read_encoded_answer_sheet_with_llm(image_b64):
+    """
+    Sends a base64 JPEG answer sheet to GPT-4o and returns the detected answers.
+
+    Returns:
+        dict: {'answers': {...}, 'sheet_code': str or None, 'confidence': 1.0}
+    """
+    response = get_client().chat.completions.create(
+        model=settings.OPENAI_MODEL,
+        response_format={"type": "json_object"},
+        messages=build_messages(image_b64),
+        temperature=0,
+    )
+    return parse_response(response.choices[0].message.content)
+
+
+def read_answer_sheet_with_llm(image):
+    """
+    Sends an answer sheet image to GPT-4o and returns the detected answers.
+
+    Args:
+        image: PIL image of the answer sheet
+
+    Returns:
+        dict: {'answers': {...}, 'sheet_code': str or None, 'confidence': 1.0}
+    """
+    return read_encoded_answer_sheet_with_llm(encode_image(image))
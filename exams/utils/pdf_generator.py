@@ -1,121 +1,272 @@
-from reportlab.lib.pagesizes import A4, landscape
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from pypdf import PdfWriter
+from reportlab.graphics.barcode.qrencoder import QRCode, QRErrorCorrectLevel
 from reportlab.pdfgen import canvas
 from io import BytesIO
 
+from . import sheet_layout as layout
+from .code_allocator import reserve_sheet_code_block, sheet_codes_for
+
+CODE_LABEL = "Código: "
+PROGRESS_STEP = 100
+
 
-def generate_answer_sheet_pdf(exam, quantity=1):
+def create_answer_sheets(exam, quantity, on_created=None):
     """
-    Gera PDF com 2 gabaritos por folha (paisagem, lado a lado).
-    Cada gabarito é vertical, ocupa metade da largura da folha.
-    Itens alinhados com o campo de nome e com espaçamento confortável entre colunas.
+    Cria os registros de gabarito em branco de uma só vez.
+
+    Os códigos são reservados em bloco no alocador de códigos, numa
+    transação curta própria, antes da transação do `bulk_create`: o bloqueio
+    da sequência não fica preso enquanto os registros são gravados. Se a
+    gravação falhar, o bloco reservado apenas deixa uma lacuna na sequência.
+
+    `on_created`, se informado, recebe o bloco reservado (um `range`) dentro
+    da transação do `bulk_create`: o que ele gravar (ex.: o bloco na tarefa
+    em segundo plano) é confirmado junto com os gabaritos, ou nada é.
+
+    Returns:
+        list: Códigos gerados, na ordem em que serão impressos
     """
     from exams.models import StudentAnswerSheet
 
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=landscape(A4))
-    page_width, page_height = landscape(A4)
-
-    # Opções de resposta (A, B, C, D, E...)
-    options = [chr(65 + i) for i in range(exam.num_options)]
-    generated_codes = []
-
-    # Layout: 2 gabaritos por folha
-    margin = 10
-    usable_width = page_width - (margin * 2)
-    sheet_width = (usable_width / 2) - 10
-    sheet_height = page_height - (margin * 2)
-    sheets_per_page = 2
-
-    # Posições iniciais
-    x_start = margin
-    y_start = margin
-    current_on_page = 0
-
-    for i in range(quantity):
-        # Cria o registro no banco para gerar código único
-        answer_sheet = StudentAnswerSheet.objects.create(
-            exam=exam,
-            student_name=None,
-            student_answers=None,
-        )
-        code = answer_sheet.sheet_code
-        generated_codes.append(code)
-
-        # Moldura externa
-        c.setLineWidth(1.2)
-        c.rect(x_start, y_start, sheet_width, sheet_height, stroke=1, fill=0)
-
-        # Cabeçalho
-        title_y = y_start + sheet_height - 20
-        c.setFont("Helvetica-Bold", 16)
-        c.drawCentredString(
-            x_start + sheet_width / 2, title_y, f"Avaliação de {exam.subject_name}"
+    block = reserve_sheet_code_block(quantity)
+    codes = sheet_codes_for(block)
+    with transaction.atomic():
+        StudentAnswerSheet.objects.bulk_create(
+            [
+                StudentAnswerSheet(
+                    exam=exam,
+                    sheet_code=code,
+                    student_name=None,
+                    student_answers=None,
+                )
+                for code in codes
+            ],
+            batch_size=1000,
         )
+        if on_created is not None:
+            on_created(block)
 
-        code_y = title_y - 20
-        c.setFont("Helvetica", 11)
-        c.drawString(
-            x_start + 25 , code_y, f"Código: {code}"
-        )
+    return codes
+
+
+def _draw_code_qr(c, code):
+    """
+    Desenha o código do gabarito como QR Code, para leitura sem OCR.
+
+    A matriz é gravada como uma única imagem embutida de 1 bit por módulo
+    (cerca de 60 bytes), escalada até o tamanho do QR: um retângulo por
+    módulo escuro deixava a geração e o arquivo várias vezes maiores. A
+    máscara é fixa: a escolha automática testa as 8 máscaras e deixa a
+    geração cerca de 8 vezes mais lenta, sem ganho para códigos tão curtos.
+    """
+    qr = QRCode(1, QRErrorCorrectLevel.M)
+    qr.addData(code)
+    qr.makeImpl(False, 0)
+
+    count = qr.getModuleCount()
+    module = layout.QR_SIZE / (count + 2 * layout.QR_QUIET_ZONE)
+    origin_x = layout.QR_X + layout.QR_QUIET_ZONE * module
+    origin_y = layout.QR_Y + layout.QR_QUIET_ZONE * module
+    side = count * module
+
+    # Uma linha de bits por linha da matriz (1 = escuro, com /D [1 0]),
+    # completada até o byte seguinte
+    row_bytes = (count + 7) // 8
+    data = bytearray()
+    for row in range(count):
+        bits = 0
+        for col in range(count):
+            bits = (bits << 1) | qr.isDark(row, col)
+        data += (bits << (row_bytes * 8 - count)).to_bytes(row_bytes, 'big')
+
+    c.addLiteral(
+        f"q {side:.3f} 0 0 {side:.3f} {origin_x:.3f} {origin_y:.3f} cm "
+        f"BI /W {count} /H {count} /BPC 1 /CS /G /D [1 0] /F /AHx ID "
+        f"{data.hex()}> EI Q"
+    )
+
+
+def _draw_sheet_template(c, subject_name, num_questions, num_options):
+    """
+    Desenha a parte fixa de um gabarito (moldura, cabeçalho, campo de nome,
+    bolhas e letras) com origem em (0, 0). Só o código muda entre gabaritos
+    da mesma prova, então esse desenho é gravado uma única vez como Form XObject.
+
+    As posições vêm de `sheet_layout`, o mesmo modelo usado na leitura.
+    """
+    # Moldura externa
+    c.setLineWidth(1.2)
+    c.rect(0, 0, layout.SHEET_WIDTH, layout.SHEET_HEIGHT, stroke=1, fill=0)
+
+    # Marcas de registro nos cantos, usadas para alinhar fotos e digitalizações
+    half_mark = layout.MARK_SIZE / 2
+    for mark_x, mark_y in layout.registration_marks():
+        c.rect(mark_x - half_mark, mark_y - half_mark, layout.MARK_SIZE, layout.MARK_SIZE,
+               stroke=0, fill=1)
+
+    # Cabeçalho
+    c.setFont("Helvetica-Bold", 16)
+    c.drawCentredString(layout.SHEET_WIDTH / 2, layout.TITLE_Y, f"Avaliação de {subject_name}")
+
+    c.setFont("Helvetica", 11)
+    c.drawString(layout.TEXT_X, layout.CODE_Y, CODE_LABEL)
+
+    # Campo de nome
+    c.setFont("Helvetica", 11)
+    c.drawString(layout.TEXT_X, layout.NAME_Y, "Nome: " + "_" * 45)
+
+    # Área das questões (uma ou duas colunas, conforme o layout)
+    options = layout.option_letters(num_options)
+    c.setFont("Helvetica", 10)
+    for q, base_x, y in layout.question_rows(num_questions):
+        c.drawString(base_x, y, f"{q:>2}.")  # número da questão alinhado
+        opt_x = base_x + layout.OPTIONS_OFFSET_X
+        for opt in options:
+            c.circle(opt_x, y + layout.CIRCLE_OFFSET_Y, layout.CIRCLE_RADIUS, stroke=1, fill=0)
+            c.drawString(opt_x + layout.LETTER_OFFSET_X, y, opt)
+            opt_x += layout.OPTION_SPACING
+
+
+def render_answer_sheets(output, subject_name, num_questions, num_options, codes, progress=None):
+    """
+    Desenha os gabaritos dos códigos informados em `output`, sem acessar o banco.
+
+    Recebe apenas dados simples para poder rodar em processos separados.
+    Se `progress` for informado, é chamado com o número de gabaritos já
+    desenhados a cada PROGRESS_STEP gabaritos.
+    """
+    c = canvas.Canvas(output, pagesize=(layout.PAGE_WIDTH, layout.PAGE_HEIGHT))
+    quantity = len(codes)
+
+    # Layout fixo desenhado uma vez e reaproveitado em todos os gabaritos
+    form_name = f"sheet_{num_questions}_{num_options}"
+    c.beginForm(form_name, upperx=layout.SHEET_WIDTH, uppery=layout.SHEET_HEIGHT)
+    _draw_sheet_template(c, subject_name, num_questions, num_options)
+    c.endForm()
+
+    # Posição do código dentro do gabarito, logo após o rótulo
+    code_x = layout.TEXT_X + c.stringWidth(CODE_LABEL, "Helvetica", 11)
 
-        # Campo de nome
-        name_y = code_y - 20
+    # Posições iniciais (2 gabaritos por folha)
+    x_start = layout.PAGE_MARGIN
+    y_start = layout.PAGE_MARGIN
+    current_on_page = 0
+
+    for i, code in enumerate(codes):
+        c.saveState()
+        c.translate(x_start, y_start)
+        c.doForm(form_name)
         c.setFont("Helvetica", 11)
-        c.drawString(x_start + 25, name_y, "Nome: " + "_" * 45)
-
-        # Área das questões
-        start_y = name_y - 20
-        start_x = x_start + 20
-        line_height = 18
-        circle_radius = 5
-        option_spacing = 28
-        num_q = exam.num_questions
-
-        # Divide em duas colunas internas se tiver mais de 10 questões
-        two_cols = num_q > 10
-        if two_cols:
-            col1 = num_q // 2
-            col2 = num_q - col1
-            # Aumenta o espaçamento entre as colunas para não ficarem próximas
-            col_gap = 55  # antes era ~25
-            col_width = (sheet_width - col_gap - 60) / 2
-        else:
-            col1 = num_q
-            col2 = 0
-            col_width = sheet_width - 70
-
-        def draw_questions(start_num, total, base_x, base_y):
-            """Desenha o conjunto de questões em uma coluna."""
-            y = base_y
-            for q in range(start_num, start_num + total):
-                c.setFont("Helvetica", 10)
-                c.drawString(base_x, y, f"{q:>2}.")  # número da questão alinhado
-                opt_x = base_x + 22
-                for opt in options:
-                    c.circle(opt_x, y + 3, circle_radius, stroke=1, fill=0)
-                    c.drawString(opt_x + 9, y, opt)
-                    opt_x += option_spacing
-                y -= line_height
-            return y
-
-        # Coluna única ou dupla
-        draw_questions(1, col1, start_x, start_y)
-        if two_cols:
-            draw_questions(col1 + 1, col2, start_x + col_width + col_gap, start_y)
+        c.drawString(code_x, layout.CODE_Y, code)
+        _draw_code_qr(c, code)
+        c.restoreState()
+
+        if progress is not None and (i + 1) % PROGRESS_STEP == 0:
+            progress(i + 1)
 
         # Próximo gabarito (à direita)
         current_on_page += 1
-        if current_on_page < sheets_per_page and i < quantity - 1:
-            x_start += sheet_width + 20
+        if current_on_page < layout.SHEETS_PER_PAGE and i < quantity - 1:
+            x_start += layout.SHEET_WIDTH + layout.SHEET_GAP
         else:
             # Nova página
             if i < quantity - 1:
                 c.showPage()
-                x_start = margin
-                y_start = margin
+                x_start = layout.PAGE_MARGIN
+                y_start = layout.PAGE_MARGIN
                 current_on_page = 0
 
     c.save()
+    if progress is not None:
+        progress(quantity)
+
+
+def _render_chunk(args):
+    """Renderiza um bloco de códigos em um processo separado e devolve os bytes."""
+    buffer = BytesIO()
+    render_answer_sheets(buffer, *args)
+    return buffer.getvalue()
+
+
+def _render_in_parallel(output, subject_name, num_questions, num_options, codes, workers, chunk_size,
+                        progress=None):
+    """
+    Divide os códigos em blocos, renderiza cada bloco em um processo e
+    concatena as páginas no PDF final, mantendo a ordem dos códigos.
+
+    Os processos são criados com "spawn": um fork dentro de um worker
+    gthread do gunicorn copiaria travas presas por outras threads e a
+    conexão com o banco. Os blocos entram no PdfWriter assim que chegam,
+    mas o pypdf só grava o documento no fim, então neste modo a memória
+    não é limitada: cresce com o número de gabaritos, ao contrário da
+    renderização em um só processo.
+    """
+    # Blocos com quantidade par para não deixar meia página entre eles
+    chunk_size += chunk_size % 2
+    chunks = [
+        (subject_name, num_questions, num_options, codes[start:start + chunk_size])
+        for start in range(0, len(codes), chunk_size)
+    ]
+
+    writer = PdfWriter()
+    done = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # map() devolve os resultados na ordem de envio
+        for chunk, pdf_bytes in zip(chunks, executor.map(_render_chunk, chunks)):
+            writer.append(BytesIO(pdf_bytes))
+            done += len(chunk[3])
+            if progress is not None:
+                progress(done)
+    writer.write(output)
+
+
+def generate_answer_sheet_pdf(exam, quantity=1, output=None, workers=None, progress=None, codes=None,
+                              on_created=None):
+    """
+    Gera PDF com 2 gabaritos por folha (paisagem, lado a lado).
+    Cada gabarito é vertical, ocupa metade da largura da folha.
+    Itens alinhados com o campo de nome e com espaçamento confortável entre colunas.
+
+    Se `output` for informado (ex.: um arquivo temporário), o PDF é escrito
+    nele em vez de em um BytesIO, evitando manter o documento final em memória.
+
+    Com `workers` > 1 (padrão: PDF_RENDER_WORKERS), lotes maiores que
+    PDF_RENDER_CHUNK_SIZE são renderizados em paralelo em vários processos.
+    Os códigos são sempre reservados no banco antes da divisão.
+
+    `progress`, se informado, recebe o número de gabaritos já renderizados.
+
+    Com `codes`, os gabaritos já existem no banco (ex.: nova tentativa de
+    uma tarefa) e só o PDF é gerado; senão são criados e `on_created` é
+    repassado a create_answer_sheets.
+    """
+    buffer = output if output is not None else BytesIO()
+    if workers is None:
+        workers = settings.PDF_RENDER_WORKERS
+    chunk_size = settings.PDF_RENDER_CHUNK_SIZE
+
+    if codes is not None:
+        generated_codes = list(codes)
+    else:
+        # Cria todos os registros no banco de uma vez para gerar os códigos únicos
+        generated_codes = create_answer_sheets(exam, quantity, on_created)
+
+    if workers > 1 and len(generated_codes) > chunk_size:
+        _render_in_parallel(
+            buffer, exam.subject_name, exam.num_questions, exam.num_options,
+            generated_codes, workers, chunk_size, progress,
+        )
+    else:
+        render_answer_sheets(
+            buffer, exam.subject_name, exam.num_questions, exam.num_options, generated_codes,
+            progress,
+        )
+
     buffer.seek(0)
     return buffer, generated_codes
-
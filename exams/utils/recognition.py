@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .image_preprocessing import PreprocessingStats, prepare_sheet_image
+from .llm_dispatcher import recognize_images_with_llm
+from .llm_reader import encode_image, read_encoded_answer_sheet_with_llm
+from .sheet_reader import read_answer_sheet
+
+BACKEND_LOCAL_OMR = 'local_omr'
+BACKEND_LLM = 'llm'
+
+
+def recognize_locally(image, exam):
+    """
+    Reads an answer sheet with the local OMR engine.
+
+    Returns:
+        dict: {'answers': {...}, 'sheet_code': str or None,
+               'confidence': float, 'backend': 'local_omr'}
+    """
+    gray = np.asarray(image.convert("L"))
+    result = read_answer_sheet(gray, exam.num_questions, exam.num_options)
+    result['backend'] = BACKEND_LOCAL_OMR
+    return result
+
+
+def encode_for_llm(image):
+    """
+    Prepares a sheet image for the LLM: grayscale, cropped to the sheet
+    frame and downsampled to LLM_IMAGE_DPI before the JPEG encoding, which
+    keeps the payload (and the image tokens) small.
+
+    Returns:
+        str: Base64 JPEG image
+    """
+    stats = PreprocessingStats()
+    prepared = prepare_sheet_image(image, settings.LLM_IMAGE_DPI, stats)
+
+    started_at = time.perf_counter()
+    image_b64 = encode_image(prepared)
+    stats.record('encode', started_at, prepared.width * prepared.height, len(image_b64))
+    stats.log("LLM payload")
+    return image_b64
+
+
+def needs_llm(result):
+    """
+    Tells whether a sheet must be (re)read by the LLM: always with the
+    `llm` backend, otherwise only when the local confidence is below
+    OMR_MIN_CONFIDENCE and OMR_LLM_FALLBACK is enabled.
+    """
+    if settings.ANSWER_SHEET_RECOGNITION_BACKEND == BACKEND_LLM:
+        return True
+    return result['confidence'] < settings.OMR_MIN_CONFIDENCE and settings.OMR_LLM_FALLBACK
+
+
+def recognize_answer_sheet(image, exam):
+    """
+    Reads an answer sheet with the configured recognition backend.
+
+    With `local_omr` (default) the sheet is read locally and only sent to
+    the LLM when needs_llm() says so. With `llm` every sheet goes to the LLM.
+
+    Args:
+        image: PIL image of the answer sheet
+        exam: Exam the sheet belongs to (for the layout)
+
+    Returns:
+        dict: {'answers': {...}, 'sheet_code': str or None,
+               'confidence': float, 'backend': str}
+    """
+    if settings.ANSWER_SHEET_RECOGNITION_BACKEND == BACKEND_LLM:
+        result = None
+    else:
+        result = recognize_locally(image, exam)
+
+    if result is None or needs_llm(result):
+        result = read_encoded_answer_sheet_with_llm(encode_for_llm(image))
+        result['backend'] = BACKEND_LLM
+
+    return result
+
+
+def recognize_with_llm_concurrently(images_b64):
+    """
+    Reads several answer sheets with the LLM at once, through the
+    rate-limited async dispatcher.
+
+    Args:
+        images_b64: List of base64 JPEG images (see encode_for_llm)
+
+    Returns:
+        list: One result dict (or the exception raised) per image, in order
+    """
+    results = recognize_images_with_llm(images_b64)
+    for result in results:
+        if isinstance(result, dict):
+            result['backend'] = BACKEND_LLM
+    return results
@@ -0,0 +1,103 @@
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .sheet_layout import LAYOUT_VERSION
+
+
+def cache_key(file_bytes, exam):
+    """
+    Hash of the uploaded file together with the exam layout and the
+    recognition settings, so the same scan read against a different
+    layout or by a different backend is not served from the cache.
+    """
+    digest = hashlib.sha256(file_bytes)
+    digest.update(f"|layout:{LAYOUT_VERSION}:{exam.num_questions}:{exam.num_options}".encode())
+    digest.update((
+        f"|backend:{settings.ANSWER_SHEET_RECOGNITION_BACKEND}"
+        f":fallback={settings.OMR_LLM_FALLBACK}:{settings.OMR_MIN_CONFIDENCE}"
+        f":model={settings.OPENAI_MODEL}"
+    ).encode())
+    return digest.hexdigest()
+
+
+def _count(field):
+    from exams.models import RecognitionCacheStats
+
+    updated = RecognitionCacheStats.objects.filter(pk=RecognitionCacheStats.SINGLETON_ID).update(
+        **{field: F(field) + 1}
+    )
+    if not updated:
+        RecognitionCacheStats.objects.get_or_create(pk=RecognitionCacheStats.SINGLETON_ID)
+        RecognitionCacheStats.objects.filter(pk=RecognitionCacheStats.SINGLETON_ID).update(
+            **{field: F(field) + 1}
+        )
+
+
+def get_cached_result(key):
+    """
+    Returns the cached recognition result for a key, or None, and
+    updates the hit/miss counters.
+    """
+    from exams.models import RecognitionCacheEntry
+
+    if not settings.RECOGNITION_CACHE_ENABLED:
+        return None
+
+    result = RecognitionCacheEntry.objects.filter(key=key).values_list('result', flat=True).first()
+    if result is None:
+        _count('misses')
+        return None
+
+    RecognitionCacheEntry.objects.filter(key=key).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _count('hits')
+    return result
+
+
+def store_result(key, result):
+    """
+    Stores a recognition result and evicts the least recently used
+    entries beyond RECOGNITION_CACHE_MAX_ENTRIES.
+    """
+    from exams.models import RecognitionCacheEntry
+
+    if not settings.RECOGNITION_CACHE_ENABLED:
+        return
+
+    try:
+        RecognitionCacheEntry.objects.create(key=key, result=result)
+    except IntegrityError:
+        # Mesmo arquivo enviado ao mesmo tempo por outra requisição
+        return
+
+    limit = settings.RECOGNITION_CACHE_MAX_ENTRIES
+    stale_ids = list(
+        RecognitionCacheEntry.objects
+        .order_by('-last_used_at', '-id')
+        .values_list('id', flat=True)[limit:limit + 1000]
+    )
+    if stale_ids:
+        RecognitionCacheEntry.objects.filter(id__in=stale_ids).delete()
+
+
+def cache_stats():
+    """
+    Returns the cache counters and current size.
+    """
+    from exams.models import RecognitionCacheEntry, RecognitionCacheStats
+
+    stats = RecognitionCacheStats.objects.filter(pk=RecognitionCacheStats.SINGLETON_ID).first()
+    hits = stats.hits if stats else 0
+    misses = stats.misses if stats else 0
+    lookups = hits + misses
+    return {
+        'enabled': settings.RECOGNITION_CACHE_ENABLED,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+        'entries': RecognitionCacheEntry.objects.count(),
+        'max_entries': settings.RECOGNITION_CACHE_MAX_ENTRIES,
+    }
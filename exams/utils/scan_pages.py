@@ -0,0 +1,64 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+
+from .image_preprocessing import PreprocessingStats, open_upload_image
+
+
+def is_pdf_upload(uploaded_file):
+    """Tells whether an uploaded file is a PDF (by content type or extension)."""
+    content_type = getattr(uploaded_file, 'content_type', '') or ''
+    return "pdf" in content_type.lower() or uploaded_file.name.lower().endswith(".pdf")
+
+
+def render_pdf_page(file_bytes, page_number, dpi):
+    """
+    Rasterizes a single page of a PDF (1-based) in grayscale, without
+    touching the others.
+    """
+    images = convert_from_bytes(
+        file_bytes, dpi=dpi, first_page=page_number, last_page=page_number, grayscale=True
+    )
+    if not images:
+        raise ValueError(f"PDF sem a página {page_number}.")
+    return images[0]
+
+
+def iter_pdf_pages(file_bytes, dpi, workers=1):
+    """
+    Yields (page_number, image) for every page of a PDF, in order.
+
+    Pages are rasterized lazily, one poppler call per page. Up to `workers`
+    pages are rendered ahead in a thread pool, so at most that many page
+    bitmaps are in memory at once.
+    """
+    total_pages = pdfinfo_from_bytes(file_bytes)["Pages"]
+    workers = max(1, workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for page_number in range(1, total_pages + 1):
+            pending.append((page_number, executor.submit(render_pdf_page, file_bytes, page_number, dpi)))
+            if len(pending) >= workers:
+                number, future = pending.popleft()
+                yield number, future.result()
+        while pending:
+            number, future = pending.popleft()
+            yield number, future.result()
+
+
+def iter_uploaded_pages(uploaded_file, dpi, workers=1):
+    """
+    Yields (page_number, image) for an uploaded PDF or a single image file.
+    Images are grayscale; JPEG photos are downscaled to about `dpi` while
+    decoding.
+    """
+    file_bytes = uploaded_file.read()
+    if is_pdf_upload(uploaded_file):
+        yield from iter_pdf_pages(file_bytes, dpi, workers)
+    else:
+        stats = PreprocessingStats()
+        image = open_upload_image(file_bytes, dpi, stats)
+        stats.log("Upload")
+        yield 1, image
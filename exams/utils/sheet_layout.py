@@ -0,0 +1,151 @@
+"""
+Geometry of a printed answer sheet, shared by the PDF generator and the reader.
+
+All coordinates are in PDF points, relative to the bottom-left corner of
+a single sheet frame (y grows upwards, as in ReportLab).
+"""
+import numpy as np
+from reportlab.lib.pagesizes import A4, landscape
+
+LAYOUT_VERSION = 1
+
+PAGE_WIDTH, PAGE_HEIGHT = landscape(A4)
+PAGE_MARGIN = 10
+SHEET_GAP = 20
+SHEETS_PER_PAGE = 2
+SHEET_WIDTH = ((PAGE_WIDTH - PAGE_MARGIN * 2) / 2) - 10
+SHEET_HEIGHT = PAGE_HEIGHT - PAGE_MARGIN * 2
+
+TITLE_Y = SHEET_HEIGHT - 20
+CODE_Y = TITLE_Y - 20
+NAME_Y = CODE_Y - 20
+TEXT_X = 25
+
+QUESTIONS_START_X = 20
+QUESTIONS_START_Y = NAME_Y - 20
+LINE_HEIGHT = 18
+CIRCLE_RADIUS = 5
+OPTION_SPACING = 28
+OPTIONS_OFFSET_X = 22
+LETTER_OFFSET_X = 9
+CIRCLE_OFFSET_Y = 3
+COL_GAP = 55
+TWO_COLUMNS_FROM = 11
+
+# Filled squares at the four inner corners of the frame, used by the
+# reader to compute the perspective transform of photos and scans
+MARK_SIZE = 14
+MARK_INSET = 5
+
+# QR code with the sheet code, right of the name line (x, y = bottom-left).
+# Codes fit in a version 1 symbol (21 modules), drawn with a 2-module margin.
+QR_SIZE = 44
+QR_MODULES = 21
+QR_QUIET_ZONE = 2
+QR_X = SHEET_WIDTH - 63
+QR_Y = SHEET_HEIGHT - 70
+
+
+def option_letters(num_options):
+    """Returns the option letters (A, B, C, ...) for an exam."""
+    return [chr(65 + i) for i in range(num_options)]
+
+
+def question_rows(num_questions):
+    """
+    Returns the position of each question row.
+
+    Sheets with more than 10 questions are split into two columns.
+
+    Returns:
+        list: [(question_number, label_x, baseline_y), ...]
+    """
+    if num_questions >= TWO_COLUMNS_FROM:
+        col1 = num_questions // 2
+        col_width = (SHEET_WIDTH - COL_GAP - 60) / 2
+        columns = [
+            (1, col1, QUESTIONS_START_X),
+            (col1 + 1, num_questions - col1, QUESTIONS_START_X + col_width + COL_GAP),
+        ]
+    else:
+        columns = [(1, num_questions, QUESTIONS_START_X)]
+
+    rows = []
+    for start_num, total, base_x in columns:
+        for index in range(total):
+            rows.append((start_num + index, base_x, QUESTIONS_START_Y - index * LINE_HEIGHT))
+    return rows
+
+
+def registration_marks():
+    """
+    Returns the centres of the registration marks, in the order
+    top-left, top-right, bottom-right, bottom-left.
+    """
+    near = MARK_INSET + MARK_SIZE / 2
+    far_x = SHEET_WIDTH - near
+    far_y = SHEET_HEIGHT - near
+    return [(near, far_y), (far_x, far_y), (far_x, near), (near, near)]
+
+
+def answer_region(num_questions, num_options, padding=CIRCLE_RADIUS + 4):
+    """
+    Returns the bounding box (x0, y0, x1, y1) of all bubbles, in points.
+    """
+    centers = bubble_centers(num_questions, num_options)
+    return (
+        centers[..., 0].min() - padding,
+        centers[..., 1].min() - padding,
+        centers[..., 0].max() + padding,
+        centers[..., 1].max() + padding,
+    )
+
+
+def build_sheet_layout(num_questions, num_options):
+    """
+    Builds the machine-readable template of a sheet for an exam layout.
+
+    Returns:
+        dict: Sheet size, text anchors and the centre of every bubble
+    """
+    letters = option_letters(num_options)
+    bubbles = []
+    for number, label_x, baseline_y in question_rows(num_questions):
+        for index, letter in enumerate(letters):
+            bubbles.append({
+                'question': number,
+                'option': letter,
+                'x': label_x + OPTIONS_OFFSET_X + index * OPTION_SPACING,
+                'y': baseline_y + CIRCLE_OFFSET_Y,
+            })
+
+    return {
+        'version': LAYOUT_VERSION,
+        'units': 'pt',
+        'sheet': {'width': SHEET_WIDTH, 'height': SHEET_HEIGHT},
+        'code': {'x': TEXT_X, 'y': CODE_Y},
+        'qr_code': {'x': QR_X, 'y': QR_Y, 'size': QR_SIZE},
+        'registration_marks': [
+            {'x': x, 'y': y, 'size': MARK_SIZE} for x, y in registration_marks()
+        ],
+        'num_questions': num_questions,
+        'num_options': num_options,
+        'bubble_radius': CIRCLE_RADIUS,
+        'bubbles': bubbles,
+    }
+
+
+def bubble_centers(num_questions, num_options):
+    """
+    Returns the bubble centres as an array for vectorized sampling.
+
+    Returns:
+        numpy.ndarray: Shape (num_questions, num_options, 2) with (x, y) in
+        points, row i being question i + 1
+    """
+    centers = np.zeros((num_questions, num_options, 2), dtype=np.float64)
+    offsets = OPTIONS_OFFSET_X + np.arange(num_options) * OPTION_SPACING
+    for number, label_x, baseline_y in question_rows(num_questions):
+        centers[number - 1, :, 0] = label_x + offsets
+        centers[number - 1, :, 1] = baseline_y + CIRCLE_OFFSET_Y
+    return centers
@@ -1,8 +1,42 @@
+import re
+
 import cv2
 import numpy as np
 import pytesseract
 from PIL import Image
 
+from . import sheet_layout as layout
+from .code_allocator import is_valid_sheet_code
+
+# Codes printed before the code allocator: 5 hexadecimal digits
+LEGACY_CODE_PATTERN = re.compile(r'[0-9A-F]{5}')
+
+# Answer values for questions without exactly one mark
+BLANK_MARK = ''
+MULTIPLE_MARK = '*'
+
+# Share of the sampled disc that must be ink for a bubble to count as marked
+FILL_THRESHOLD = 0.45
+# Distance from the threshold at which a bubble is considered unambiguous
+CLEAR_MARGIN = 0.3
+# Sample inside the printed outline so the circle itself is not counted
+SAMPLE_RADIUS_RATIO = 0.6
+
+# The frame and the registration marks are searched for on copies whose
+# longest side has these sizes
+FRAME_SEARCH_SIZE = 600
+MIN_FRAME_AREA_RATIO = 0.3
+MARK_SEARCH_SIZE = 1000
+MARK_MIN_SIDE_RATIO = 0.006
+MARK_MAX_SIDE_RATIO = 0.05
+MARK_MIN_RECTANGULARITY = 0.85
+MARK_MIN_AREA_SHARE = 0.25
+
+# Resolution of the aligned crops (bubbles, QR code and printed code for OCR)
+ANSWER_PIXELS_PER_POINT = 150 / 72
+QR_PIXELS_PER_POINT = 150 / 72
+CODE_PIXELS_PER_POINT = 300 / 72
+
 
 def validate_sheet_image(image_path):
     """
@@ -38,6 +72,304 @@ def validate_sheet_image(image_path):
         return False, f"Error validating image: {str(e)}"
 
 
+def _downscale(gray, size=FRAME_SEARCH_SIZE):
+    """
+    Returns a copy whose longest side is at most `size` and its scale.
+    Halves with pyrDown first, which is much cheaper than one large
+    INTER_AREA resize with a fractional factor.
+    """
+    small = gray
+    while max(small.shape[:2]) >= 2 * size:
+        small = cv2.pyrDown(small)
+
+    longest = max(small.shape[:2])
+    if longest > size:
+        factor = size / longest
+        small = cv2.resize(small, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+    return small, small.shape[1] / gray.shape[1]
+
+
+def locate_sheet_frame(gray):
+    """
+    Finds the printed sheet frame on a downscaled copy of the image.
+
+    Returns:
+        tuple: (x, y, width, height) of the frame in pixels of `gray`. The
+        whole image is used when no frame is found (already cropped scans).
+    """
+    height, width = gray.shape[:2]
+    small, scale = _downscale(gray)
+
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contours:
+        x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        if w * h >= MIN_FRAME_AREA_RATIO * small.shape[0] * small.shape[1]:
+            return x / scale, y / scale, w / scale, h / scale
+
+    return 0, 0, width, height
+
+
+def find_registration_marks(gray):
+    """
+    Finds the four corner registration marks on a downscaled copy.
+
+    Candidates are solid, square blobs without holes; filled bubbles are
+    rounder and smaller than the marks and are discarded. The outermost
+    candidate towards each corner wins.
+
+    Returns:
+        numpy.ndarray or None: (4, 2) mark centres in pixels of `gray`,
+        ordered top-left, top-right, bottom-right, bottom-left
+    """
+    small, scale = _downscale(gray, MARK_SEARCH_SIZE)
+    longest = max(small.shape[:2])
+    min_side = MARK_MIN_SIDE_RATIO * longest
+    max_side = MARK_MAX_SIDE_RATIO * longest
+
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return None
+
+    centers = []
+    areas = []
+    for contour, (_, _, first_child, parent) in zip(contours, hierarchy[0]):
+        # Holes and blobs with holes (empty bubbles, letters) are not marks
+        if parent != -1 or first_child != -1:
+            continue
+        (cx, cy), (w, h), _ = cv2.minAreaRect(contour)
+        if not (min_side <= w <= max_side and min_side <= h <= max_side):
+            continue
+        if not 0.6 <= w / h <= 1.6:
+            continue
+        area = cv2.contourArea(contour)
+        if area < MARK_MIN_RECTANGULARITY * w * h:
+            continue
+        centers.append((cx, cy))
+        areas.append(area)
+
+    if len(centers) < 4:
+        return None
+
+    # Marks are the largest solid squares; smaller ones are filled bubbles
+    areas = np.array(areas)
+    centers = np.array(centers)[areas >= MARK_MIN_AREA_SHARE * areas.max()]
+    sums = centers.sum(axis=1)
+    diffs = centers[:, 0] - centers[:, 1]
+    corners = centers[[sums.argmin(), diffs.argmax(), sums.argmax(), diffs.argmin()]]
+    if len({tuple(point) for point in corners}) < 4:
+        return None
+    if cv2.contourArea(corners.astype(np.float32)) < MIN_FRAME_AREA_RATIO * small.shape[0] * small.shape[1]:
+        return None
+
+    return corners / scale
+
+
+def sheet_transform(gray):
+    """
+    Computes the 3x3 matrix that maps sheet points (PDF coordinates,
+    origin bottom-left) to pixels of `gray`.
+
+    Uses a homography from the registration marks when they are found and
+    falls back to the bounding box of the frame (sheets printed before the
+    marks existed, or already cropped scans).
+    """
+    marks = find_registration_marks(gray)
+    if marks is not None:
+        return cv2.getPerspectiveTransform(
+            np.float32(layout.registration_marks()), np.float32(marks)
+        )
+
+    x, y, w, h = locate_sheet_frame(gray)
+    return np.array([
+        [w / layout.SHEET_WIDTH, 0, x],
+        [0, -h / layout.SHEET_HEIGHT, y + h],
+        [0, 0, 1],
+    ])
+
+
+def warp_region(gray, transform, region, pixels_per_point):
+    """
+    Warps only one rectangle of the sheet into an upright image.
+
+    Args:
+        gray: Grayscale source image
+        transform: Matrix from sheet_transform
+        region: (x0, y0, x1, y1) in sheet points
+        pixels_per_point: Resolution of the output image
+
+    Returns:
+        numpy.ndarray: Image where pixel (u, v) is the sheet point
+        (x0 + u / pixels_per_point, y1 - v / pixels_per_point)
+    """
+    x0, y0, x1, y1 = region
+    to_points = np.array([
+        [1 / pixels_per_point, 0, x0],
+        [0, -1 / pixels_per_point, y1],
+        [0, 0, 1],
+    ])
+    size = (int(np.ceil((x1 - x0) * pixels_per_point)), int(np.ceil((y1 - y0) * pixels_per_point)))
+    return cv2.warpPerspective(
+        gray, transform @ to_points, size,
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=255,
+    )
+
+
+def sample_fill_ratios(ink, centers_px, radius_px):
+    """
+    Measures how much of each bubble is filled, in one vectorized gather.
+
+    Args:
+        ink: 2D array with 1 where there is ink and 0 elsewhere
+        centers_px: Array (..., 2) with bubble centres (x, y) in pixels
+        radius_px: Sampling radius in pixels
+
+    Returns:
+        numpy.ndarray: Fill ratio between 0 and 1 for each centre
+    """
+    r = max(1, int(round(radius_px)))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    disc = dx ** 2 + dy ** 2 <= r * r
+    dy, dx = dy[disc], dx[disc]
+
+    cx = np.rint(centers_px[..., 0]).astype(np.intp)[..., None]
+    cy = np.rint(centers_px[..., 1]).astype(np.intp)[..., None]
+    ys = np.clip(cy + dy, 0, ink.shape[0] - 1)
+    xs = np.clip(cx + dx, 0, ink.shape[1] - 1)
+    return ink[ys, xs].mean(axis=-1)
+
+
+def _parse_sheet_code(text):
+    """
+    Finds a sheet code in free text: a 7-symbol code with a valid check
+    symbol, or a legacy 5-hex-digit code from sheets printed before the
+    code allocator existed.
+    """
+    text = text.upper().replace('Ó', 'O')
+    candidates = text.split(':', 1)[1] if ':' in text else text
+    for token in re.findall(r'[0-9A-Z]+', candidates):
+        if is_valid_sheet_code(token):
+            return token
+        if LEGACY_CODE_PATTERN.fullmatch(token):
+            return token
+    return None
+
+
+def _decode_qr_code(gray, transform):
+    """
+    Decodes the sheet code from the printed QR code, in-process.
+
+    After alignment the QR corners are known, so the decoder is given them
+    directly and the (much slower) QR search only runs if that fails.
+    """
+    padding = 4
+    region = (
+        layout.QR_X - padding,
+        layout.QR_Y - padding,
+        layout.QR_X + layout.QR_SIZE + padding,
+        layout.QR_Y + layout.QR_SIZE + padding,
+    )
+    roi_qr = warp_region(gray, transform, region, QR_PIXELS_PER_POINT)
+
+    quiet_zone = layout.QR_SIZE * layout.QR_QUIET_ZONE / (layout.QR_MODULES + 2 * layout.QR_QUIET_ZONE)
+    near = (padding + quiet_zone) * QR_PIXELS_PER_POINT
+    far = (padding + layout.QR_SIZE - quiet_zone) * QR_PIXELS_PER_POINT
+    corners = np.float32([[near, near], [far, near], [far, far], [near, far]]).reshape(1, 4, 2)
+
+    detector = cv2.QRCodeDetector()
+    text, _ = detector.decode(roi_qr, corners)
+    if not text:
+        text, _, _ = detector.detectAndDecode(roi_qr)
+    return _parse_sheet_code(text) if text else None
+
+
+def _ocr_sheet_code(gray, transform):
+    """Reads the printed sheet code next to the 'Código:' label using OCR."""
+    region = (layout.TEXT_X - 5, layout.CODE_Y - 6, layout.TEXT_X + 160, layout.CODE_Y + 15)
+    roi_code = warp_region(gray, transform, region, CODE_PIXELS_PER_POINT)
+
+    try:
+        extracted_text = pytesseract.image_to_string(roi_code, config='--psm 7')
+    except Exception as e:
+        print(f"Error extracting code: {e}")
+        return None
+
+    return _parse_sheet_code(extracted_text)
+
+
+def _extract_sheet_code(gray, transform):
+    """
+    Reads the sheet code from the QR code, falling back to OCR of the
+    printed text (sheets without QR code or a damaged QR code).
+    """
+    return _decode_qr_code(gray, transform) or _ocr_sheet_code(gray, transform)
+
+
+def read_answer_sheet(gray, num_questions, num_options):
+    """
+    Extracts the marked answers and the sheet code from a grayscale image.
+
+    The sheet is aligned once (registration marks, or the frame as a
+    fallback) and only the answer region is warped to an upright image.
+    Bubbles are not searched for: their positions come from the same layout
+    used to print the sheet, and the fill ratio of every bubble is sampled
+    at once. Blank questions are reported as BLANK_MARK and questions with
+    more than one mark as MULTIPLE_MARK.
+
+    Args:
+        gray: Grayscale image as a 2D NumPy array
+        num_questions: Number of questions on the answer sheet
+        num_options: Number of options per question (e.g., 4 for A,B,C,D)
+
+    Returns:
+        dict: {'answers': {'1': 'A', ...}, 'sheet_code': str or None,
+               'confidence': float between 0 and 1}
+    """
+    transform = sheet_transform(gray)
+
+    region = layout.answer_region(num_questions, num_options)
+    answers_image = warp_region(gray, transform, region, ANSWER_PIXELS_PER_POINT)
+
+    centers = layout.bubble_centers(num_questions, num_options)
+    centers_px = np.stack([
+        (centers[..., 0] - region[0]) * ANSWER_PIXELS_PER_POINT,
+        (region[3] - centers[..., 1]) * ANSWER_PIXELS_PER_POINT,
+    ], axis=-1)
+    radius_px = layout.CIRCLE_RADIUS * SAMPLE_RADIUS_RATIO * ANSWER_PIXELS_PER_POINT
+
+    _, ink = cv2.threshold(answers_image, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    fills = sample_fill_ratios(ink, centers_px, radius_px)
+
+    marked = fills >= FILL_THRESHOLD
+    marks_per_question = marked.sum(axis=1)
+    chosen = fills.argmax(axis=1)
+    letters = layout.option_letters(num_options)
+
+    answers = {}
+    for index in range(num_questions):
+        if marks_per_question[index] == 0:
+            answers[str(index + 1)] = BLANK_MARK
+        elif marks_per_question[index] == 1:
+            answers[str(index + 1)] = letters[chosen[index]]
+        else:
+            answers[str(index + 1)] = MULTIPLE_MARK
+
+    sheet_code = _extract_sheet_code(gray, transform)
+
+    # Without a code the sheet cannot be matched, so confidence is zero;
+    # otherwise it is how far the fill ratios are from the threshold
+    if sheet_code and num_questions > 0:
+        clarity = np.abs(fills - FILL_THRESHOLD).min(axis=1) / CLEAR_MARGIN
+        confidence = float(np.clip(clarity, 0, 1).mean())
+    else:
+        confidence = 0.0
+
+    return {'answers': answers, 'sheet_code': sheet_code, 'confidence': confidence}
+
+
 def process_answer_sheet_image(image_path, num_questions, num_options):
     """
     Processes an answer sheet image and extracts the marked answers.
@@ -59,81 +391,9 @@ def process_answer_sheet_image(image_path, num_questions, num_options):
     
     # Convert to grayscale
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Apply threshold to binarize the image
-    _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
-    
-    # Detect contours (filled circles)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Filter circular contours (marked bubbles)
-    detected_circles = []
-    for contour in contours:
-        # Calculate area and perimeter
-        area = cv2.contourArea(contour)
-        perimeter = cv2.arcLength(contour, True)
-        
-        # Check if it's approximately circular
-        if perimeter > 0:
-            circularity = 4 * np.pi * (area / (perimeter * perimeter))
-            
-            # If circular and has adequate size
-            if circularity > 0.7 and 50 < area < 500:
-                # Get the center of the circle
-                M = cv2.moments(contour)
-                if M["m00"] != 0:
-                    cX = int(M["m10"] / M["m00"])
-                    cY = int(M["m01"] / M["m00"])
-                    detected_circles.append((cX, cY, area))
-    
-    # Sort circles by position (top to bottom, left to right)
-    detected_circles.sort(key=lambda x: (x[1], x[0]))
-    
-    # Group circles by row (question)
-    answers = {}
-    option_letters = [chr(65 + i) for i in range(num_options)]  # A, B, C, D...
-    
-    # Simplification: assume circles are organized in rows
-    # Each row has num_options circles
-    for i in range(0, min(len(detected_circles), num_questions * num_options), num_options):
-        question_num = (i // num_options) + 1
-        row_circles = detected_circles[i:i+num_options]
-        
-        # Check which circle is most filled (marked)
-        max_fill = 0
-        marked_option = None
-        
-        for idx, (cX, cY, area) in enumerate(row_circles):
-            # Extract circle region
-            roi = thresh[max(0, cY-10):cY+10, max(0, cX-10):cX+10]
-            if roi.size > 0:
-                fill = np.sum(roi) / 255
-                if fill > max_fill:
-                    max_fill = fill
-                    marked_option = option_letters[idx] if idx < len(option_letters) else None
-        
-        if marked_option:
-            answers[str(question_num)] = marked_option
-    
-    # Try to extract the sheet code using OCR
-    sheet_code = None
-    try:
-        # Extract the upper region of the image where the code usually is
-        roi_code = gray[0:150, 0:image.shape[1]]
-        extracted_text = pytesseract.image_to_string(roi_code)
-        
-        # Look for "CODE:" or "CÓDIGO:" in the text
-        for line in extracted_text.split('\n'):
-            if 'CODE' in line.upper() or 'CÓDIGO' in line.upper():
-                # Extract the code (assume it's 12 alphanumeric characters)
-                parts = line.split(':')
-                if len(parts) > 1:
-                    sheet_code = parts[1].strip().replace(' ', '')[:12]
-                    break
-    except Exception as e:
-        print(f"Error extracting code: {e}")
-    
-    return answers, sheet_code
+
+    result = read_answer_sheet(gray, num_questions, num_options)
+    return result['answers'], result['sheet_code']
 
 
 def process_advanced_answer_sheet(image_path, num_questions, num_options):
@@ -141,8 +401,8 @@ def process_advanced_answer_sheet(image_path, num_questions, num_options):
     Advanced version of answer sheet processing.
     Uses more robust computer vision techniques.
     
-    This is a basic implementation that can be improved with:
-    - Edge detection and automatic alignment
+    Alignment with the registration marks is already part of
+    process_answer_sheet_image. This can still be improved with:
     - Machine Learning for mark detection
     - Batch processing of multiple answer sheets
     - Image quality validation
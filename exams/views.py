@@ -1,77 +1,210 @@
-import base64
-import io
+import json
+import tempfile
 
 import requests
-from PIL import Image as PilImage
-from openai import OpenAI
-from pdf2image import convert_from_bytes
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import FileResponse, StreamingHttpResponse
 from rest_framework import viewsets, filters
 from django_filters.rest_framework import DjangoFilterBackend
 
-from config import settings
-from .models import Exam, CorrectAnswerSheet, StudentAnswerSheet
+from django.conf import settings
+from .pagination import ExamCursorPagination, StudentAnswerSheetCursorPagination
+from .models import Exam, CorrectAnswerSheet, StudentAnswerSheet, Job
 from .serializers import (
     ExamSerializer,
     CorrectAnswerSheetSerializer,
     StudentAnswerSheetSerializer,
-    StudentAnswerSheetUploadSerializer
+    StudentAnswerSheetUploadSerializer,
+    JobSerializer
+)
+from .utils.job_runner import enqueue_job
+from .utils.recognition_cache import cache_key, cache_stats, get_cached_result, store_result
+from .utils.recognition import (
+    BACKEND_LLM,
+    encode_for_llm,
+    needs_llm,
+    recognize_answer_sheet,
+    recognize_locally,
+    recognize_with_llm_concurrently,
 )
+from .utils.scan_pages import iter_uploaded_pages
 
-import json
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+def _is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _store_recognition(result, sheet_image=None):
+    """
+    Grava as respostas reconhecidas no gabarito com o código lido e calcula
+    o resultado. Retorna None se o código não corresponde a nenhum gabarito.
+    """
+    answer_sheet = StudentAnswerSheet.objects.filter(sheet_code=result.get("sheet_code")).first()
+    if not answer_sheet:
+        return None
+
+    answer_sheet.student_answers = result.get("answers", {})
+    if sheet_image is not None:
+        answer_sheet.sheet_image = sheet_image
+    answer_sheet.save()
+
+    # Calcula o resultado do exame
+    answer_sheet.calculate_result()
+    return answer_sheet
+
+
+def _recognition_summary(answer_sheet, result):
+    """Campos de resposta comuns ao envio individual e em lote."""
+    return {
+        "backend": result["backend"],
+        "confidence": result["confidence"],
+        "sheet_code": answer_sheet.sheet_code,
+        "detected_answers": answer_sheet.student_answers,
+        "correct_items": answer_sheet.correct_items,
+        "incorrect_items": answer_sheet.incorrect_items,
+        "accuracy_percentage": float(answer_sheet.accuracy_percentage),
+    }
+
+
+def _job_accepted_response(job, request):
+    """Resposta padrão para tarefas enviadas à fila."""
+    return Response(
+        JobSerializer(job, context={'request': request}).data,
+        status=status.HTTP_202_ACCEPTED
+    )
 
 
 class ExamViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing exams.
     """
-    queryset = Exam.objects.all()
+    # The key is joined for answers_correct_sheet_id, without its answers JSON
+    queryset = Exam.objects.select_related('correct_answer_sheet').defer('correct_answer_sheet__answers')
     serializer_class = ExamSerializer
+    pagination_class = ExamCursorPagination
 
     @action(detail=True, methods=['post'])
     def generate_answer_sheets_pdf(self, request, pk=None):
         """
         Endpoint to generate PDF with blank answer sheets for students.
+
+        With `async=true` the PDF is generated by a background worker and
+        the job is returned for polling at /api/jobs/{id}/. Synchronous
+        requests are limited to PDF_SYNC_MAX_SHEETS sheets, since the whole
+        document stays in memory until it is written.
         """
         from .utils.pdf_generator import generate_answer_sheet_pdf
 
         exam = self.get_object()
         quantity = int(request.data.get('quantity', 1))
 
-        # Generate the PDF
-        pdf_buffer, generated_codes = generate_answer_sheet_pdf(exam, quantity)
+        if _is_true(request.data.get('async', False)):
+            job = enqueue_job(Job.KIND_ANSWER_SHEETS_PDF, exam, {'quantity': quantity}, total=quantity)
+            return _job_accepted_response(job, request)
+
+        if quantity > settings.PDF_SYNC_MAX_SHEETS:
+            return Response(
+                {'error': f'At most {settings.PDF_SYNC_MAX_SHEETS} sheets per synchronous request; '
+                          f'use async=true for larger print runs.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Generate the PDF into a temporary file so large print runs
+        # are not held in memory twice
+        pdf_file = tempfile.SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_MEMORY)
+        generate_answer_sheet_pdf(exam, quantity, output=pdf_file)
+        pdf_file.seek(0)
+
+        # Stream the PDF back in chunks; the file is closed when the response ends
+        return FileResponse(
+            pdf_file,
+            as_attachment=True,
+            filename=f"answer_sheets_{exam.subject_name}.pdf",
+            content_type='application/pdf',
+        )
+
+
+    @action(detail=True, methods=['get'])
+    def layout(self, request, pk=None):
+        """
+        Returns the machine-readable layout (bubble positions in points)
+        of the answer sheets printed for this exam.
+        """
+        from .utils.sheet_layout import build_sheet_layout
+
+        exam = self.get_object()
+        return Response(build_sheet_layout(exam.num_questions, exam.num_options))
+
+
+    @action(detail=True, methods=['get'])
+    def statistics(self, request, pk=None):
+        """
+        Returns the item analysis of the exam: difficulty and point-biserial
+        discrimination per question, option distribution, score histogram
+        and KR-20 reliability. Cached until a sheet or the key changes.
+        """
+        from .utils.item_analysis import exam_statistics
 
-        # Return the PDF as response
-        response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="answer_sheets_{exam.subject_name}.pdf"'
-        return response
+        exam = self.get_object()
+        try:
+            statistics = exam_statistics(exam)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if statistics is None:
+            return Response(
+                {'error': 'The exam has no correct answer sheet.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(statistics)
 
 
 class CorrectAnswerSheetViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing correct answer sheets.
     """
-    queryset = CorrectAnswerSheet.objects.all()
+    queryset = CorrectAnswerSheet.objects.select_related('exam')
     serializer_class = CorrectAnswerSheetSerializer
 
 
 class StudentAnswerSheetViewSet(viewsets.ModelViewSet):
-    queryset = StudentAnswerSheet.objects.all()
+    # exam_subject comes from the join; answer_codes is never serialized
+    queryset = StudentAnswerSheet.objects.select_related('exam').defer('answer_codes')
     serializer_class = StudentAnswerSheetSerializer
+    pagination_class = StudentAnswerSheetCursorPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter, filters.SearchFilter]
     filterset_fields = ['exam']
+    # Only submitted_at and id may drive the cursor; other fields repeat too much
+    ordering_fields = ['submitted_at', 'id']
     search_fields = ['sheet_code']
 
+    def get_queryset(self):
+        """
+        Skips loading the answers JSON when `fields=`/`compact` leaves it out.
+        """
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            omitted = StudentAnswerSheetSerializer.omitted_fields(self.request)
+            if 'student_answers' in omitted:
+                queryset = queryset.defer('student_answers')
+        return queryset
+
+    def perform_destroy(self, instance):
+        from .utils.item_analysis import invalidate_exam_statistics
+
+        # Sheets have no post_delete receiver, so cascades stay one DELETE
+        exam_id = instance.exam_id
+        instance.delete()
+        transaction.on_commit(lambda: invalidate_exam_statistics(exam_id))
+
     @action(detail=False, methods=['post'])
     def upload_answer_sheet(self, request):
         """
         Processa um arquivo de imagem enviado diretamente,
-        sem usar serializer, e envia para a IA interpretar.
+        sem usar serializer, e lê as respostas com o backend configurado
+        (OMR local, com a IA como alternativa quando a confiança é baixa).
         """
         file = request.FILES.get('sheet_image')
         exam_id = request.data.get('exam')
@@ -82,106 +215,145 @@ class StudentAnswerSheetViewSet(viewsets.ModelViewSet):
             return Response({"error": "O campo 'exam' é obrigatório."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            file_bytes = file.read()
+            exam = Exam.objects.get(pk=exam_id)
+        except (Exam.DoesNotExist, ValueError):
+            return Response({"error": "Prova não encontrada."}, status=status.HTTP_404_NOT_FOUND)
 
-            # Detecta tipo (PDF ou imagem)
-            content_type = getattr(file, 'content_type', '').lower()
+        try:
+            # Reenvios do mesmo arquivo para o mesmo layout vêm do cache
+            key = cache_key(file.read(), exam)
+            file.seek(0)
+            result = get_cached_result(key)
+            cached = result is not None
 
-            if "pdf" in content_type or file.name.lower().endswith(".pdf"):
-                # Converte primeira página do PDF em imagem
-                images = convert_from_bytes(file_bytes)
-                if not images:
-                    raise ValueError("PDF sem páginas.")
-                image = images[0].convert("RGB")
-            else:
-                # Abre imagem comum (jpg, png, etc.)
-                image = PilImage.open(io.BytesIO(file_bytes)).convert("RGB")
-
-            # Converte para base64
-            buffer = io.BytesIO()
-            image.save(buffer, format="JPEG")
-            buffer.seek(0)
-            image_b64 = base64.b64encode(buffer.read()).decode("utf-8")
-
-            # Envia para o modelo GPT-4o
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                response_format={"type": "json_object"},
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Você é um sistema especialista em leitura automática de gabaritos de provas. "
-                            "Analise a imagem e retorne as respostas no formato JSON puro."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "Analise a imagem de um gabarito de prova e identifique "
-                                    "quais alternativas (A, B, C, D, E) estão marcadas. "
-                                    "Se alguma estiver em branco, use ''. "
-                                    "Retorne exatamente neste formato:\n\n"
-                                    "{ \"sheet_code\": \"CÓDIGO\", \"answers\": { \"1\": \"A\", \"2\": \"B\", ... } }"
-                                )
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}
-                            }
-                        ]
-                    },
-                ],
-                temperature=0,
-            )
+            if not cached:
+                # Só a primeira página de um PDF é convertida em imagem
+                _, image = next(iter_uploaded_pages(file, settings.OMR_RASTER_DPI))
 
-            result_text = response.choices[0].message.content
-            try:
-                result = json.loads(result_text)
-            except json.JSONDecodeError:
-                return Response({
-                    "error": "Falha ao interpretar a resposta da IA.",
-                    "raw_response": result_text
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                # Lê o gabarito com o backend configurado (OMR local ou IA)
+                result = recognize_answer_sheet(image, exam)
 
             # Salva o resultado no banco
-            answer_sheet = StudentAnswerSheet.objects.filter(sheet_code=result.get("sheet_code")).first()
+            answer_sheet = _store_recognition(result, request.data.get('sheet_image'))
             if not answer_sheet:
                 return Response(
                     {"error": "Código do gabarito não reconhecido.", "sheet_code": result.get("sheet_code")},
                     status=status.HTTP_400_BAD_REQUEST)
 
-            answer_sheet.sheet_code = result.get("sheet_code")
-            answer_sheet.student_answers = result.get("answers", {})
-            answer_sheet.sheet_image = request.data.get('sheet_image')
-            answer_sheet.save()
-
-            # Calcula o resultado do exame
-            answer_sheet.calculate_result()
+            # Só leituras cujo código corresponde a um gabarito vão para o
+            # cache: uma leitura falha pode dar certo no próximo envio
+            if not cached:
+                store_result(key, result)
 
             return Response({
-                "message": "Gabarito processado com sucesso pela IA.",
-                "sheet_code": answer_sheet.sheet_code,
-                "detected_answers": answer_sheet.student_answers,
-                "correct_items": answer_sheet.correct_items,
-                "incorrect_items": answer_sheet.incorrect_items,
-                "accuracy_percentage": float(answer_sheet.accuracy_percentage),
+                "message": "Gabarito processado com sucesso.",
+                "cached": cached,
+                **_recognition_summary(answer_sheet, result),
             }, status=status.HTTP_201_CREATED)
 
         except Exception as e:
             return Response({
-                "error": f"Erro ao processar imagem com IA: {str(e)}"
+                "error": f"Erro ao processar imagem: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def recognition_cache(self, request):
+        """
+        Retorna os contadores de acertos e falhas do cache de reconhecimento.
+        """
+        return Response(cache_stats())
+
+    @action(detail=False, methods=['post'])
+    def upload_answer_sheets_batch(self, request):
+        """
+        Processa um PDF digitalizado com vários gabaritos (um por página).
+
+        As páginas são convertidas em imagem uma a uma, lidas, corrigidas e
+        o resultado de cada página é enviado assim que fica pronto, como
+        NDJSON (um objeto JSON por linha).
+        """
+        file = request.FILES.get('sheets_file')
+        exam_id = request.data.get('exam')
+
+        if not file:
+            return Response({"error": "Nenhum arquivo enviado."}, status=status.HTTP_400_BAD_REQUEST)
+        if not exam_id:
+            return Response({"error": "O campo 'exam' é obrigatório."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            exam = Exam.objects.get(pk=exam_id)
+        except (Exam.DoesNotExist, ValueError):
+            return Response({"error": "Prova não encontrada."}, status=status.HTTP_404_NOT_FOUND)
+
+        def page_line(page_number, result):
+            line = {"page": page_number}
+            answer_sheet = _store_recognition(result)
+            if answer_sheet:
+                line.update(_recognition_summary(answer_sheet, result))
+            else:
+                line.update({
+                    "error": "Código do gabarito não reconhecido.",
+                    "sheet_code": result.get("sheet_code"),
+                })
+            return json.dumps(line, ensure_ascii=False) + "\n"
+
+        def error_line(page_number, message):
+            return json.dumps({"page": page_number, "error": message}, ensure_ascii=False) + "\n"
+
+        def flush_llm_pages(deferred):
+            # Páginas que precisam do LLM são enviadas juntas, em paralelo
+            results = recognize_with_llm_concurrently([image_b64 for _, image_b64 in deferred])
+            for (page_number, _), result in zip(deferred, results):
+                if isinstance(result, Exception):
+                    yield error_line(page_number, f"Erro ao processar página: {str(result)}")
+                    continue
+                try:
+                    yield page_line(page_number, result)
+                except Exception as e:
+                    yield error_line(page_number, f"Erro ao processar página: {str(e)}")
+
+        def process_pages():
+            pages = iter_uploaded_pages(file, settings.OMR_RASTER_DPI, settings.OMR_PAGE_WORKERS)
+            use_llm_only = settings.ANSWER_SHEET_RECOGNITION_BACKEND == BACKEND_LLM
+            deferred = []
+            page_number = 0
+            try:
+                for page_number, image in pages:
+                    try:
+                        result = None if use_llm_only else recognize_locally(image, exam)
+                        if result is None or needs_llm(result):
+                            deferred.append((page_number, encode_for_llm(image)))
+                        else:
+                            yield page_line(page_number, result)
+                    except Exception as e:
+                        yield error_line(page_number, f"Erro ao processar página: {str(e)}")
+
+                    if len(deferred) >= settings.LLM_BATCH_SIZE:
+                        yield from flush_llm_pages(deferred)
+                        deferred = []
+            except Exception as e:
+                # Falha ao abrir ou converter o arquivo
+                yield error_line(page_number + 1, f"Erro ao ler arquivo: {str(e)}")
+
+            if deferred:
+                yield from flush_llm_pages(deferred)
+
+        return StreamingHttpResponse(process_pages(), content_type='application/x-ndjson')
+
     @action(detail=False, methods=['get'])
     def export_results(self, request):
         """
         Endpoint to export results to Excel.
+
+        With `async=true` the file is generated by a background worker and
+        the job is returned for polling at /api/jobs/{id}/. With
+        `file_type=csv` the results are streamed as CSV instead.
         """
-        from .utils.excel_exporter import export_detailed_results_to_excel, export_results_to_excel
+        from .utils.excel_exporter import (
+            export_detailed_results_to_excel,
+            export_results_to_excel,
+            iter_results_csv,
+        )
 
         exam_id = request.query_params.get('exam_id')
         detailed = request.query_params.get('detailed', 'true').lower() == 'true'
@@ -200,16 +372,58 @@ class StudentAnswerSheetViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Generate the Excel file
+        if _is_true(request.query_params.get('async', False)):
+            job = enqueue_job(Job.KIND_RESULTS_EXCEL, exam, {'detailed': detailed})
+            return _job_accepted_response(job, request)
+
+        if request.query_params.get('file_type') == 'csv':
+            # CSV fast path: rows go straight from the database to the client
+            response = StreamingHttpResponse(
+                iter_results_csv(exam, detailed),
+                content_type='text/csv; charset=utf-8'
+            )
+            response['Content-Disposition'] = f'attachment; filename="results_{exam.subject_name}.csv"'
+            return response
+
+        # Generate the Excel file into a temporary file (spilled to disk when
+        # large) and stream it back in chunks
+        excel_file = tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_MEMORY)
         if detailed:
-            excel_buffer = export_detailed_results_to_excel(exam)
+            export_detailed_results_to_excel(exam, output=excel_file)
         else:
-            excel_buffer = export_results_to_excel(exam)
+            export_results_to_excel(exam, output=excel_file)
 
-        # Return the Excel as response
-        response = HttpResponse(
-            excel_buffer.getvalue(),
+        return FileResponse(
+            excel_file,
+            as_attachment=True,
+            filename=f"results_{exam.subject_name}.xlsx",
             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         )
-        response['Content-Disposition'] = f'attachment; filename="results_{exam.subject_name}.xlsx"'
-        return response
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for polling background jobs and downloading their results.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['exam', 'kind', 'status']
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Streams the file produced by a finished job.
+        """
+        job = self.get_object()
+        if job.status != Job.STATUS_DONE or not job.result_file:
+            return Response(
+                {'error': 'The job has not finished yet.', 'status': job.status},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        return FileResponse(
+            job.result_file.open('rb'),
+            as_attachment=True,
+            filename=job.result_file.name.rsplit('/', 1)[-1],
+        )
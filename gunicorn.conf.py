@@ -0,0 +1,91 @@
+"""
+Gunicorn configuration for production.
+
+    gunicorn config.wsgi:application -c gunicorn.conf.py
+
+GUNICORN_PROFILE picks the worker model for the traffic a deployment serves:
+
+    cpu    sync workers, one per core: local OMR, PDF rendering, exports.
+    io     threaded workers with many threads: LLM recognition, whose time is
+           spent waiting on the API, and batch uploads streaming results.
+    mixed  (default) threaded workers with a few threads, for a single
+           instance serving everything.
+
+To isolate the two kinds of load, run one instance per profile and route
+the upload endpoints that use the LLM to the `io` one.
+"""
+import math
+import os
+
+
+def available_cpus():
+    """
+    CPUs this container may actually use: the affinity mask, capped by the
+    cgroup CPU quota. os.cpu_count() reports every core of the host.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2 ("max 100000" or "200000 100000"), then cgroup v1
+    quota_files = [
+        ('/sys/fs/cgroup/cpu.max', None),
+        ('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '/sys/fs/cgroup/cpu/cpu.cfs_period_us'),
+    ]
+    for quota_path, period_path in quota_files:
+        try:
+            with open(quota_path) as f:
+                values = f.read().split()
+            if period_path is not None:
+                with open(period_path) as f:
+                    values.append(f.read().strip())
+        except OSError:
+            continue
+        if values[0] not in ('max', '-1'):
+            cpus = min(cpus, max(1, math.ceil(int(values[0]) / int(values[1]))))
+        break
+    return cpus
+
+
+cpus = available_cpus()
+
+PROFILES = {
+    # workers, threads, timeout (s)
+    'cpu': (cpus, 1, 120),
+    'io': (max(2, cpus // 2), 16, 300),
+    'mixed': (cpus + 1, 4, 180),
+}
+
+profile = os.environ.get('GUNICORN_PROFILE', 'mixed')
+if profile not in PROFILES:
+    raise SystemExit(
+        f"GUNICORN_PROFILE={profile!r} is not a known profile; use one of: {', '.join(PROFILES)}"
+    )
+default_workers, default_threads, default_timeout = PROFILES[profile]
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', default_workers))
+threads = int(os.environ.get('GUNICORN_THREADS', default_threads))
+worker_class = 'sync' if threads == 1 else 'gthread'
+
+# Slow endpoints (batch PDF upload, LLM retries) need a long timeout; large
+# print runs and exports should use the async job API instead
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', default_timeout))
+graceful_timeout = 30
+keepalive = 5
+
+# Load Django once in the master and fork: faster boot and shared memory
+preload_app = True
+
+# Recycle workers periodically so memory held by large images, PDFs and
+# workbooks is given back; the jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Heartbeat files in memory instead of the container's overlay filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
@@ -0,0 +1,257 @@
+"""
+Load test of the application server with local stubs for the LLM and the
+storage, so it runs without network access or credentials.
+
+    python scripts/load_test.py --profile mixed --backend llm --concurrency 16
+
+The script:
+
+1. starts an OpenAI-compatible stub (POST /v1/chat/completions) that waits
+   --llm-latency seconds and answers with the code of a seeded sheet;
+2. creates a temporary SQLite database and media directory
+   (LOCAL_MEDIA_ROOT replaces the R2 storage);
+3. starts gunicorn with gunicorn.conf.py and the chosen GUNICORN_PROFILE;
+4. seeds an exam, its answer key and --sheets blank sheets through the API;
+5. sends --requests requests with --concurrency client threads and prints
+   throughput and latency percentiles per endpoint.
+
+The scan uploaded by the `upload` endpoint is rendered from a seeded sheet
+with pdf2image (poppler); pass --scan to use an existing image instead.
+The recognition cache is disabled, so every upload is read again.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+SCENARIOS = {
+    # endpoint: weight
+    'upload': {'upload': 1},
+    'read': {'sheets': 3, 'statistics': 1, 'exams': 1},
+    'mixed': {'upload': 2, 'sheets': 3, 'statistics': 1, 'exams': 1},
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LLMStub(ThreadingHTTPServer):
+    """OpenAI-compatible chat completions endpoint with a fixed latency."""
+
+    daemon_threads = True
+
+    def __init__(self, port, latency, num_questions):
+        super().__init__(('127.0.0.1', port), _LLMStubHandler)
+        self.latency = latency
+        self.num_questions = num_questions
+        self.codes = itertools.cycle([None])
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def next_code(self):
+        with self.lock:
+            self.calls += 1
+            return next(self.codes)
+
+
+class _LLMStubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        answers = {str(q): random.choice('ABCD') for q in range(1, self.server.num_questions + 1)}
+        content = json.dumps({'sheet_code': self.server.next_code(), 'answers': answers})
+        body = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'stub',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _render_scan(subject_name, num_questions, num_options, code, dpi):
+    """Renders one printed sheet as a PNG scan."""
+    from pdf2image import convert_from_bytes
+
+    from exams.utils.pdf_generator import render_answer_sheets
+
+    pdf = io.BytesIO()
+    render_answer_sheets(pdf, subject_name, num_questions, num_options, [code])
+    page = convert_from_bytes(pdf.getvalue(), dpi=dpi, first_page=1, last_page=1, grayscale=True)[0]
+    sheet = page.crop((0, 0, page.width // 2, page.height))
+    buffer = io.BytesIO()
+    sheet.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _wait_for_server(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("The server exited during startup.")
+        try:
+            requests.get(url, timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit("The server did not start in time.")
+
+
+def _seed(api, num_questions, num_options, quantity):
+    exam = requests.post(f"{api}/exams/", json={
+        'subject_name': 'Load test', 'num_questions': num_questions, 'num_options': num_options,
+    }).json()
+    letters = [chr(65 + index) for index in range(num_options)]
+    requests.post(f"{api}/correct-answer-sheets/", json={
+        'exam': exam['id'],
+        'answers': {str(q): random.choice(letters) for q in range(1, num_questions + 1)},
+    }).raise_for_status()
+    requests.post(
+        f"{api}/exams/{exam['id']}/generate_answer_sheets_pdf/", data={'quantity': quantity}
+    ).raise_for_status()
+    sheets = requests.get(f"{api}/student-answer-sheets/", params={
+        'exam': exam['id'], 'fields': 'sheet_code', 'page_size': quantity,
+    }).json()
+    return exam, [sheet['sheet_code'] for sheet in sheets['results']]
+
+
+def _percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', default='mixed', help="GUNICORN_PROFILE (cpu, io, mixed).")
+    parser.add_argument('--backend', default='llm', choices=['llm', 'local_omr'],
+                        help="ANSWER_SHEET_RECOGNITION_BACKEND of the server.")
+    parser.add_argument('--scenario', default='mixed', choices=sorted(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--llm-latency', type=float, default=1.0, help="Seconds per stub LLM call.")
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--options', type=int, default=4)
+    parser.add_argument('--sheets', type=int, default=200, help="Sheets seeded for the exam.")
+    parser.add_argument('--scan', help="Image uploaded by the upload endpoint (default: rendered).")
+    parser.add_argument('--server', default='gunicorn config.wsgi:application -c gunicorn.conf.py',
+                        help="Server command line, run from the repository root.")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='load-test-'))
+    port = _free_port()
+    stub = LLMStub(_free_port(), args.llm_latency, args.questions)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    env = {
+        **os.environ,
+        'DATABASE_URL': f"sqlite:///{workdir / 'db.sqlite3'}",
+        'LOCAL_MEDIA_ROOT': str(workdir / 'media'),
+        'OPENAI_API_KEY': 'stub',
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{stub.server_address[1]}/v1",
+        'ANSWER_SHEET_RECOGNITION_BACKEND': args.backend,
+        'RECOGNITION_CACHE_ENABLED': 'False',
+        'GUNICORN_PROFILE': args.profile,
+        'PORT': str(port),
+        'GUNICORN_LOG_LEVEL': 'warning',
+    }
+    manage = [sys.executable, 'manage.py']
+    subprocess.run([*manage, 'migrate', '-v0'], cwd=BASE_DIR, env=env, check=True)
+    subprocess.run([*manage, 'createcachetable'], cwd=BASE_DIR, env=env, check=True)
+
+    server = subprocess.Popen(shlex.split(args.server), cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL)
+    api = f"http://127.0.0.1:{port}/api"
+    try:
+        _wait_for_server(f"{api}/exams/", server)
+        exam, codes = _seed(api, args.questions, args.options, args.sheets)
+        stub.codes = itertools.cycle(codes)
+
+        if args.scan:
+            scan = Path(args.scan).read_bytes()
+        else:
+            scan = _render_scan(exam['subject_name'], args.questions, args.options, codes[0], 200)
+
+        session = threading.local()
+
+        def call(endpoint):
+            if not hasattr(session, 'client'):
+                session.client = requests.Session()
+            client = session.client
+            started_at = time.perf_counter()
+            if endpoint == 'upload':
+                response = client.post(f"{api}/student-answer-sheets/upload_answer_sheet/", data={
+                    'exam': exam['id'],
+                }, files={'sheet_image': ('scan.png', scan, 'image/png')})
+            elif endpoint == 'sheets':
+                response = client.get(f"{api}/student-answer-sheets/", params={
+                    'exam': exam['id'], 'compact': 'true',
+                })
+            elif endpoint == 'statistics':
+                response = client.get(f"{api}/exams/{exam['id']}/statistics/")
+            else:
+                response = client.get(f"{api}/exams/")
+            return endpoint, response.status_code, time.perf_counter() - started_at
+
+        mix = SCENARIOS[args.scenario]
+        endpoints = random.choices(list(mix), weights=list(mix.values()), k=args.requests)
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(call, endpoints))
+        elapsed = time.perf_counter() - started_at
+    finally:
+        server.terminate()
+        server.wait()
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"profile={args.profile} backend={args.backend} scenario={args.scenario} "
+          f"concurrency={args.concurrency} llm_latency={args.llm_latency}s")
+    print(f"{len(results)} requests in {elapsed:.1f}s: {len(results) / elapsed:.1f} req/s, "
+          f"{stub.calls} LLM calls")
+    print(f"{'endpoint':>11} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for endpoint in mix:
+        latencies = [latency for name, _, latency in results if name == endpoint]
+        errors = sum(1 for name, code, _ in results if name == endpoint and code >= 400)
+        if not latencies:
+            continue
+        print(f"{endpoint:>11} {len(latencies):>6} {errors:>6} {_percentile(latencies, 0.5) * 1000:>8.0f} "
+              f"{_percentile(latencies, 0.95) * 1000:>8.0f} {max(latencies) * 1000:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()